@@ -0,0 +1,63 @@
+"""
+Перенос неактивных ссылок в архив (hot/cold).
+
+Ссылка неактивна, если её просмотры не менялись (по сохранённым снимкам) и она
+не создавалась дольше ARCHIVE_AFTER_DAYS. Раз в ARCHIVE_INTERVAL_SECONDS Archiver
+проходит links по возрастанию id окнами по ARCHIVE_SCAN строк: каждое окно —
+своя короткая транзакция, между окнами пауза ARCHIVE_PAUSE_SECONDS, а обращения к
+базе идут с фоновым приоритетом, так что нажатия пользователей не ждут архивацию.
+Проход заканчивается на первых ссылках новее порога. Архив открывается из списка
+(«🗄 Архив»), ищется через /find по запросу и возвращается кнопкой «Вернуть».
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_SCAN, ARCHIVE_PAUSE_SECONDS, ARCHIVE_INTERVAL_SECONDS
+from database import archive_inactive_links
+from ratelimit import priority, BULK
+
+logger = logging.getLogger(__name__)
+
+
+class Archiver:
+    def __init__(self, after_days: float = ARCHIVE_AFTER_DAYS):
+        self.after_days = after_days
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.after_days <= 0:
+            logger.info("Архивация ссылок выключена.")
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Архивация ссылок без переходов дольше {self.after_days:g} дн. включена.")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        priority.set(BULK)
+        while True:
+            try:
+                await self.run_pass()
+            except Exception as e:
+                logger.error(f"Ошибка архивации ссылок: {e}")
+            await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+    async def run_pass(self, now: Optional[datetime] = None) -> int:
+        """Один проход по links; возвращает число перенесённых ссылок."""
+        cutoff = ((now or datetime.now()) - timedelta(days=self.after_days)).isoformat()
+        total = 0
+        after_id: Optional[int] = 0
+        while after_id is not None:
+            moved, after_id = await archive_inactive_links(cutoff, after_id, ARCHIVE_SCAN)
+            total += moved
+            if after_id is not None:
+                await asyncio.sleep(ARCHIVE_PAUSE_SECONDS)
+        if total:
+            logger.info(f"В архив перенесено ссылок: {total}")
+        return total
@@ -0,0 +1,217 @@
+"""
+Резервные копии базы на ходу (SQLite online backup API).
+
+Копия снимается через отдельное соединение, которое держит одну читающую
+транзакцию: в режиме WAL пишущие обработчики её не ждут, а копия согласована на
+момент начала и не перезапускается от чужих записей. Страницы копируются по
+BACKUP_PAGES_PER_STEP с паузой BACKUP_STEP_PAUSE между шагами в потоке aiosqlite,
+поэтому цикл событий не блокируется, а база не занята подолгу. Затем копия
+проверяется PRAGMA integrity_check, сжимается gzip потоком блоками по
+BACKUP_CHUNK_BYTES (память не зависит от размера базы) и кладётся в BACKUP_DIR;
+хранятся BACKUP_KEEP последних копий.
+
+Восстановление — тем же API в обратную сторону: проверенная копия записывается в
+рабочую базу одним шагом под её блокировкой, открытые соединения видят новые
+данные. После восстановления из командной строки бота нужно перезапустить, чтобы
+сбросить кэши процесса.
+
+    python backup.py create
+    python backup.py verify backups/links-20260101-120000.db.gz
+    python backup.py restore backups/links-20260101-120000.db.gz
+"""
+import asyncio
+import glob
+import gzip
+import logging
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import aiosqlite
+
+import database
+from config import (
+    BACKUP_DIR,
+    BACKUP_INTERVAL_SECONDS,
+    BACKUP_KEEP,
+    BACKUP_PAGES_PER_STEP,
+    BACKUP_STEP_PAUSE,
+    BACKUP_CHUNK_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+backup_stats = {"created": 0, "failed": 0, "last_path": None, "last_seconds": 0.0, "last_size": 0}
+
+
+class BackupInfo(NamedTuple):
+    path: str
+    pages: int
+    size: int          # байт до сжатия
+    compressed: int    # байт в архиве
+    seconds: float
+
+
+def _compress(path: str, out: str) -> None:
+    with open(path, "rb") as src, gzip.open(out, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, BACKUP_CHUNK_BYTES)
+    with open(out, "rb") as f:
+        os.fsync(f.fileno())
+
+
+def _decompress(path: str, out: str) -> None:
+    # gzip проверяет CRC на чтении: повреждённый архив не распакуется молча
+    with gzip.open(path, "rb") as src, open(out, "wb") as dst:
+        shutil.copyfileobj(src, dst, BACKUP_CHUNK_BYTES)
+
+
+def _remove(path: str) -> None:
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+async def check_integrity(path: str) -> str:
+    """PRAGMA integrity_check несжатой базы: "ok" или первые найденные ошибки."""
+    async with aiosqlite.connect(path) as db:
+        async with db.execute("PRAGMA integrity_check(10)") as cursor:
+            rows = [row[0] for row in await cursor.fetchall()]
+    return "; ".join(rows)
+
+
+async def create_backup(directory: str = BACKUP_DIR, pages_per_step: int = BACKUP_PAGES_PER_STEP,
+                        pause: float = BACKUP_STEP_PAUSE) -> BackupInfo:
+    """Снимает, проверяет и сжимает копию рабочей базы; старые копии сверх BACKUP_KEEP удаляются."""
+    os.makedirs(directory, exist_ok=True)
+    started = time.monotonic()
+    name = f"links-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    raw = os.path.join(directory, name + ".db.tmp")
+    out = os.path.join(directory, name + ".db.gz")
+    progress = {"pages": 0}
+
+    def step(status: int, remaining: int, total: int) -> None:
+        # Вызывается в потоке соединения после каждого шага: пауза отдаёт базу пишущим
+        progress["pages"] = total
+        if remaining and pause:
+            time.sleep(pause)
+
+    try:
+        async with aiosqlite.connect(database.DB_PATH, isolation_level=None) as source, \
+                aiosqlite.connect(raw) as target:
+            # Читающая транзакция на всё время копии: один снимок, без перезапусков
+            await source.execute("BEGIN")
+            await source.execute_fetchall("SELECT COUNT(*) FROM sqlite_master")
+            await source.backup(target, pages=pages_per_step, progress=step)
+            await source.execute("COMMIT")
+            # Копия — самостоятельный файл без -wal
+            await target.execute("PRAGMA journal_mode=DELETE")
+        result = await check_integrity(raw)
+        if result != "ok":
+            raise RuntimeError(f"копия не прошла integrity_check: {result}")
+        size = os.path.getsize(raw)
+        await asyncio.to_thread(_compress, raw, out + ".part")
+        os.replace(out + ".part", out)
+    except Exception:
+        backup_stats["failed"] += 1
+        raise
+    finally:
+        _remove(raw)
+        _remove(out + ".part")
+    removed = rotate(directory)
+    info = BackupInfo(out, progress["pages"], size, os.path.getsize(out), time.monotonic() - started)
+    backup_stats.update(created=backup_stats["created"] + 1, last_path=out, last_seconds=info.seconds,
+                        last_size=info.compressed)
+    logger.info(f"Резервная копия {out}: {info.pages} страниц, {info.size} → {info.compressed} байт "
+                f"за {info.seconds:.1f} с; удалено старых: {removed}")
+    return info
+
+
+def rotate(directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> int:
+    """Удаляет копии сверх keep последних (имена сортируются по времени создания)."""
+    backups = sorted(glob.glob(os.path.join(directory, "links-*.db.gz")))
+    stale = backups[:-keep] if keep > 0 else []
+    for path in stale:
+        os.remove(path)
+    return len(stale)
+
+
+async def verify_backup(path: str) -> str:
+    """Распаковывает копию во временный файл и проверяет её; "ok" или описание ошибки."""
+    raw = path + ".verify"
+    try:
+        await asyncio.to_thread(_decompress, path, raw)
+        return await check_integrity(raw)
+    except (OSError, EOFError, aiosqlite.DatabaseError) as e:
+        return f"копия повреждена: {e}"
+    finally:
+        _remove(raw)
+
+
+async def restore_backup(path: str) -> int:
+    """
+    Записывает проверенную копию в рабочую базу через backup API (одним шагом,
+    под блокировкой базы) и сбрасывает кэш ссылок процесса. Возвращает число страниц.
+    """
+    raw = path + ".restore"
+    try:
+        await asyncio.to_thread(_decompress, path, raw)
+        result = await check_integrity(raw)
+        if result != "ok":
+            raise RuntimeError(f"копия не прошла integrity_check: {result}")
+        async with aiosqlite.connect(raw) as source, aiosqlite.connect(database.DB_PATH) as target:
+            pages = (await source.execute_fetchall("PRAGMA page_count"))[0][0]
+            await source.backup(target)
+    finally:
+        _remove(raw)
+    database.link_cache.clear()
+    logger.info(f"База восстановлена из {path}: {pages} страниц")
+    return pages
+
+
+class BackupScheduler:
+    """Раз в BACKUP_INTERVAL_SECONDS снимает резервную копию; 0 — выключено."""
+    def __init__(self, interval: float = BACKUP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        if self.interval <= 0:
+            logger.info("Резервное копирование по расписанию выключено.")
+            return
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Резервные копии раз в {self.interval / 3600:g} ч в {BACKUP_DIR}.")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await create_backup()
+            except Exception as e:
+                logger.error(f"Ошибка резервного копирования: {e}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    command, args = sys.argv[1:2], sys.argv[2:]
+    if command == ["create"]:
+        print(asyncio.run(create_backup()).path)
+    elif command == ["verify"] and args:
+        result = asyncio.run(verify_backup(args[0]))
+        print(result)
+        sys.exit(0 if result == "ok" else 1)
+    elif command == ["restore"] and args:
+        print(f"Восстановлено страниц: {asyncio.run(restore_backup(args[0]))}")
+    else:
+        print(__doc__)
+        sys.exit(1)
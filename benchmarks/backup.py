@@ -0,0 +1,122 @@
+"""
+Задержка обращений к базе во время резервного копирования.
+
+На заполненной базе обработчики-подобные запросы (страница списка, карточка,
+сохранение и переименование ссылки) идут непрерывно, а параллельно снимается
+копия. Режимы: «без копии», «по шагам» (как в боте: BACKUP_PAGES_PER_STEP страниц
+с паузой) и «одним шагом» (вся база за один вызов backup). Печатает p50/p95/p99/max
+запросов, время и размер копии; код выхода 1, если p99 при копии по шагам
+больше чем втрое хуже, чем без копии.
+
+    python benchmarks/backup.py [--users 200] [--links 200] [--workers 8]
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "123:backup")
+
+import aiosqlite  # noqa: E402
+
+import backup  # noqa: E402
+import database  # noqa: E402
+from config import BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE  # noqa: E402
+
+MODES = (("без копии", None), ("по шагам", (BACKUP_PAGES_PER_STEP, BACKUP_STEP_PAUSE)), ("одним шагом", (-1, 0)))
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+
+async def prepare(args) -> None:
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), "links.db")
+    await database.init_db()
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        await db.executemany(
+            "INSERT INTO links (user_id, original_url, short_url, title, vk_key) VALUES (?, ?, ?, ?, ?)",
+            ((u, f"https://example.com/{u}/{i}?{'q' * 200}", f"https://vk.cc/u{u}x{i}", f"Ссылка {i}", f"u{u}x{i}")
+             for u in range(1, args.users + 1) for i in range(args.links))
+        )
+        await db.commit()
+
+
+async def worker(args, stop: asyncio.Event, latencies: list, rng: random.Random) -> None:
+    while not stop.is_set():
+        user_id = rng.randint(1, args.users)
+        link_id = (user_id - 1) * args.links + rng.randint(1, args.links)
+        action = rng.random()
+        started = time.perf_counter()
+        if action < 0.4:
+            await database.get_links_page(user_id, None, rng.randint(0, args.links // 5) * 5, 5)
+        elif action < 0.7:
+            await database.get_link_by_id(link_id, user_id)
+        elif action < 0.85:
+            n = rng.randrange(1 << 30)
+            await database.save_link(user_id, f"https://new.example.com/{n}", f"https://vk.cc/n{n}", None, f"n{n}")
+        else:
+            await database.rename_link(link_id, user_id, f"Имя {rng.randrange(1000)}")
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(args, mode) -> dict:
+    stop = asyncio.Event()
+    latencies = []
+    rng = random.Random(7)
+    workers = [asyncio.create_task(worker(args, stop, latencies, random.Random(rng.random())))
+               for _ in range(args.workers)]
+    info = None
+    directory = tempfile.mkdtemp()
+    await asyncio.sleep(0.5)
+    if mode is None:
+        await asyncio.sleep(args.duration)
+    else:
+        pages, pause = mode
+        info = await backup.create_backup(directory, pages, pause)
+    stop.set()
+    await asyncio.gather(*workers)
+    shutil.rmtree(directory)
+    return {
+        "requests": len(latencies),
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "max": max(latencies) * 1000,
+        "backup": info,
+    }
+
+
+async def main(args) -> int:
+    database.logger.setLevel("CRITICAL")
+    backup.logger.setLevel("CRITICAL")
+    await prepare(args)
+    size = os.path.getsize(database.DB_PATH)
+    print(f"База {size / 2 ** 20:.1f} МБ ({args.users * args.links} ссылок), обработчиков {args.workers}")
+    print(f"{'режим':<14}{'запросов':>10}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'max мс':>9}{'копия с':>9}{'архив МБ':>10}")
+    results = {}
+    for name, mode in MODES:
+        r = results[name] = await run(args, mode)
+        info = r["backup"]
+        tail = f"{info.seconds:>9.2f}{info.compressed / 2 ** 20:>10.2f}" if info else f"{'—':>9}{'—':>10}"
+        print(f"{name:<14}{r['requests']:>10}{r['p50']:>9.1f}{r['p95']:>9.1f}{r['p99']:>9.1f}{r['max']:>9.1f}{tail}")
+    if results["по шагам"]["p99"] > 3 * results["без копии"]["p99"]:
+        print("p99 запросов во время копии по шагам больше чем втрое хуже, чем без копии")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--links", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=3.0, help="длительность прогона без копии")
+    sys.exit(asyncio.run(main(parser.parse_args())))
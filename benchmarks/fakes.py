@@ -0,0 +1,166 @@
+"""
+Локальные заглушки Bot API и VK API для офлайн-замеров.
+
+FakeBotAPI отвечает на любые методы Bot API (getUpdates отдаёт один /start,
+sendMessage/editMessageText возвращают сообщение), FakeVKAPI — на методы VK,
+которые вызывает vkcc.py. Оба считают вызовы по методам и могут добавлять
+искусственную задержку.
+"""
+import asyncio
+import hashlib
+import re
+import time
+from collections import Counter
+from typing import Optional, Tuple
+
+from aiohttp import web
+
+CHAT_ID = 1000
+
+
+async def serve(app: web.Application) -> Tuple[web.AppRunner, str]:
+    """Запускает приложение на свободном порту 127.0.0.1, возвращает (runner, базовый URL)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+class FakeBotAPI:
+    """Минимальный Bot API: getUpdates отдаёт один /start, sendMessage фиксирует ответ."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.update_sent = False
+        self.answered = asyncio.Event()
+        self._message_id = 1000
+        self.uploaded_bytes = 0
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        data = await request.post()
+        if self.latency and method != "getUpdates":
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            result = {"id": 123, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            result = []
+            if not self.update_sent:
+                self.update_sent = True
+                result = [self.start_update()]
+            else:
+                await asyncio.sleep(0.2)
+        elif method in ("sendMessage", "editMessageText", "sendDocument"):
+            self._message_id += 1
+            result = {
+                "message_id": int(data.get("message_id", self._message_id)), "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id", CHAT_ID)), "type": "private"},
+                "text": data.get("text", ""),
+            }
+            self.answered.set()
+        elif method == "sendPhoto":
+            self._message_id += 1
+            photo = data.get("photo")
+            if photo.startswith("attach://"):
+                # aiogram загружает файл отдельной частью multipart, в поле — ссылка на неё
+                size = len(data[photo[len("attach://"):]].file.read())
+                self.uploaded_bytes += size
+                file_id = f"photo{self._message_id}"
+            else:
+                size, file_id = 0, photo
+            result = {
+                "message_id": self._message_id, "date": int(time.time()),
+                "chat": {"id": int(data.get("chat_id", CHAT_ID)), "type": "private"},
+                "photo": [{"file_id": file_id, "file_unique_id": file_id, "width": 330, "height": 330,
+                           "file_size": size}],
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def start_update() -> dict:
+        user = {"id": CHAT_ID, "is_bot": False, "first_name": "Bench"}
+        return {
+            "update_id": 1,
+            "message": {
+                "message_id": 1, "date": int(time.time()),
+                "chat": {"id": CHAT_ID, "type": "private"}, "from": user,
+                "text": "/start", "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+            },
+        }
+
+
+class FakeVKAPI:
+    """
+    Методы VK, которые использует vkcc.py, с детерминированными ответами.
+
+    С capacity сервер обслуживает не больше capacity запросов одновременно,
+    ещё столько же ждут в очереди (задержка растёт), остальным сразу
+    отвечает ошибкой 6 «Too many requests per second».
+    """
+
+    def __init__(self, latency: float = 0.0, capacity: Optional[int] = None):
+        self.latency = latency
+        self.capacity = capacity
+        self.calls = Counter()
+        self.flooded = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._workers = asyncio.Semaphore(capacity) if capacity else None
+        self.app = web.Application()
+        self.app.router.add_route("*", "/method/{method}", self.handle)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(request.query)
+        params.update(await request.post())
+        if self.capacity and self.in_flight >= 2 * self.capacity:
+            self.flooded += 1
+            return web.json_response({"error": {"error_code": 6, "error_msg": "Too many requests per second"}})
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self._workers:
+                async with self._workers:
+                    return await self.respond(method, params)
+            return await self.respond(method, params)
+        finally:
+            self.in_flight -= 1
+
+    async def respond(self, method: str, params: dict) -> web.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "utils.getShortLink":
+            key = hashlib.md5(params.get("url", "").encode()).hexdigest()[:6]
+            response = {"short_url": f"https://vk.cc/{key}", "key": key, "url": params.get("url")}
+        elif method == "utils.getLinkStats":
+            response = self.link_stats(params.get("key", ""))
+        elif method == "execute":
+            response = [self.link_stats(key) for key in re.findall(r'"key": "([^"]*)"', params.get("code", ""))]
+        elif method in ("database.getCountriesById", "database.getCitiesById"):
+            ids = (params.get("country_ids") or params.get("city_ids") or "").split(",")
+            response = [{"id": int(i), "title": f"Место {i}"} for i in ids if i]
+        elif method in ("database.getCountries", "database.getCities"):
+            response = {"count": 0, "items": []}
+        else:
+            return web.json_response({"error": {"error_code": 3, "error_msg": f"Unknown method {method}"}})
+        return web.json_response({"response": response})
+
+    @staticmethod
+    def link_stats(key: str) -> dict:
+        views = int(hashlib.md5(key.encode()).hexdigest()[:4], 16) % 500
+        return {
+            "key": key,
+            "views": views,
+            "sex_age": [{"age_range": "18-21", "female": views // 3, "male": views // 4}],
+            "countries": [{"country_id": 1, "views": views // 2}],
+            "cities": [{"city_id": 1, "views": views // 3}],
+        }
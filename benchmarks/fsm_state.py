@@ -0,0 +1,135 @@
+"""
+Размер данных FSM на пользователя: прогоняет через настоящие обработчики типичный
+сценарий (список ссылок с пагинацией и сортировкой, сокращение, поочерёдное
+переименование пакета, поиск) для пользователя с большим числом ссылок и
+проверяет, что данные состояния после каждого апдейта не превышают лимит.
+
+    python benchmarks/fsm_state.py [--links 500] [--batch 50] [--cap 1024]
+
+Код выхода 1, если лимит превышен.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "123:benchmark")
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.strategy import FSMStrategy  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import database  # noqa: E402
+from config import FSM_STATE_MAX_BYTES  # noqa: E402
+from fsm_storage import MeteredMemoryStorage, state_size  # noqa: E402
+from handlers import router  # noqa: E402
+from fakes import FakeBotAPI, serve  # noqa: E402
+
+USER_ID = 1000
+USER = {"id": USER_ID, "is_bot": False, "first_name": "Bench"}
+CHAT = {"id": USER_ID, "type": "private"}
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "bench"}
+
+
+class Updates:
+    def __init__(self):
+        self.update_id = 0
+
+    def _next(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def message(self, text: str) -> Update:
+        update = {
+            "update_id": self._next(),
+            "message": {"message_id": self.update_id, "date": int(time.time()), "chat": CHAT, "from": USER, "text": text},
+        }
+        if text.startswith("/"):
+            command = text.split(maxsplit=1)[0]
+            update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return Update(**update)
+
+    def callback(self, data: str) -> Update:
+        message = {"message_id": 1, "date": int(time.time()), "chat": CHAT, "from": BOT_USER, "text": "..."}
+        return Update(update_id=self._next(), callback_query={
+            "id": str(self.update_id), "from": USER, "chat_instance": "1", "message": message, "data": data,
+        })
+
+
+async def prepare(links: int, batch: int) -> int:
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), "links.db")
+    await database.init_db()
+    for i in range(links):
+        await database.save_link(
+            USER_ID, f"https://example.com/articles/{i}?utm_source=bench", f"https://vk.cc/b{i}",
+            f"Ссылка номер {i} с достаточно длинным описанием", f"b{i}"
+        )
+    job_id = await database.create_job(
+        USER_ID, USER_ID, "shorten", items=[{"url": f"https://example.com/articles/{i}"} for i in range(batch)]
+    )
+    for i in range(batch):
+        await database.complete_job_item(job_id, i, {
+            "ok": True, "link_id": i + 1, "title": f"Ссылка номер {i}", "short_url": f"https://vk.cc/b{i}",
+            "text": f"✅ Ссылка сокращена: https://vk.cc/b{i}",
+        })
+    return job_id
+
+
+async def main(args) -> int:
+    job_id = await prepare(args.links, args.batch)
+    runner, api_url = await serve(FakeBotAPI().app)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    storage = MeteredMemoryStorage()
+    dp = Dispatcher(storage=storage, fsm_strategy=FSMStrategy.USER_IN_CHAT)
+    dp.include_router(router)
+    key = StorageKey(bot_id=bot.id, chat_id=USER_ID, user_id=USER_ID)
+
+    u = Updates()
+    scenario = [
+        ("список", u.message("мои ссылки")),
+        ("страница 3", u.callback("page:3")),
+        ("сортировка", u.callback("sort:views")),
+        ("страница 2", u.callback("page:2")),
+        ("назад к списку", u.callback("back_to_links")),
+        ("сокращение", u.callback("shorten_link")),
+        ("одна ссылка", u.message("https://example.com/new-article")),
+        ("отмена", u.callback("cancel_shorten")),
+        ("переименование пакета", u.callback(f"rename_mass:{job_id}")),
+    ]
+    scenario += [(f"название {i + 1}", u.message(f"Новое название {i}")) for i in range(3)]
+    scenario.append(("поиск", u.message("/find " + "ссылка " * 40)))
+
+    worst = 0
+    try:
+        for name, update in scenario:
+            await dp.feed_update(bot, update)
+            size = state_size(await storage.get_data(key))
+            worst = max(worst, size)
+            print(f"  {name:<24} {size:6d} байт")
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+    full_list = state_size({"links": await database.get_links_by_user(USER_ID)})
+    print(f"Максимум на пользователя: {worst} байт (лимит {args.cap})")
+    print(f"Для сравнения, полный список из {args.links} ссылок в состоянии: {full_list} байт")
+    if worst > args.cap:
+        print("Данные состояния превышают лимит")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=50)
+    parser.add_argument("--cap", type=int, default=FSM_STATE_MAX_BYTES)
+    sys.exit(asyncio.run(main(parser.parse_args())))
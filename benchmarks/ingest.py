@@ -0,0 +1,144 @@
+"""
+Разбор списка ссылок на 50, 5 000 и 50 000 строк: прежний построчный путь и ingest.py.
+
+Строки — смесь правильных ссылок (часть с описанием), невалидных адресов,
+слишком длинных описаний, повторов внутри списка и ссылок, которые у
+пользователя уже сохранены. «Построчно» — прежний parse_url_lines (re.compile в
+каждом is_valid_url) и проверка дубликата отдельным запросом на каждую ссылку, как
+это делало сокращение каждого элемента; «пакетно» — parse_batch и один запрос
+exclude_existing. Печатает время разбора и проверки по базе; код выхода 1, если
+пакетный путь в сумме медленнее построчного.
+
+Сам разбор у пакетного пути медленнее построчного (в 1,5–2 раза): он ещё
+приводит каждую ссылку к каноническому виду и отсеивает повторы, которых
+построчный разбор не делал, — это отдельно печатается для каждого размера.
+Выигрыш целиком даёт один запрос к базе вместо запроса на каждую ссылку.
+
+    python benchmarks/ingest.py [--sizes 50,5000,50000] [--existing 2000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "123:ingest")
+
+import aiosqlite  # noqa: E402
+
+import database  # noqa: E402
+from ingest import parse_batch, exclude_existing  # noqa: E402
+
+USER_ID = 1
+
+
+def legacy_is_valid_url(url: str) -> bool:
+    url = url.strip()
+    if not url:
+        return False
+    pattern = re.compile(
+        r'^https?://'
+        r'(?:(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}|'
+        r'localhost|'
+        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'
+        r'(?::\d+)?(?:/[-a-zA-Z0-9@:%_\+.~#?&//=]*)?$'
+    )
+    return bool(pattern.match(url))
+
+
+def legacy_parse(lines):
+    processed, failed = [], []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if "|" in line:
+            u, t = map(str.strip, line.split("|", 1))
+            if len(t) > 100:
+                failed.append(f"❌ Ошибка: Название для {u} слишком длинное (максимум 100 символов).")
+                continue
+        else:
+            u, t = line, None
+        if not legacy_is_valid_url(u):
+            failed.append(f"❌ Ошибка: {u} — невалидная ссылка.")
+            continue
+        processed.append((u, t))
+    return processed, failed
+
+
+def make_lines(size: int, existing: int, rng: random.Random):
+    lines = []
+    for i in range(size):
+        kind = rng.random()
+        if kind < 0.05:
+            lines.append(f"not a url {i}")
+        elif kind < 0.08:
+            lines.append(f"https://example.com/long/{i} | {'x' * 120}")
+        elif kind < 0.15 and lines:
+            lines.append(rng.choice(lines))
+        elif kind < 0.2:
+            lines.append(f"https://saved.example.com/{rng.randrange(existing)}")
+        elif kind < 0.5:
+            lines.append(f"https://example.com/page/{i}?b=2&a={i} | Описание {i}")
+        else:
+            lines.append(f"https://news{i % 97}.example.org/{i}/article-{i}.html")
+    return lines
+
+
+async def legacy(lines):
+    started = time.perf_counter()
+    processed, failed = legacy_parse(lines)
+    parsed = time.perf_counter()
+    new = []
+    for url, title in processed:
+        if not await database.is_duplicate_link(USER_ID, url):
+            new.append(url)
+    return parsed - started, time.perf_counter() - parsed, len(new)
+
+
+async def batched(lines):
+    started = time.perf_counter()
+    result = parse_batch(lines)
+    parsed = time.perf_counter()
+    result = await exclude_existing(USER_ID, result)
+    return parsed - started, time.perf_counter() - parsed, len(result.accepted)
+
+
+async def main(args) -> int:
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), "links.db")
+    await database.init_db()
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        await db.executemany(
+            "INSERT INTO links (user_id, original_url, short_url, title, vk_key) VALUES (?, ?, ?, ?, ?)",
+            ((USER_ID, f"https://saved.example.com/{i}", f"https://vk.cc/s{i}", f"Ссылка {i}", f"s{i}")
+             for i in range(args.existing))
+        )
+        await db.commit()
+
+    print(f"У пользователя {args.existing} ссылок")
+    print(f"{'строк':>7}{'путь':>12}{'разбор мс':>11}{'база мс':>10}{'всего мс':>10}{'новых':>8}")
+    status = 0
+    for size in args.sizes:
+        lines = make_lines(size, args.existing, random.Random(size))
+        rows = [("построчно", await legacy(lines)), ("пакетно", await batched(lines))]
+        for name, (parse_s, db_s, new) in rows:
+            print(f"{size:>7}{name:>12}{parse_s * 1000:>11.1f}{db_s * 1000:>10.1f}{(parse_s + db_s) * 1000:>10.1f}{new:>8}")
+        (_, (lp, ld, _)), (_, (bp, bd, _)) = rows
+        print(f"{'':>7}{'разбор пакетно / построчно':>30}: x{bp / lp:.2f}")
+        # Построчный путь не отсеивает повторы внутри списка, поэтому новых у него больше
+        if bp + bd > lp + ld:
+            print(f"{size}: пакетный разбор медленнее построчного")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=lambda s: [int(x) for x in s.split(",")], default=[50, 5000, 50000])
+    parser.add_argument("--existing", type=int, default=2000)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,185 @@
+"""
+Смешанная нагрузка: массовое сокращение в очереди задач и одновременные нажатия
+других пользователей (карточка, статистика, страница списка).
+
+Прогон повторяется дважды на одной и той же нагрузке: «fifo» — общие очереди к VK
+и базе без приоритетов и без показа снимков при перегрузке, «приоритет» — как в
+боте. Расписание нажатий (моменты, пользователи, кнопки) строится заранее из
+фиксированного seed и одинаково в обоих прогонах. Печатает p50/p95/p99 нажатий и
+скорость фоновой обработки; код выхода 1, если p99 нажатий с приоритетами не
+лучше, чем без них.
+
+    python benchmarks/priority.py [--bulk-jobs 8] [--taps 20] [--duration 10]
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "123:priority")
+
+import aiosqlite  # noqa: E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import database  # noqa: E402
+import session as http  # noqa: E402
+import stats  # noqa: E402
+import tasks  # noqa: E402, F401 — регистрирует типы фоновых задач
+import vkcc  # noqa: E402
+from config import VK_CONCURRENCY_INITIAL, VK_CONCURRENCY_MIN, VK_CONCURRENCY_MAX, VK_SHED_QUEUE  # noqa: E402
+from fakes import FakeBotAPI, FakeVKAPI, serve  # noqa: E402
+from fsm_storage import MeteredMemoryStorage  # noqa: E402
+from handlers import router  # noqa: E402
+from jobs import JobQueue, enqueue_job  # noqa: E402
+from ratelimit import AdaptiveLimiter  # noqa: E402
+
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "bench"}
+BULK_USER_BASE = 1_000_000
+LINKS_PER_USER = 20
+
+
+def tap(update_id: int, user_id: int, data: str) -> Update:
+    chat = {"id": user_id, "type": "private"}
+    message = {"message_id": 1, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "..."}
+    return Update(update_id=update_id, callback_query={
+        "id": str(update_id), "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+        "chat_instance": str(user_id), "message": message, "data": data,
+    })
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+
+async def prepare(args) -> dict:
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), "links.db")
+    await database.init_db()
+    links = {}
+    for user_id in range(1, args.users + 1):
+        for i in range(LINKS_PER_USER):
+            await database.save_link(user_id, f"https://example.com/{user_id}/{i}", f"https://vk.cc/u{user_id}x{i}",
+                                     f"Ссылка {i}", f"u{user_id}x{i}")
+        async with aiosqlite.connect(database.DB_PATH) as db:
+            async with db.execute("SELECT id FROM links WHERE user_id = ?", (user_id,)) as cursor:
+                links[user_id] = [row[0] for row in await cursor.fetchall()]
+    # Снимки просмотров есть, но устаревшие: без перегрузки нажатия идут в VK
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        await db.execute(
+            "INSERT INTO link_stats (link_id, user_id, views, payload, summary, fetched_at) "
+            "SELECT id, user_id, 1, '{}', '{\"views\": 1}', '2000-01-01T00:00:00' FROM links"
+        )
+        await db.commit()
+    return links
+
+
+def make_schedule(args, links: dict) -> list:
+    """Нажатия на duration секунд: (момент от начала, пользователь, кнопка)."""
+    rng = random.Random(7)
+    schedule, at = [], 0.0
+    while at < args.duration:
+        user_id = rng.randint(1, args.users)
+        link_id = rng.choice(links[user_id])
+        schedule.append((at, user_id, rng.choice((f"link:{link_id}", f"stats:{link_id}", "page:2"))))
+        at += rng.expovariate(args.taps)
+    return schedule
+
+
+async def run(args, dp: Dispatcher, prioritize: bool) -> dict:
+    links = await prepare(args)
+    schedule = make_schedule(args, links)
+    bot_api, vk_api = FakeBotAPI(), FakeVKAPI(args.vk_latency, args.vk_capacity)
+    bot_runner, bot_url = await serve(bot_api.app)
+    vk_runner, vk_url = await serve(vk_api.app)
+    vkcc.VK_API_BASE = f"{vk_url}/method/"
+    # Предел не выше того, что фальшивый VK держит без ошибки 6: единичный флуд в
+    # случайный момент одного из прогонов менял бы p99 сильнее, чем приоритеты
+    max_limit = min(VK_CONCURRENCY_MAX, 2 * args.vk_capacity)
+    vkcc.vk_limiter = AdaptiveLimiter(VK_CONCURRENCY_INITIAL, VK_CONCURRENCY_MIN, max_limit)
+    vkcc.vk_limiter.prioritize = prioritize
+    database.db_gate.prioritize = prioritize
+    stats.VK_SHED_QUEUE = VK_SHED_QUEUE if prioritize else math.inf
+    stats.shed_stats["shed"] = 0
+    await http.create_session()
+
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=AiohttpSession(api=TelegramAPIServer.from_base(bot_url)))
+    job_queue = JobQueue(bot, workers=args.workers)
+    await job_queue.start()
+    for job in range(args.bulk_jobs):
+        user_id = BULK_USER_BASE + job
+        items = [{"url": f"https://bulk.example.com/{job}/{i}", "title": None} for i in range(args.bulk_size)]
+        await enqueue_job(user_id, user_id, "shorten", items=items, message_id=1)
+
+    latencies = []
+
+    async def one_tap(update: Update):
+        started = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    pending = []
+    for update_id, (at, user_id, data) in enumerate(schedule, 1):
+        await asyncio.sleep(max(0.0, started + at - time.perf_counter()))
+        pending.append(asyncio.create_task(one_tap(tap(update_id, user_id, data))))
+    await asyncio.gather(*pending)
+    elapsed = time.perf_counter() - started
+
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        async with db.execute("SELECT COUNT(*) FROM job_items WHERE status = 'done'") as cursor:
+            bulk_done = (await cursor.fetchone())[0]
+    await job_queue.stop()
+    await http.close_session()
+    await bot.session.close()
+    await bot_runner.cleanup()
+    await vk_runner.cleanup()
+    return {
+        "taps": len(latencies),
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "bulk_rate": bulk_done / elapsed,
+        "shed": stats.shed_stats["shed"],
+        "flooded": vk_api.flooded,
+    }
+
+
+async def main(args) -> int:
+    vkcc.logger.setLevel("CRITICAL")
+    dp = Dispatcher(storage=MeteredMemoryStorage())
+    dp.include_router(router)
+    results = [("fifo", await run(args, dp, False)), ("приоритет", await run(args, dp, True))]
+    print(f"Пользователей {args.users}, нажатий ~{args.taps}/с {args.duration:g} с; фоном {args.bulk_jobs} задач по "
+          f"{args.bulk_size} ссылок, воркеров {args.workers}; VK: {args.vk_capacity} одновременно, "
+          f"{args.vk_latency * 1000:.0f} мс")
+    print(f"{'режим':<12}{'нажатий':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'фон/с':>8}{'из снимков':>12}{'ошибок 6':>10}")
+    for name, r in results:
+        print(f"{name:<12}{r['taps']:>9}{r['p50']:>9.0f}{r['p95']:>9.0f}{r['p99']:>9.0f}"
+              f"{r['bulk_rate']:>8.1f}{r['shed']:>12}{r['flooded']:>10}")
+    fifo, prioritized = results[0][1], results[1][1]
+    if prioritized["p99"] >= fifo["p99"]:
+        print("p99 нажатий с приоритетами не лучше, чем без них")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--taps", type=float, default=20.0, help="нажатий в секунду")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--bulk-jobs", type=int, default=8)
+    parser.add_argument("--bulk-size", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--vk-capacity", type=int, default=4)
+    parser.add_argument("--vk-latency", type=float, default=0.1)
+    sys.exit(asyncio.run(main(parser.parse_args())))
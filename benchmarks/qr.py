@@ -0,0 +1,145 @@
+"""
+Кнопка «QR» под нагрузкой: холодные запросы, повторы и повторы после потери file_id.
+
+Три прохода по одним и тем же ссылкам: «холодный» (код рисуется в пуле и
+загружается), «повтор» (отправка по сохранённому file_id) и «с диска» (file_id
+забыты — PNG берётся из дискового кэша и загружается без отрисовки). Для каждого
+прохода печатает p50/p99 нажатия, число отрисовок, загруженные байты и
+наибольшую задержку цикла событий. Код выхода 1, если повтор что-то рисует или
+загружает.
+
+    python benchmarks/qr.py [--links 200] [--concurrency 20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "123:qr")
+
+import aiosqlite  # noqa: E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import database  # noqa: E402
+import qr  # noqa: E402
+from fakes import FakeBotAPI, serve  # noqa: E402
+from fsm_storage import MeteredMemoryStorage  # noqa: E402
+from handlers import router  # noqa: E402
+
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "bench"}
+USER_ID = 1
+
+
+def tap(update_id: int, data: str) -> Update:
+    chat = {"id": USER_ID, "type": "private"}
+    message = {"message_id": 1, "date": int(time.time()), "chat": chat, "from": BOT_USER, "text": "..."}
+    return Update(update_id=update_id, callback_query={
+        "id": str(update_id), "from": {"id": USER_ID, "is_bot": False, "first_name": "U"},
+        "chat_instance": str(USER_ID), "message": message, "data": data,
+    })
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+
+async def loop_lag(stop: asyncio.Event, result: dict) -> None:
+    """Наибольшее опоздание пробуждения: сколько цикл событий был занят без перерыва."""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        result["max"] = max(result["max"], time.perf_counter() - started - 0.001)
+
+
+async def run_pass(args, dp: Dispatcher, bot: Bot, bot_api: FakeBotAPI, link_ids, first_update: int) -> dict:
+    before = dict(qr.qr_stats), bot_api.uploaded_bytes
+    latencies, lag, stop = [], {"max": 0.0}, asyncio.Event()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(update_id: int, link_id: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await dp.feed_update(bot, tap(update_id, f"qr:{link_id}"))
+            latencies.append(time.perf_counter() - started)
+
+    monitor = asyncio.create_task(loop_lag(stop, lag))
+    await asyncio.gather(*(one(first_update + i, link_id) for i, link_id in enumerate(link_ids)))
+    stop.set()
+    await monitor
+    return {
+        "taps": len(latencies),
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "rendered": qr.qr_stats["rendered"] - before[0]["rendered"],
+        "file_id": qr.qr_stats["file_id"] - before[0]["file_id"],
+        "uploaded": bot_api.uploaded_bytes - before[1],
+        "lag": lag["max"] * 1000,
+    }
+
+
+async def main(args) -> int:
+    workdir = tempfile.mkdtemp()
+    database.DB_PATH = os.path.join(workdir, "links.db")
+    await database.init_db()
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        await db.executemany(
+            "INSERT INTO links (user_id, original_url, short_url, title, vk_key) VALUES (?, ?, ?, ?, ?)",
+            ((USER_ID, f"https://example.com/{i}", f"https://vk.cc/q{i:05d}", f"Ссылка {i}", f"q{i:05d}")
+             for i in range(args.links + 1))
+        )
+        await db.commit()
+        async with db.execute("SELECT id FROM links") as cursor:
+            link_ids = [row[0] for row in await cursor.fetchall()]
+
+    started = time.perf_counter()
+    qr.render_png("https://vk.cc/q00000", os.path.join(workdir, "probe.png"))
+    inline_ms = (time.perf_counter() - started) * 1000
+
+    qr.qr_cache.directory = os.path.join(workdir, "qr")
+    qr.qr_cache.start()
+    bot_api = FakeBotAPI()
+    runner, url = await serve(bot_api.app)
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    dp = Dispatcher(storage=MeteredMemoryStorage())
+    dp.include_router(router)
+
+    # Первое нажатие прогревает диспетчер и соединения; в замеры не входит
+    warmup, *link_ids = link_ids
+    await run_pass(args, dp, bot, bot_api, [warmup], 0)
+    results = [("холодный", await run_pass(args, dp, bot, bot_api, link_ids, 1)),
+               ("повтор", await run_pass(args, dp, bot, bot_api, link_ids, 10 ** 6))]
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        await db.execute("DELETE FROM qr_files")
+        await db.commit()
+    results.append(("с диска", await run_pass(args, dp, bot, bot_api, link_ids, 2 * 10 ** 6)))
+
+    await bot.session.close()
+    await runner.cleanup()
+    qr.qr_cache.stop()
+    print(f"Ссылок {args.links}, одновременно {args.concurrency}, воркеров отрисовки {qr.qr_cache.workers}; "
+          f"одна отрисовка в цикле событий заняла бы его на {inline_ms:.1f} мс")
+    print(f"{'проход':<10}{'нажатий':>9}{'p50 мс':>9}{'p99 мс':>9}{'нарисовано':>12}{'file_id':>9}"
+          f"{'загружено КБ':>14}{'задержка цикла мс':>19}")
+    for name, r in results:
+        print(f"{name:<10}{r['taps']:>9}{r['p50']:>9.1f}{r['p99']:>9.1f}{r['rendered']:>12}{r['file_id']:>9}"
+              f"{r['uploaded'] / 1024:>14.1f}{r['lag']:>19.1f}")
+    repeat = results[1][1]
+    if repeat["rendered"] or repeat["uploaded"]:
+        print("повторные запросы рисуют или загружают картинку заново")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,318 @@
+"""
+Воспроизведение записанных апдейтов Telegram через настоящие Dispatcher и роутеры
+бота, полностью офлайн: Bot API и VK API подменяются локальными заглушками
+(benchmarks/fakes.py), база — временный SQLite, фоновые задачи выполняет JobQueue.
+
+Формат записи — JSONL, по апдейту на строку: либо сам объект Update
+({"update_id": ..., "message": {...}}), либо {"ts": <секунды>, "update": {...}}.
+Без "ts" время берётся из message.date / callback_query.message.date. Строки
+без update_id пропускаются (и учитываются в отчёте).
+
+    python benchmarks/replay.py updates.jsonl [--speed 10] [--multiply 4] [--concurrency 200]
+    python benchmarks/replay.py --generate 2000 --users 100 --out updates.jsonl
+
+--speed      ускорение относительно записанных интервалов (0 — без пауз); апдейты
+             одного пользователя всегда идут по порядку, разные пользователи —
+             параллельно. Порог ThrottlingMiddleware сжимается в то же число раз;
+             отсечённые им сообщения в отчёте видны как <middleware>
+--multiply   каждый апдейт проигрывается N раз от разных пользователей
+--vk-latency, --bot-latency — задержка заглушек в секундах
+
+Отчёт: по каждому обработчику — число апдейтов, пропускная способность,
+p50/p95/p99 задержки и доля ошибок; плюс вызовы заглушек и выполненные задачи.
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "123:replay")
+
+import aiosqlite  # noqa: E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.dispatcher.event.bases import UNHANDLED  # noqa: E402
+from aiogram.fsm.strategy import FSMStrategy  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+import database  # noqa: E402
+import session as http  # noqa: E402
+import tasks  # noqa: E402, F401 — регистрирует типы фоновых задач
+import vkcc  # noqa: E402
+from fakes import FakeBotAPI, FakeVKAPI, serve  # noqa: E402
+from fsm_storage import MeteredMemoryStorage  # noqa: E402
+from handlers import router, ThrottlingMiddleware, action_dedup  # noqa: E402
+from dedup import DedupMiddleware, dedup_stats  # noqa: E402
+from jobs import JobQueue  # noqa: E402
+from sent_messages import MessageRegistryMiddleware, MessageSweeper  # noqa: E402
+
+USER_ID_STRIDE = 10 ** 9  # сдвиг ID пользователя и чата для копий при --multiply
+BOT_USER = {"id": 123, "is_bot": True, "first_name": "bench"}
+
+_handler_name: contextvars.ContextVar[dict] = contextvars.ContextVar("handler_name")
+
+
+async def record_handler(handler, event, data):
+    """Inner-middleware: запоминает, какой обработчик принял апдейт."""
+    holder = _handler_name.get(None)
+    if holder is not None:
+        holder["name"] = getattr(data.get("handler").callback, "__name__", "unknown")
+    return await handler(event, data)
+
+
+# Запись
+
+def load_updates(path: str):
+    """[(ts, update_dict)] в порядке времени и число пропущенных строк."""
+    updates, skipped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            update = record.get("update", record)
+            if not isinstance(update, dict) or "update_id" not in update:
+                skipped += 1
+                continue
+            ts = record.get("ts")
+            if ts is None:
+                event = update.get("message") or (update.get("callback_query") or {}).get("message") or {}
+                ts = event.get("date", 0)
+            updates.append((float(ts), update))
+    updates.sort(key=lambda item: item[0])
+    if updates:
+        start = updates[0][0]
+        updates = [(ts - start, update) for ts, update in updates]
+    return updates, skipped
+
+
+def generate_updates(count: int, users: int, duration: float):
+    """Синтетическая запись: типичные сценарии пользователей, равномерно во времени."""
+    rng = random.Random(42)
+    scenarios = [
+        ["/start", "мои ссылки", "cb:page:2", "cb:sort:views", "cb:back_to_links"],
+        ["сократить ссылку", "urls:1"],
+        ["сократить ссылку", "urls:5"],
+        ["/find example", "cb:find:5:example"],
+        ["мои ссылки", "cb:page:3", "cb:page:1"],
+    ]
+    updates, update_id = [], 0
+    while len(updates) < count:
+        user_id = rng.randint(1, users)
+        ts = rng.uniform(0, duration)
+        for step, action in enumerate(rng.choice(scenarios)):
+            update_id += 1
+            user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+            chat = {"id": user_id, "type": "private"}
+            step_ts = ts + step * rng.uniform(2.5, 6.0)  # больше порога ThrottlingMiddleware
+            if action.startswith("cb:"):
+                message = {"message_id": update_id, "date": int(step_ts), "chat": chat, "from": BOT_USER, "text": "..."}
+                update = {"update_id": update_id, "callback_query": {
+                    "id": str(update_id), "from": user, "chat_instance": str(user_id),
+                    "message": message, "data": action[3:],
+                }}
+            else:
+                if action.startswith("urls:"):
+                    text = "\n".join(
+                        f"https://example.com/{user_id}/{rng.randint(1, 10 ** 6)} | заметка"
+                        for _ in range(int(action[5:]))
+                    )
+                else:
+                    text = action
+                message = {"message_id": update_id, "date": int(step_ts), "chat": chat, "from": user, "text": text}
+                if text.startswith("/"):
+                    message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+                update = {"update_id": update_id, "message": message}
+            updates.append({"ts": round(step_ts, 3), "update": update})
+    updates.sort(key=lambda record: record["ts"])
+    return updates[:count]
+
+
+def remap_user(update: dict, copy: int, update_id: int) -> Update:
+    """Копия апдейта от другого пользователя: сдвигает ID пользователя и чата."""
+    data = json.loads(json.dumps(update))
+    data["update_id"] = update_id
+    if copy:
+        shift = copy * USER_ID_STRIDE
+
+        def walk(node):
+            if isinstance(node, dict):
+                for key in ("from", "chat"):
+                    if isinstance(node.get(key), dict) and not node[key].get("is_bot"):
+                        node[key]["id"] += shift
+                for value in node.values():
+                    walk(value)
+        walk(data)
+    return Update(**data)
+
+
+# Прогон
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def pending_jobs() -> int:
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        async with db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('pending', 'running')") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+async def job_counts() -> dict:
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        async with db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status") as cursor:
+            return dict(await cursor.fetchall())
+
+
+async def replay(args, updates) -> None:
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), "links.db")
+    await database.init_db()
+
+    bot_api, vk_api = FakeBotAPI(args.bot_latency), FakeVKAPI(args.vk_latency)
+    bot_runner, bot_url = await serve(bot_api.app)
+    vk_runner, vk_url = await serve(vk_api.app)
+    vkcc.VK_API_BASE = f"{vk_url}/method/"
+    await http.create_session()
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(bot_url))
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    bot.session.middleware(MessageRegistryMiddleware())
+    dp = Dispatcher(storage=MeteredMemoryStorage(), fsm_strategy=FSMStrategy.USER_IN_CHAT)
+    dp.update.outer_middleware(DedupMiddleware())
+    for middleware in router.message.middleware:
+        if isinstance(middleware, ThrottlingMiddleware):
+            # Время сжато в speed раз — порог антифлуда сжимается так же
+            middleware.rate_limit = middleware.rate_limit / args.speed if args.speed > 0 else 0
+    action_dedup.seen.ttl = action_dedup.seen.ttl / args.speed if args.speed > 0 else 0
+    for observer in (router.message, router.callback_query, router.inline_query):
+        observer.middleware(record_handler)
+    dp.include_router(router)
+    job_queue = JobQueue(bot)
+    await job_queue.start()
+    sweeper = MessageSweeper(bot)
+    await sweeper.start()
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def feed(update: Update):
+        holder = {}
+        _handler_name.set(holder)
+        async with semaphore:
+            started = time.perf_counter()
+            failed = False
+            try:
+                result = await dp.feed_update(bot, update)
+            except Exception:
+                failed, result = True, None
+            elapsed = time.perf_counter() - started
+        name = holder.get("name") or ("<не обработан>" if result is UNHANDLED else "<middleware>")
+        latencies[name].append(elapsed)
+        if failed:
+            errors[name] += 1
+
+    # Апдейты одного пользователя идут строго по порядку, разные пользователи — параллельно
+    # Копии получают свои update_id, а повторы внутри записи остаются повторами
+    sessions = defaultdict(list)
+    for ts, update in updates:
+        for copy in range(args.multiply):
+            update_id = update["update_id"] * args.multiply + copy
+            remapped = remap_user(update, copy, update_id)
+            user = getattr(remapped.event, "from_user", None)
+            sessions[user.id if user else update_id].append((ts, remapped))
+
+    started = time.perf_counter()
+
+    async def play(user_updates):
+        for ts, update in user_updates:
+            if args.speed > 0:
+                delay = ts / args.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await feed(update)
+
+    tasks_ = [asyncio.create_task(play(user_updates)) for user_updates in sessions.values()]
+    await asyncio.gather(*tasks_)
+    handlers_elapsed = time.perf_counter() - started
+
+    deadline = time.perf_counter() + args.jobs_timeout
+    while await pending_jobs() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.2)
+    total_elapsed = time.perf_counter() - started
+    jobs = await job_counts()
+
+    await sweeper.stop()
+    await job_queue.stop()
+    await http.close_session()
+    await session.close()
+    await bot_runner.cleanup()
+    await vk_runner.cleanup()
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"Апдейтов: {total} за {handlers_elapsed:.2f} с ({total / handlers_elapsed:.1f}/с)")
+    print(f"{'обработчик':<28}{'кол-во':>8}{'в сек':>9}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}{'ошибки':>9}")
+    for name, values in sorted(latencies.items(), key=lambda item: -len(item[1])):
+        print(
+            f"{name:<28}{len(values):>8}{len(values) / handlers_elapsed:>9.1f}"
+            f"{percentile(values, 0.5) * 1000:>9.1f}{percentile(values, 0.95) * 1000:>9.1f}"
+            f"{percentile(values, 0.99) * 1000:>9.1f}{errors[name] / len(values):>9.1%}"
+        )
+    print(f"Задачи за {total_elapsed:.2f} с: " + ", ".join(f"{status} {count}" for status, count in sorted(jobs.items())))
+    print("Bot API: " + ", ".join(f"{method} {count}" for method, count in bot_api.calls.most_common()))
+    print("VK API: " + ", ".join(f"{method} {count}" for method, count in vk_api.calls.most_common()))
+    print(f"Повторы: апдейтов {dedup_stats['updates']}, действий {dedup_stats['actions']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", nargs="?", help="JSONL с записанными апдейтами")
+    parser.add_argument("--speed", type=float, default=0.0)
+    parser.add_argument("--multiply", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--vk-latency", type=float, default=0.05)
+    parser.add_argument("--bot-latency", type=float, default=0.02)
+    parser.add_argument("--jobs-timeout", type=float, default=60.0)
+    parser.add_argument("--generate", type=int, help="записать синтетические апдейты вместо прогона")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=300.0, help="секунд, на которые растянута запись")
+    parser.add_argument("--out", default="updates.jsonl")
+    args = parser.parse_args()
+
+    if args.generate:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for record in generate_updates(args.generate, args.users, args.duration):
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        print(f"{args.out}: {args.generate} апдейтов")
+        return 0
+    if not args.path:
+        parser.error("нужен путь к записи или --generate")
+    updates, skipped = load_updates(args.path)
+    if skipped:
+        print(f"Пропущено строк без апдейта: {skipped}")
+    if not updates:
+        print("В файле нет апдейтов Telegram")
+        return 1
+    asyncio.run(replay(args, updates))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Поиск /find у пользователя со 100 000 ссылок: задержка search_links по видам запросов.
+
+Названия и адреса генерируются из фиксированного seed: редкое слово (десятки
+совпадений), частое (четверть всех ссылок), префикс, два слова, страница за окном
+ранжирования SEARCH_RANK_WINDOW и запрос без слов, который уходит в LIKE. Каждый
+запрос повторяется --repeat раз; печатает число совпадений на первой странице,
+p50 и p99. Код выхода 1, если p99 какого-либо FTS-запроса больше --budget мс
+(LIKE просматривает все ссылки пользователя и в бюджет не входит).
+
+    python benchmarks/search.py [--links 100000] [--repeat 200] [--budget 10] [--window 1000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "123:search")
+
+import aiosqlite  # noqa: E402
+
+import database  # noqa: E402
+
+USER_ID = 1
+PER_PAGE = 5
+WORDS = ["новости", "рецепт", "видео", "обзор", "статья", "музыка", "кино", "погода", "скидка", "курс",
+         "python", "github", "docs", "report", "travel", "sport", "game", "shop", "blog", "forum"]
+
+
+def percentile(values, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] if ordered else 0.0
+
+
+def make_links(count: int, rng: random.Random):
+    for i in range(count):
+        words = rng.sample(WORDS[1:], 2)
+        # Каждая четвёртая ссылка содержит частое слово, каждая тысячная — редкое
+        if i % 4 == 0:
+            words.append(WORDS[0])
+        if i % 1000 == 0:
+            words.append("уникальный")
+        title = " ".join(words).capitalize() + f" {i}"
+        yield (USER_ID, f"https://{words[0]}.example.com/{words[1]}/{i}", f"https://vk.cc/f{i}", title, f"f{i}")
+
+
+async def main(args) -> int:
+    if args.window:
+        database.SEARCH_RANK_WINDOW = args.window
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), "links.db")
+    await database.init_db()
+    if not database.fts_enabled:
+        print("SQLite собран без FTS5 — поиск работает через LIKE, замер не имеет смысла")
+        return 1
+    async with aiosqlite.connect(database.DB_PATH) as db:
+        await db.executemany(
+            "INSERT INTO links (user_id, original_url, short_url, title, vk_key) VALUES (?, ?, ?, ?, ?)",
+            make_links(args.links, random.Random(27))
+        )
+        await db.commit()
+
+    cases = [
+        ("редкое слово", "уникальный", 0),
+        ("частое слово", "новости", 0),
+        ("префикс", "рец", 0),
+        ("два слова", "новости видео", 0),
+        ("за окном", "новости", database.SEARCH_RANK_WINDOW + 100),
+        ("LIKE", "%", 0),
+    ]
+    print(f"Ссылок у пользователя: {args.links}, повторов: {args.repeat}, окно ранжирования: "
+          f"{database.SEARCH_RANK_WINDOW}")
+    print(f"{'запрос':<14}{'строк':>7}{'p50 мс':>9}{'p99 мс':>9}")
+    status = 0
+    for name, query, offset in cases:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            rows, _ = await database.search_links(USER_ID, query, PER_PAGE, offset)
+            timings.append(time.perf_counter() - started)
+        p99 = percentile(timings, 0.99) * 1000
+        print(f"{name:<14}{len(rows):>7}{percentile(timings, 0.5) * 1000:>9.2f}{p99:>9.2f}")
+        if name != "LIKE" and p99 > args.budget:
+            print(f"{name}: p99 {p99:.1f} мс больше бюджета {args.budget:g} мс")
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--links", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--window", type=int, help="переопределить SEARCH_RANK_WINDOW")
+    parser.add_argument("--budget", type=float, default=10.0, help="p99 FTS-запроса, мс")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,112 @@
+"""
+Холодный старт бота: время импорта (`python -X importtime`) и время до ответа
+на первый апдейт. Бот запускается отдельным процессом против локального
+заглушечного Bot API, который отдаёт одно сообщение /start и ждёт ответа.
+
+    python benchmarks/startup.py [--budget 5.0] [--import-budget 4.0] [--runs 3]
+
+Код выхода 1, если медиана любого замера превышает бюджет.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from fakes import FakeBotAPI, serve
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def bot_env(api_url: str = "") -> dict:
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "123:benchmark")
+    env.setdefault("VK_TOKEN", "benchmark")
+    env.setdefault("DATABASE_URL", "benchmark")
+    env["PYTHONPATH"] = ROOT
+    if api_url:
+        env["TELEGRAM_API_URL"] = api_url
+    return env
+
+
+def parse_importtime(stderr: str):
+    """Возвращает (общее время импорта main в секундах, [(self_us, модуль)])."""
+    total = 0
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us), name.strip()))
+        if name.strip() == "main":
+            total = int(cumulative_us)
+    modules.sort(reverse=True)
+    return total / 1e6, modules
+
+
+async def measure_imports(workdir: str):
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-X", "importtime", "-c", "import main",
+        cwd=workdir, env=bot_env(),
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await proc.communicate()
+    return parse_importtime(stderr.decode())
+
+
+async def measure_first_update(workdir: str, timeout: float) -> float:
+    api = FakeBotAPI()
+    runner, api_url = await serve(api.app)
+
+    started = time.perf_counter()
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, "main.py"),
+        cwd=workdir, env=bot_env(api_url),
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        await asyncio.wait_for(api.answered.wait(), timeout)
+        return time.perf_counter() - started
+    finally:
+        proc.terminate()
+        await proc.wait()
+        await runner.cleanup()
+
+
+async def main(args) -> int:
+    import_times, first_update_times = [], []
+    modules = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            import_time, modules = await measure_imports(workdir)
+            import_times.append(import_time)
+            first_update_times.append(await measure_first_update(workdir, args.timeout))
+
+    import_median = statistics.median(import_times)
+    first_update_median = statistics.median(first_update_times)
+    print("Самые долгие импорты (собственное время):")
+    for self_us, name in modules[:args.top]:
+        print(f"  {self_us / 1000:8.1f} мс  {name}")
+    print(f"Импорт main:            {import_median:.3f} с (бюджет {args.import_budget:.1f} с)")
+    print(f"До ответа на /start:    {first_update_median:.3f} с (бюджет {args.budget:.1f} с)")
+
+    failed = False
+    if import_median > args.import_budget:
+        print("Время импорта превышает бюджет")
+        failed = True
+    if first_update_median > args.budget:
+        print("Время до первого апдейта превышает бюджет")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=float, default=5.0, help="секунд от запуска процесса до ответа на первый апдейт")
+    parser.add_argument("--import-budget", type=float, default=4.0, help="секунд на импорт main")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--top", type=int, default=10)
+    sys.exit(asyncio.run(main(parser.parse_args())))
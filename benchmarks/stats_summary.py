@@ -0,0 +1,54 @@
+"""
+Стоимость показа статистики: сборка сводки на каждый показ (как раньше — сортировка
+полных списков) против показа готовой сводки, сохранённой при получении статистики.
+
+    python benchmarks/stats_summary.py [--cities 5000] [--renders 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import format_link_stats, summarize_stats  # noqa: E402
+
+
+def make_stats(cities: int) -> dict:
+    rnd = random.Random(42)
+    return {
+        "views": cities * 50,
+        "sex_age": [
+            {"age_range": age, "male": rnd.randint(0, 1000), "female": rnd.randint(0, 1000)}
+            for age in ("0-18", "18-21", "21-24", "24-27", "27-30", "30-35", "35-45", "45-100")
+        ],
+        "countries": [{"country_id": i, "views": rnd.randint(0, 5000)} for i in range(1, 200)],
+        "cities": [{"city_id": i, "views": rnd.randint(0, 100)} for i in range(1, cities + 1)],
+    }
+
+
+def measure(fn, renders: int) -> float:
+    started = time.perf_counter()
+    for _ in range(renders):
+        fn()
+    return (time.perf_counter() - started) / renders * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cities", type=int, default=5000)
+    parser.add_argument("--renders", type=int, default=2000)
+    args = parser.parse_args()
+
+    stats = make_stats(args.cities)
+    summary = summarize_stats(stats)
+    per_render = measure(lambda: format_link_stats(summarize_stats(stats), "https://vk.cc/x"), args.renders)
+    precomputed = measure(lambda: format_link_stats(summary, "https://vk.cc/x"), args.renders)
+    print(f"городов: {args.cities}")
+    print(f"сводка на каждый показ: {per_render:9.1f} мкс/показ")
+    print(f"готовая сводка:         {precomputed:9.1f} мкс/показ (x{per_render / precomputed:.0f})")
+
+
+if __name__ == "__main__":
+    main()
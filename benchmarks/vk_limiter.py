@@ -0,0 +1,104 @@
+"""
+Проверка адаптивного предела запросов к VK на заглушке с фиксированной ёмкостью.
+
+Заглушка VK обслуживает --capacity запросов одновременно, ещё столько же
+держит в очереди, остальным отвечает ошибкой 6. Много одновременных вызовов
+shorten_link идут через vkcc.vk_limiter; для сравнения тот же прогон
+повторяется с фиксированным пределом, равным числу вызывающих. Код выхода 1,
+если адаптивный предел не вышел к ёмкости сервера или вызовы падали.
+
+    python benchmarks/vk_limiter.py [--capacity 8] [--callers 100] [--requests 2000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "benchmark")
+
+import session as http  # noqa: E402
+import vkcc  # noqa: E402
+from config import VK_CONCURRENCY_INITIAL, VK_CONCURRENCY_MIN, VK_CONCURRENCY_MAX  # noqa: E402
+from fakes import FakeVKAPI, serve  # noqa: E402
+from ratelimit import AdaptiveLimiter  # noqa: E402
+
+
+async def run(args, limiter: AdaptiveLimiter) -> dict:
+    vk_api = FakeVKAPI(args.latency, args.capacity)
+    runner, url = await serve(vk_api.app)
+    vkcc.VK_API_BASE = f"{url}/method/"
+    vkcc.vk_limiter = limiter
+    queue = list(range(args.requests))
+    failed = 0
+    limits = []
+
+    async def caller():
+        nonlocal failed
+        while queue:
+            i = queue.pop()
+            try:
+                await vkcc.shorten_link(f"https://example.com/{i}", "benchmark")
+            except ValueError:
+                failed += 1
+
+    async def sample():
+        while True:
+            limits.append((limiter.limit, limiter.queued))
+            await asyncio.sleep(0.05)
+
+    sampler = asyncio.create_task(sample())
+    started = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(args.callers)))
+    elapsed = time.perf_counter() - started
+    sampler.cancel()
+    await runner.cleanup()
+    settled = [limit for limit, _ in limits[len(limits) // 2:]] or [limiter.limit]
+    return {
+        "rps": args.requests / elapsed,
+        "failed": failed,
+        "flooded": vk_api.flooded,
+        "server_peak": vk_api.max_in_flight,
+        "limit_avg": sum(settled) / len(settled),
+        "limit_max": max(settled),
+        "queued_max": max((queued for _, queued in limits), default=0),
+        "drops": limiter.drops,
+    }
+
+
+async def main(args) -> int:
+    vkcc.logger.setLevel("CRITICAL")
+    await http.create_session()
+    try:
+        adaptive = await run(args, AdaptiveLimiter(VK_CONCURRENCY_INITIAL, VK_CONCURRENCY_MIN, VK_CONCURRENCY_MAX))
+        fixed = await run(args, AdaptiveLimiter(args.callers, args.callers, args.callers))
+    finally:
+        await http.close_session()
+
+    print(f"Ёмкость заглушки: {args.capacity} одновременно (+{args.capacity} в очереди), "
+          f"задержка {args.latency * 1000:.0f} мс, вызывающих {args.callers}, запросов {args.requests}")
+    print(f"{'предел':<14}{'запр/с':>9}{'ошибок 6':>10}{'упало':>8}{'пик на сервере':>16}"
+          f"{'предел ср.':>12}{'макс. очередь':>15}")
+    for name, result in (("адаптивный", adaptive), (f"фикс. {args.callers}", fixed)):
+        print(f"{name:<14}{result['rps']:>9.1f}{result['flooded']:>10}{result['failed']:>8}"
+              f"{result['server_peak']:>16}{result['limit_avg']:>12.1f}{result['queued_max']:>15}")
+
+    ok = True
+    if adaptive["failed"]:
+        print(f"Адаптивный предел: {adaptive['failed']} вызовов упали после повторов")
+        ok = False
+    if not args.capacity <= adaptive["limit_avg"] <= 2 * args.capacity:
+        print(f"Адаптивный предел {adaptive['limit_avg']:.1f} не вышел к ёмкости сервера {args.capacity}")
+        ok = False
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--capacity", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--callers", type=int, default=100)
+    parser.add_argument("--requests", type=int, default=2000)
+    sys.exit(asyncio.run(main(parser.parse_args())))
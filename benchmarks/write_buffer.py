@@ -0,0 +1,61 @@
+"""
+Сравнение пропускной способности записи: отдельная транзакция на каждую
+операцию против буфера групповой записи. Отдельные транзакции под такой
+нагрузкой могут упираться в блокировку базы («database is locked»); такие записи
+считаются неудачными и печатаются, скорость считается по сохранённым. Буфер
+групповой записи обязан сохранить всё.
+
+    python benchmarks/write_buffer.py [--writes 2000] [--concurrency 200]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+for var in ("BOT_TOKEN", "VK_TOKEN", "DATABASE_URL"):
+    os.environ.setdefault(var, "benchmark")
+
+import database  # noqa: E402
+from write_buffer import GroupCommitWriter  # noqa: E402
+
+
+async def run(use_buffer: bool, writes: int, concurrency: int) -> tuple:
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(), "links.db")
+    await database.init_db()
+    if use_buffer:
+        database.write_buffer = GroupCommitWriter(database.DB_PATH)
+        await database.write_buffer.start()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def write(i: int) -> bool:
+        async with semaphore:
+            return await database.save_link(i % 100, f"https://example.com/{i}", f"https://vk.cc/b{i}", "bench", f"b{i}")
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(write(i) for i in range(writes)))
+    elapsed = time.perf_counter() - started
+    saved = sum(results)
+    batches = database.write_buffer.batches if use_buffer else saved
+    await database.stop_write_buffer()
+    if use_buffer:
+        assert saved == writes, "часть записей через буфер не сохранилась"
+    return saved / elapsed, batches, writes - saved
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--writes", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    args = parser.parse_args()
+    direct, _, failed = await run(False, args.writes, args.concurrency)
+    buffered, batches, _ = await run(True, args.writes, args.concurrency)
+    print(f"отдельные транзакции: {direct:8.0f} записей/с, не сохранено из-за блокировки: {failed}")
+    print(f"групповая запись:     {buffered:8.0f} записей/с (x{buffered / direct:.1f}), "
+          f"пакетов {batches}, в среднем {args.writes / batches:.1f} операций")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
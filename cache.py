@@ -0,0 +1,61 @@
+from collections import OrderedDict, namedtuple
+from typing import Any, Dict, Hashable, Optional
+
+LinkRow = namedtuple("LinkRow", "id user_id original_url short_url title vk_key created_at")
+
+
+class LRUCache:
+    """
+    Ограниченный по размеру LRU-кэш со счётчиками попаданий.
+
+    Чтобы чтение, начатое до записи в БД, не положило в кэш старое значение
+    после инвалидации, put принимает эпоху, полученную до чтения: любая
+    инвалидация увеличивает эпоху, и такие «опоздавшие» значения отбрасываются.
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: Hashable, value: Any, epoch: int) -> None:
+        if epoch != self.epoch or value is None:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self.epoch += 1
+        self.invalidations += 1
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self.epoch += 1
+        self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -4,6 +4,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.exceptions import TelegramBadRequest
 
+from config import MAX_TITLE_LENGTH
 from database import get_link_by_id, delete_link, rename_link
 from keyboards import main_menu, link_inline_keyboard
 
@@ -78,8 +79,8 @@ async def process_rename(message: Message, state: FSMContext):
     link_id = data.get("rename_id")
     user_id = message.from_user.id
 
-    if not new_title or len(new_title) > 100:
-        await message.answer("❌ Название не может быть пустым или длиннее 100 символов.")
+    if not new_title or len(new_title) > MAX_TITLE_LENGTH:
+        await message.answer(f"❌ Название не может быть пустым или длиннее {MAX_TITLE_LENGTH} символов.")
         await state.clear()
         return
 
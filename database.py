@@ -1,35 +1,570 @@
 import aiosqlite
+import json
 import logging
-from datetime import datetime
-from typing import Optional, List, Tuple
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, List, Set, Tuple
+
+from cache import LRUCache, LinkRow
+from config import (
+    LINK_CACHE_SIZE,
+    WRITE_BUFFER_ENABLED,
+    WRITE_BUFFER_MAX_BATCH,
+    WRITE_BUFFER_MAX_DELAY,
+    DB_CONCURRENCY,
+    BULK_UNDO_SECONDS,
+    MAX_TITLE_LENGTH,
+)
+from utils import summarize_stats
+from ratelimit import PriorityLimiter, gate_module
+from tracing import instrument_module
+from write_buffer import GroupCommitWriter, WriteResult
 
 logger = logging.getLogger(__name__)
 
+# Строки ссылок по (user_id, link_id); сбрасываются в save_link, rename_link и delete_link
+link_cache = LRUCache(LINK_CACHE_SIZE)
+
+# Необязательный буфер групповой записи (WRITE_BUFFER=1), запускается из main
+write_buffer: Optional[GroupCommitWriter] = None
+
 
 DB_PATH = "links.db"
 
+# FTS5 может отсутствовать в сборке SQLite — тогда поиск работает через LIKE
+fts_enabled = False
+
 
 async def init_db():
     try:
         async with aiosqlite.connect(DB_PATH) as db:
+            # WAL: читатели (в том числе резервное копирование, backup.py) не блокируют запись
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute(LINKS_TABLE_SQL.format(name="links"))
+            await drop_global_short_url_unique(db)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON links (user_id)")
+            await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_links_user_short ON links (user_id, short_url)")
             await db.execute("""
-                CREATE TABLE IF NOT EXISTS links (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    original_url TEXT,
-                    short_url TEXT UNIQUE,
-                    title TEXT,
+                CREATE TABLE IF NOT EXISTS short_url_cache (
+                    canonical_url TEXT PRIMARY KEY,
+                    short_url TEXT,
                     vk_key TEXT,
+                    hits INTEGER DEFAULT 0,
                     created_at TEXT
                 )
             """)
-            await db.execute("CREATE INDEX IF NOT EXISTS idx_user_id ON links (user_id)")
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS geo_names (
+                    kind TEXT,
+                    id INTEGER,
+                    name TEXT,
+                    PRIMARY KEY (kind, id)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS user_settings (
+                    user_id INTEGER PRIMARY KEY,
+                    distinct_keys INTEGER DEFAULT 0
+                )
+            """)
+            await init_search_index(db)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS link_stats (
+                    link_id INTEGER PRIMARY KEY,
+                    views INTEGER,
+                    payload TEXT,
+                    fetched_at TEXT
+                )
+            """)
+            await add_column_if_missing(db, "link_stats", "user_id", "INTEGER")
+            await add_column_if_missing(db, "link_stats", "base_views", "INTEGER DEFAULT 0")
+            await add_column_if_missing(db, "link_stats", "base_at", "TEXT")
+            await add_column_if_missing(db, "link_stats", "growth", "INTEGER DEFAULT 0")
+            await add_column_if_missing(db, "link_stats", "summary", "TEXT")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_link_stats_views ON link_stats (user_id, views)")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_link_stats_growth ON link_stats (user_id, growth)")
+            await add_column_if_missing(db, "link_stats", "digest_views", "INTEGER")
+            await add_column_if_missing(db, "link_stats", "views_changed_at", "TEXT")
+            await add_column_if_missing(db, "user_settings", "digest", "TEXT")
+            await add_column_if_missing(db, "user_settings", "digest_chat_id", "INTEGER")
+            await add_column_if_missing(db, "user_settings", "digest_next_at", "REAL")
+            await db.execute(
+                "CREATE INDEX IF NOT EXISTS idx_user_settings_digest ON user_settings (digest_next_at) "
+                "WHERE digest IS NOT NULL"
+            )
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER,
+                    user_id INTEGER,
+                    kind TEXT,
+                    text TEXT,
+                    status TEXT DEFAULT 'pending',
+                    attempts INTEGER DEFAULT 0,
+                    error TEXT,
+                    created_at TEXT,
+                    sent_at TEXT
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status ON outbox (status, id)")
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    chat_id INTEGER,
+                    message_id INTEGER,
+                    kind TEXT,
+                    status TEXT DEFAULT 'pending',
+                    payload TEXT,
+                    total INTEGER DEFAULT 0,
+                    attempts INTEGER DEFAULT 0,
+                    locked_by TEXT,
+                    heartbeat_at REAL,
+                    error TEXT,
+                    created_at TEXT,
+                    finished_at TEXT
+                )
+            """)
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS job_items (
+                    job_id INTEGER,
+                    idx INTEGER,
+                    payload TEXT,
+                    status TEXT DEFAULT 'pending',
+                    result TEXT,
+                    PRIMARY KEY (job_id, idx)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS undo_log (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    kind TEXT,
+                    payload TEXT,
+                    expires_at REAL
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS qr_files (
+                    short_url TEXT PRIMARY KEY,
+                    file_id TEXT
+                )
+            """)
+            await db.execute(LINKS_TABLE_SQL.format(name="links_archive"))
+            await add_column_if_missing(db, "links_archive", "archived_at", "TEXT")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_links_archive_user ON links_archive (user_id, id)")
+            await init_user_counters(db)
             await db.commit()
             logger.info("База данных links.db инициализирована или проверена.")
     except Exception as e:
         logger.error(f"Ошибка инициализации базы данных: {e}")
 
 
+# Один short_url может принадлежать нескольким пользователям (общий кэш сокращений),
+# поэтому уникальность short_url — только в пределах пользователя
+LINKS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {name} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        original_url TEXT,
+        short_url TEXT,
+        title TEXT,
+        vk_key TEXT,
+        created_at TEXT
+    )
+"""
+
+
+async def drop_global_short_url_unique(db) -> None:
+    """Пересоздаёт links без UNIQUE на short_url для баз, созданных старыми версиями."""
+    async with db.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'links'") as cursor:
+        row = await cursor.fetchone()
+    if not row or "short_url TEXT UNIQUE" not in row[0]:
+        return
+    await db.execute("DROP TABLE IF EXISTS links_migrated")
+    await db.execute(LINKS_TABLE_SQL.format(name="links_migrated"))
+    await db.execute(
+        "INSERT INTO links_migrated (id, user_id, original_url, short_url, title, vk_key, created_at) "
+        "SELECT id, user_id, original_url, short_url, title, vk_key, created_at FROM links"
+    )
+    # Вместе с таблицей удаляются её индексы и триггеры — их пересоздаёт init_db
+    await db.execute("DROP TABLE links")
+    await db.execute("ALTER TABLE links_migrated RENAME TO links")
+    await db.commit()
+    logger.info("Таблица links пересоздана без глобальной уникальности short_url.")
+
+
+async def add_column_if_missing(db, table: str, column: str, declaration: str) -> None:
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    if column not in columns:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        logger.info(f"Добавлена колонка {table}.{column}")
+
+
+async def init_search_index(db) -> None:
+    """Полнотекстовый индекс по названию и адресам ссылок, синхронизируется триггерами."""
+    global fts_enabled
+    try:
+        async with db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'links_fts'"
+        ) as cursor:
+            exists = await cursor.fetchone() is not None
+        await db.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS links_fts USING fts5(
+                title, original_url, short_url,
+                content='links', content_rowid='id', tokenize='unicode61'
+            )
+        """)
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS links_fts_ai AFTER INSERT ON links BEGIN
+                INSERT INTO links_fts (rowid, title, original_url, short_url)
+                VALUES (new.id, new.title, new.original_url, new.short_url);
+            END
+        """)
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS links_fts_ad AFTER DELETE ON links BEGIN
+                INSERT INTO links_fts (links_fts, rowid, title, original_url, short_url)
+                VALUES ('delete', old.id, old.title, old.original_url, old.short_url);
+            END
+        """)
+        await db.execute("""
+            CREATE TRIGGER IF NOT EXISTS links_fts_au AFTER UPDATE OF title, original_url, short_url ON links BEGIN
+                INSERT INTO links_fts (links_fts, rowid, title, original_url, short_url)
+                VALUES ('delete', old.id, old.title, old.original_url, old.short_url);
+                INSERT INTO links_fts (rowid, title, original_url, short_url)
+                VALUES (new.id, new.title, new.original_url, new.short_url);
+            END
+        """)
+        if not exists:
+            await db.execute("INSERT INTO links_fts (links_fts) VALUES ('rebuild')")
+            logger.info("Поисковый индекс links_fts построен.")
+        fts_enabled = True
+    except aiosqlite.OperationalError as e:
+        fts_enabled = False
+        logger.warning(f"FTS5 недоступен, поиск будет работать через LIKE: {e}")
+
+
+# Счётчики по пользователю (число ссылок, из них в архиве, сумма просмотров, последнее
+# изменение) и общие итоги (строка id = 0) ведутся триггерами в той же транзакции, что и
+# запись в links, links_archive и link_stats, — поэтому верны и при групповой записи.
+# Ссылки в архиве считаются ссылками пользователя: перенос в архив и обратно (строка с тем
+# же id уже есть в другой таблице) меняет только archived_count. Просмотры считаются только
+# у существующих ссылок: снимок удалённой ссылки в сумму не входит.
+_COUNTERS_NOW = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+_STATS_VIEWS = "COALESCE((SELECT views FROM link_stats WHERE link_id = {}.id), 0)"
+_LINK_EXISTS = (
+    "(EXISTS (SELECT 1 FROM links WHERE id = {0}) OR EXISTS (SELECT 1 FROM links_archive WHERE id = {0}))"
+)
+_LINK_OWNER = "COALESCE((SELECT user_id FROM links WHERE id = {0}), (SELECT user_id FROM links_archive WHERE id = {0}))"
+
+
+def _link_removed_sql(row: str) -> str:
+    """Тело триггера: ссылка row удалена совсем — минус из счётчиков пользователя и итогов."""
+    return f"""
+            UPDATE user_counters SET
+                link_count = link_count - 1,
+                total_views = total_views - {_STATS_VIEWS.format(row)},
+                last_activity = {_COUNTERS_NOW}
+            WHERE user_id = {row}.user_id;
+            UPDATE counter_totals SET
+                users = users - (COALESCE((SELECT link_count FROM user_counters WHERE user_id = {row}.user_id), 0) = 0),
+                links = links - 1,
+                views = views - {_STATS_VIEWS.format(row)},
+                last_activity = {_COUNTERS_NOW}
+            WHERE id = 0;"""
+
+
+USER_COUNTERS_TRIGGERS = {
+    "user_counters_links_ai": f"""
+        AFTER INSERT ON links WHEN NOT EXISTS (SELECT 1 FROM links_archive WHERE id = new.id) BEGIN
+            UPDATE counter_totals SET
+                users = users + (COALESCE((SELECT link_count FROM user_counters WHERE user_id = new.user_id), 0) = 0),
+                links = links + 1,
+                views = views + {_STATS_VIEWS.format("new")},
+                last_activity = new.created_at
+            WHERE id = 0;
+            INSERT INTO user_counters (user_id, link_count, total_views, last_activity)
+            VALUES (new.user_id, 1, {_STATS_VIEWS.format("new")}, new.created_at)
+            ON CONFLICT (user_id) DO UPDATE SET
+                link_count = link_count + 1,
+                total_views = total_views + excluded.total_views,
+                last_activity = excluded.last_activity;
+        END
+    """,
+    "user_counters_links_ad": f"""
+        AFTER DELETE ON links WHEN NOT EXISTS (SELECT 1 FROM links_archive WHERE id = old.id) BEGIN
+            {_link_removed_sql("old")}
+        END
+    """,
+    "user_counters_archive_ai": """
+        AFTER INSERT ON links_archive BEGIN
+            UPDATE user_counters SET archived_count = archived_count + 1 WHERE user_id = new.user_id;
+            UPDATE counter_totals SET archived = archived + 1 WHERE id = 0;
+        END
+    """,
+    "user_counters_archive_ad": """
+        AFTER DELETE ON links_archive BEGIN
+            UPDATE user_counters SET archived_count = archived_count - 1 WHERE user_id = old.user_id;
+            UPDATE counter_totals SET archived = archived - 1 WHERE id = 0;
+        END
+    """,
+    "user_counters_archive_purge": f"""
+        AFTER DELETE ON links_archive WHEN NOT EXISTS (SELECT 1 FROM links WHERE id = old.id) BEGIN
+            {_link_removed_sql("old")}
+        END
+    """,
+    "user_counters_stats_ai": f"""
+        AFTER INSERT ON link_stats WHEN {_LINK_EXISTS.format("new.link_id")} BEGIN
+            UPDATE user_counters SET total_views = total_views + COALESCE(new.views, 0)
+            WHERE user_id = {_LINK_OWNER.format("new.link_id")};
+            UPDATE counter_totals SET views = views + COALESCE(new.views, 0) WHERE id = 0;
+        END
+    """,
+    "user_counters_stats_au": f"""
+        AFTER UPDATE OF views ON link_stats
+        WHEN new.views IS NOT old.views AND {_LINK_EXISTS.format("new.link_id")} BEGIN
+            UPDATE user_counters SET total_views = total_views + COALESCE(new.views, 0) - COALESCE(old.views, 0)
+            WHERE user_id = {_LINK_OWNER.format("new.link_id")};
+            UPDATE counter_totals SET views = views + COALESCE(new.views, 0) - COALESCE(old.views, 0) WHERE id = 0;
+        END
+    """,
+}
+
+
+async def init_user_counters(db) -> None:
+    """
+    Таблицы и триггеры счётчиков. Триггеры пересоздаются при каждом старте, чтобы база
+    получала их текущие определения; там, где счётчиков ещё не было, они строятся по данным.
+    """
+    async with db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_counters'"
+    ) as cursor:
+        exists = await cursor.fetchone() is not None
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_counters (
+            user_id INTEGER PRIMARY KEY,
+            link_count INTEGER DEFAULT 0,
+            total_views INTEGER DEFAULT 0,
+            last_activity TEXT
+        )
+    """)
+    await add_column_if_missing(db, "user_counters", "archived_count", "INTEGER DEFAULT 0")
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS counter_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            users INTEGER DEFAULT 0,
+            links INTEGER DEFAULT 0,
+            views INTEGER DEFAULT 0,
+            last_activity TEXT
+        )
+    """)
+    await add_column_if_missing(db, "counter_totals", "archived", "INTEGER DEFAULT 0")
+    await db.execute("INSERT OR IGNORE INTO counter_totals (id) VALUES (0)")
+    for name, body in USER_COUNTERS_TRIGGERS.items():
+        await db.execute(f"DROP TRIGGER IF EXISTS {name}")
+        await db.execute(f"CREATE TRIGGER {name} {body}")
+    if not exists:
+        await _rebuild_user_counters(db)
+        logger.info("Счётчики пользователей построены.")
+
+
+_EXPECTED_COUNTERS_SQL = """
+    SELECT l.user_id, COUNT(*), SUM(l.archived), COALESCE(SUM(s.views), 0), MAX(l.created_at)
+    FROM (
+        SELECT id, user_id, created_at, 0 AS archived FROM links
+        UNION ALL
+        SELECT id, user_id, created_at, 1 AS archived FROM links_archive
+    ) l LEFT JOIN link_stats s ON s.link_id = l.id
+    GROUP BY l.user_id
+"""
+
+
+async def _rebuild_user_counters(db) -> Tuple[int, bool]:
+    """
+    Пересчитывает счётчики по links, links_archive и link_stats внутри текущей транзакции.
+    Время последней активности сохраняется (удаления по данным не восстановить).
+    Возвращает число пользователей с расхождением и было ли расхождение в общих итогах.
+    """
+    async with db.execute(_EXPECTED_COUNTERS_SQL) as cursor:
+        expected = {row[0]: row[1:] for row in await cursor.fetchall()}
+    async with db.execute(
+        "SELECT user_id, link_count, archived_count, total_views, last_activity FROM user_counters"
+    ) as cursor:
+        stored = {row[0]: row[1:] for row in await cursor.fetchall()}
+    async with db.execute("SELECT users, links, archived, views FROM counter_totals WHERE id = 0") as cursor:
+        totals = tuple(await cursor.fetchone())
+
+    mismatched = 0
+    rows = []
+    for user_id in expected.keys() | stored.keys():
+        link_count, archived_count, total_views, created = expected.get(user_id, (0, 0, 0, None))
+        old = stored.get(user_id, (0, 0, 0, None))
+        if (link_count, archived_count, total_views) != tuple(old[:3]):
+            mismatched += 1
+        last_activity = max(filter(None, (created, old[3])), default=None)
+        rows.append((user_id, link_count, archived_count, total_views, last_activity))
+    expected_totals = (
+        sum(1 for count, _, _, _ in expected.values() if count),
+        sum(count for count, _, _, _ in expected.values()),
+        sum(archived for _, archived, _, _ in expected.values()),
+        sum(views for _, _, views, _ in expected.values()),
+    )
+
+    await db.execute("DELETE FROM user_counters")
+    await db.executemany(
+        "INSERT INTO user_counters (user_id, link_count, archived_count, total_views, last_activity) "
+        "VALUES (?, ?, ?, ?, ?)",
+        rows
+    )
+    await db.execute(
+        "UPDATE counter_totals SET users = ?, links = ?, archived = ?, views = ?, "
+        "last_activity = (SELECT MAX(last_activity) FROM user_counters) WHERE id = 0",
+        expected_totals
+    )
+    return mismatched, totals != expected_totals
+
+
+async def rebuild_user_counters() -> Optional[Tuple[int, bool]]:
+    """
+    Проверка согласованности: пересчитывает счётчики с нуля одной транзакцией и
+    возвращает (пользователей с расхождением, расходились ли общие итоги) или None при ошибке.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            result = await _rebuild_user_counters(db)
+            await db.commit()
+        if result[0] or result[1]:
+            logger.warning(f"Счётчики пользователей расходились с данными: пользователей {result[0]}, "
+                           f"общие итоги {'да' if result[1] else 'нет'}; пересчитаны")
+        return result
+    except Exception as e:
+        logger.error(f"Ошибка при пересчёте счётчиков пользователей: {e}")
+        return None
+
+
+async def get_user_counters(user_id: int) -> Tuple[int, int, int, Optional[str]]:
+    """
+    (число ссылок, из них в архиве, сумма просмотров, последнее изменение) пользователя —
+    одна строка по ключу.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT link_count, archived_count, total_views, last_activity FROM user_counters WHERE user_id = ?",
+                (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return tuple(row) if row else (0, 0, 0, None)
+    except Exception as e:
+        logger.error(f"Ошибка при получении счётчиков пользователя: {e}")
+        return 0, 0, 0, None
+
+
+async def get_counter_totals() -> Tuple[int, int, int, int, Optional[str]]:
+    """Общие итоги: (пользователей со ссылками, ссылок, из них в архиве, просмотров, последнее изменение)."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT users, links, archived, views, last_activity FROM counter_totals WHERE id = 0"
+            ) as cursor:
+                row = await cursor.fetchone()
+                return tuple(row) if row else (0, 0, 0, 0, None)
+    except Exception as e:
+        logger.error(f"Ошибка при получении общих итогов: {e}")
+        return 0, 0, 0, 0, None
+
+
+# Служебные части адресов, которые есть почти в каждой ссылке и только раздувают выборку
+_SEARCH_STOPWORDS = {"http", "https", "www"}
+
+# bm25 считается только для стольких самых новых совпадений: иначе запрос из частого
+# слова у пользователя со 100k ссылок ранжирует десятки тысяч строк. Более старые
+# совпадения идут следом, без ранжирования, от новых к старым
+SEARCH_RANK_WINDOW = 250
+
+
+def build_fts_query(query: str) -> str:
+    """Превращает ввод пользователя в FTS5-запрос: все слова обязательны, последнее — как префикс."""
+    tokens = [t for t in re.findall(r"\w+", query.lower()) if t not in _SEARCH_STOPWORDS]
+    if not tokens:
+        return ""
+    return " ".join([f'"{t}"' for t in tokens[:-1]] + [f'"{tokens[-1]}"*'])
+
+
+def like_pattern(query: str) -> str:
+    """Подстрока для LIKE ... ESCAPE '\\': % и _ из ввода ищутся как обычные символы."""
+    escaped = query.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+_FTS_MATCHES = """
+    FROM links_fts CROSS JOIN links l ON l.id = links_fts.rowid
+    WHERE links_fts MATCH ? AND l.user_id = ?
+"""
+
+
+async def search_links(user_id: int, query: str, limit: int = 5, offset: int = 0) -> Tuple[List[Tuple], bool]:
+    """
+    Ищет ссылки пользователя по названию, исходному и короткому URL.
+    Возвращает строки (id, title, short_url, created_at) и признак того, что есть
+    следующая страница. SEARCH_RANK_WINDOW самых новых совпадений — по убыванию
+    релевантности, остальные — за ними, от новых к старым.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            fts_query = build_fts_query(query) if fts_enabled else ""
+            if not fts_query:
+                pattern = like_pattern(query)
+                async with db.execute(
+                    "SELECT id, title, short_url, created_at FROM links "
+                    "WHERE user_id = ? AND (title LIKE ? ESCAPE '\\' OR original_url LIKE ? ESCAPE '\\' "
+                    "OR short_url LIKE ? ESCAPE '\\') "
+                    "ORDER BY id DESC LIMIT ? OFFSET ?",
+                    (user_id, pattern, pattern, pattern, limit + 1, offset)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+                return rows[:limit], len(rows) > limit
+
+            rows = []
+            if offset < SEARCH_RANK_WINDOW:
+                # CROSS JOIN не даёт планировщику начать с idx_user_id и проверять MATCH построчно
+                async with db.execute(
+                    f"""
+                    SELECT id, title, short_url, created_at FROM (
+                        SELECT l.id, l.title, l.short_url, l.created_at,
+                               bm25(links_fts, 10.0, 2.0, 2.0) AS score
+                        {_FTS_MATCHES}
+                        ORDER BY links_fts.rowid DESC LIMIT ?
+                    ) ORDER BY score, id DESC LIMIT ? OFFSET ?
+                    """,
+                    (fts_query, user_id, SEARCH_RANK_WINDOW, limit + 1, offset)
+                ) as cursor:
+                    rows = list(await cursor.fetchall())
+            if len(rows) <= limit:
+                # Окно ранжирования кончилось на этой странице — дальше совпадения старше окна
+                async with db.execute(
+                    f"SELECT COUNT(*), MIN(rowid) FROM (SELECT links_fts.rowid {_FTS_MATCHES} "
+                    "ORDER BY links_fts.rowid DESC LIMIT ?)",
+                    (fts_query, user_id, SEARCH_RANK_WINDOW)
+                ) as cursor:
+                    ranked, oldest = await cursor.fetchone()
+                if ranked == SEARCH_RANK_WINDOW:
+                    async with db.execute(
+                        f"SELECT l.id, l.title, l.short_url, l.created_at {_FTS_MATCHES} AND links_fts.rowid < ? "
+                        "ORDER BY links_fts.rowid DESC LIMIT ? OFFSET ?",
+                        (fts_query, user_id, oldest, limit + 1 - len(rows), max(0, offset - SEARCH_RANK_WINDOW))
+                    ) as cursor:
+                        rows += await cursor.fetchall()
+            return rows[:limit], len(rows) > limit
+    except Exception as e:
+        logger.error(f"Ошибка при поиске ссылок: {e}")
+        return [], False
+
+
 async def is_duplicate_link(user_id: int, original_url: str) -> bool:
     try:
         async with aiosqlite.connect(DB_PATH) as db:
@@ -46,6 +581,23 @@ async def is_duplicate_link(user_id: int, original_url: str) -> bool:
 check_duplicate_link = is_duplicate_link
 
 
+async def get_existing_original_urls(user_id: int, urls: List[str]) -> Set[str]:
+    """Какие из urls уже сохранены у пользователя — одним запросом на весь список."""
+    if not urls:
+        return set()
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT original_url FROM links "
+                "WHERE user_id = ? AND original_url IN (SELECT value FROM json_each(?))",
+                (user_id, json.dumps(urls))
+            ) as cursor:
+                return {row[0] for row in await cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Ошибка при проверке дубликатов списка: {e}")
+        return set()
+
+
 async def get_link_by_original_url(user_id: int, original_url: str) -> Optional[Tuple]:
     try:
         async with aiosqlite.connect(DB_PATH) as db:
@@ -60,18 +612,48 @@ async def get_link_by_original_url(user_id: int, original_url: str) -> Optional[
         return None
 
 
+async def execute_write(sql: str, params: tuple) -> WriteResult:
+    """
+    Выполняет одну пишущую операцию: через буфер групповой записи, если он запущен,
+    иначе — отдельной транзакцией. В обоих случаях возвращается после коммита.
+    """
+    if write_buffer is not None and write_buffer.running:
+        return await write_buffer.execute(sql, params)
+    return await _execute_direct(sql, params)
+
+
+async def _execute_direct(sql: str, params: tuple) -> WriteResult:
+    async with aiosqlite.connect(DB_PATH) as db:
+        cursor = await db.execute(sql, params)
+        await db.commit()
+        return WriteResult(cursor.rowcount, cursor.lastrowid)
+
+
+async def start_write_buffer() -> None:
+    global write_buffer
+    if WRITE_BUFFER_ENABLED and write_buffer is None:
+        write_buffer = GroupCommitWriter(DB_PATH, WRITE_BUFFER_MAX_BATCH, WRITE_BUFFER_MAX_DELAY)
+        await write_buffer.start()
+
+
+async def stop_write_buffer() -> None:
+    global write_buffer
+    if write_buffer is not None:
+        await write_buffer.stop()
+        write_buffer = None
+
+
 async def save_link(user_id: int, original_url: str, short_url: str, title: str, vk_key: str) -> bool:
     try:
-        async with aiosqlite.connect(DB_PATH) as db:
-            await db.execute(
-                """
-                INSERT INTO links (user_id, original_url, short_url, title, vk_key, created_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """,
-                (user_id, original_url, short_url, title, vk_key, datetime.now().isoformat())
-            )
-            await db.commit()
-            return True
+        result = await execute_write(
+            """
+            INSERT INTO links (user_id, original_url, short_url, title, vk_key, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, original_url, short_url, title, vk_key, datetime.now().isoformat())
+        )
+        link_cache.invalidate((user_id, result.lastrowid))
+        return True
     except aiosqlite.IntegrityError:
         logger.warning(f"Попытка добавить дубликат short_url: {short_url}")
         return False
@@ -80,20 +662,92 @@ async def save_link(user_id: int, original_url: str, short_url: str, title: str,
         return False
 
 
-async def get_links_by_user(user_id: int) -> List[Tuple]:
+LINK_SORT_COLUMNS = {"views": "views", "growth": "growth"}
+
+
+async def get_links_by_user(user_id: int, sort: Optional[str] = None) -> List[Tuple]:
+    """
+    Ссылки пользователя в порядке добавления или, при sort='views'/'growth',
+    по сохранённой статистике (по индексу link_stats); ссылки без снимка идут в конце.
+    """
     try:
         async with aiosqlite.connect(DB_PATH) as db:
+            column = LINK_SORT_COLUMNS.get(sort)
+            if column is None:
+                async with db.execute(
+                    "SELECT id, title, short_url, created_at FROM links WHERE user_id = ?",
+                    (user_id,)
+                ) as cursor:
+                    return await cursor.fetchall()
             async with db.execute(
-                "SELECT id, title, short_url, created_at FROM links WHERE user_id = ?",
+                f"SELECT l.id, l.title, l.short_url, l.created_at FROM link_stats s "
+                f"JOIN links l ON l.id = s.link_id WHERE s.user_id = ? ORDER BY s.{column} DESC",
                 (user_id,)
             ) as cursor:
-                return await cursor.fetchall()
+                ranked = await cursor.fetchall()
+            async with db.execute(
+                "SELECT id, title, short_url, created_at FROM links WHERE user_id = ? "
+                "AND id NOT IN (SELECT link_id FROM link_stats WHERE user_id = ?)",
+                (user_id, user_id)
+            ) as cursor:
+                return ranked + await cursor.fetchall()
     except Exception as e:
         logger.error(f"Ошибка при получении ссылок пользователя: {e}")
         return []
 
 
-async def get_link_by_id(link_id: int, user_id: int) -> Optional[Tuple]:
+async def get_links_page(user_id: int, sort: Optional[str], offset: int, limit: int) -> Tuple[List[Tuple], int, int]:
+    """
+    Одна страница списка в том же порядке, что и get_links_by_user, число ссылок в
+    списке и число ссылок в архиве (оба из user_counters, без подсчёта строк).
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT link_count, archived_count FROM user_counters WHERE user_id = ?", (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                total, archived = (row[0] - row[1], row[1]) if row else (0, 0)
+            column = LINK_SORT_COLUMNS.get(sort)
+            if column is None:
+                async with db.execute(
+                    "SELECT id, title, short_url, created_at FROM links WHERE user_id = ? "
+                    "ORDER BY id LIMIT ? OFFSET ?",
+                    (user_id, limit, offset)
+                ) as cursor:
+                    return await cursor.fetchall(), total, archived
+            async with db.execute(
+                f"SELECT l.id, l.title, l.short_url, l.created_at FROM link_stats s "
+                f"JOIN links l ON l.id = s.link_id WHERE s.user_id = ? ORDER BY s.{column} DESC "
+                f"LIMIT ? OFFSET ?",
+                (user_id, limit, offset)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            if len(rows) < limit:
+                async with db.execute(
+                    "SELECT COUNT(*) FROM link_stats s JOIN links l ON l.id = s.link_id WHERE s.user_id = ?",
+                    (user_id,)
+                ) as cursor:
+                    ranked = (await cursor.fetchone())[0]
+                async with db.execute(
+                    "SELECT id, title, short_url, created_at FROM links WHERE user_id = ? "
+                    "AND id NOT IN (SELECT link_id FROM link_stats WHERE user_id = ?) "
+                    "ORDER BY id LIMIT ? OFFSET ?",
+                    (user_id, user_id, limit - len(rows), max(0, offset - ranked))
+                ) as cursor:
+                    rows += await cursor.fetchall()
+            return rows, total, archived
+    except Exception as e:
+        logger.error(f"Ошибка при получении страницы ссылок: {e}")
+        return [], 0, 0
+
+
+async def get_link_by_id(link_id: int, user_id: int) -> Optional[LinkRow]:
+    key = (user_id, link_id)
+    cached = link_cache.get(key)
+    if cached is not None:
+        return cached
+    epoch = link_cache.epoch
     try:
         async with aiosqlite.connect(DB_PATH) as db:
             async with db.execute(
@@ -101,37 +755,902 @@ async def get_link_by_id(link_id: int, user_id: int) -> Optional[Tuple]:
                 "FROM links WHERE id = ? AND user_id = ?",
                 (link_id, user_id)
             ) as cursor:
-                return await cursor.fetchone()
+                row = await cursor.fetchone()
+        link = LinkRow(*row) if row else None
+        link_cache.put(key, link, epoch)
+        return link
     except Exception as e:
         logger.error(f"Ошибка при получении ссылки по ID: {e}")
         return None
 
 
 async def delete_link(link_id: int, user_id: int) -> bool:
+    try:
+        result = await execute_write(
+            "DELETE FROM links WHERE id = ? AND user_id = ?",
+            (link_id, user_id)
+        )
+        link_cache.invalidate((user_id, link_id))
+        if result.rowcount == 0:
+            logger.warning(f"Попытка удалить несуществующую ссылку: id={link_id}, user_id={user_id}")
+        return result.rowcount > 0
+    except Exception as e:
+        logger.error(f"Ошибка при удалении ссылки: {e}")
+        return False
+
+
+async def rename_link(link_id: int, user_id: int, new_title: str) -> bool:
+    try:
+        result = await execute_write(
+            "UPDATE links SET title = ? WHERE id = ? AND user_id = ?",
+            (new_title, link_id, user_id)
+        )
+        link_cache.invalidate((user_id, link_id))
+        return result.rowcount > 0
+    except Exception as e:
+        logger.error(f"Ошибка при переименовании ссылки: {e}")
+        return False
+
+
+# Архив: ссылки без новых переходов дольше ARCHIVE_AFTER_DAYS переносятся из links в
+# links_archive (archive.py), чтобы links и его индексы оставались небольшими. Перенос
+# сохраняет id, поэтому снимки статистики и счётчики переходят вместе со ссылкой.
+
+_ARCHIVE_COLUMNS = "id, user_id, original_url, short_url, title, vk_key, created_at"
+
+# Неактивна: просмотры не менялись с cutoff; без снимка — считаем от создания ссылки,
+# снимок старой версии без views_changed_at — от момента, когда видели просмотры
+_INACTIVE_SINCE = "COALESCE(s.views_changed_at, CASE WHEN s.views > 0 THEN s.fetched_at END, l.created_at)"
+
+
+async def archive_inactive_links(cutoff: str, after_id: int, scan: int) -> Tuple[int, Optional[int]]:
+    """
+    Просматривает до scan ссылок с id > after_id и переносит неактивные с cutoff
+    в архив одной короткой транзакцией. Возвращает (перенесено, id, с которого
+    продолжать) или (перенесено, None), если дальше только ссылки новее cutoff.
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute(
+                f"SELECT l.id, l.user_id, l.created_at, {_INACTIVE_SINCE} < ? FROM links l "
+                "LEFT JOIN link_stats s ON s.link_id = l.id WHERE l.id > ? ORDER BY l.id LIMIT ?",
+                (cutoff, after_id, scan)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            moved = [(link_id, user_id) for link_id, user_id, _, inactive in rows if inactive]
+            if moved:
+                ids = json.dumps([link_id for link_id, _ in moved])
+                await db.execute(
+                    f"INSERT INTO links_archive ({_ARCHIVE_COLUMNS}, archived_at) "
+                    f"SELECT {_ARCHIVE_COLUMNS}, ? FROM links WHERE id IN (SELECT value FROM json_each(?))",
+                    (datetime.now().isoformat(), ids)
+                )
+                await db.execute("DELETE FROM links WHERE id IN (SELECT value FROM json_each(?))", (ids,))
+            await db.commit()
+        for link_id, user_id in moved:
+            link_cache.invalidate((user_id, link_id))
+        # id растут вместе с created_at: дошли до ссылок новее cutoff — проход окончен
+        if len(rows) < scan or rows[-1][2] >= cutoff:
+            return len(moved), None
+        return len(moved), rows[-1][0]
+    except Exception as e:
+        logger.error(f"Ошибка при переносе ссылок в архив: {e}")
+        return 0, None
+
+
+async def restore_archived_links(user_id: int, ids: Optional[List[int]] = None) -> int:
+    """
+    Возвращает ссылки пользователя из архива в список (все, если ids не задан) одной
+    транзакцией. Ссылка, чей short_url пользователь тем временем добавил заново, остаётся
+    в архиве. Возвращает число восстановленных.
+    """
+    condition, param = ("1", None) if ids is None else _selection_filter(ids, False)
+    params = (user_id,) if ids is None else (user_id, param)
     try:
         async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("BEGIN IMMEDIATE")
             cursor = await db.execute(
-                "DELETE FROM links WHERE id = ? AND user_id = ?",
+                f"INSERT OR IGNORE INTO links ({_ARCHIVE_COLUMNS}) "
+                f"SELECT {_ARCHIVE_COLUMNS} FROM links_archive WHERE user_id = ? AND {condition}",
+                params
+            )
+            restored = cursor.rowcount
+            async with db.execute(
+                f"SELECT id FROM links_archive WHERE user_id = ? AND {condition} "
+                "AND id IN (SELECT id FROM links WHERE user_id = links_archive.user_id)",
+                params
+            ) as cursor:
+                restored_ids = [row[0] for row in await cursor.fetchall()]
+            await db.execute(
+                "DELETE FROM links_archive WHERE id IN (SELECT value FROM json_each(?))",
+                (json.dumps(restored_ids),)
+            )
+            await db.commit()
+        for link_id in restored_ids:
+            link_cache.invalidate((user_id, link_id))
+        return restored
+    except Exception as e:
+        logger.error(f"Ошибка при восстановлении ссылок из архива: {e}")
+        return 0
+
+
+async def restore_archived_url(user_id: int, original_url: str) -> Optional[str]:
+    """Если пользователь снова сокращает ссылку из архива — возвращает её в список; short_url или None."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT id, short_url FROM links_archive WHERE user_id = ? AND original_url = ?",
+                (user_id, original_url)
+            ) as cursor:
+                row = await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Ошибка при поиске ссылки в архиве: {e}")
+        return None
+    if row and await restore_archived_links(user_id, [row[0]]):
+        return row[1]
+    return None
+
+
+async def get_archived_link(link_id: int, user_id: int) -> Optional[LinkRow]:
+    """Ссылка из архива (для карточки и статистики); в кэш ссылок не попадает."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                f"SELECT {_ARCHIVE_COLUMNS} FROM links_archive WHERE id = ? AND user_id = ?",
                 (link_id, user_id)
+            ) as cursor:
+                row = await cursor.fetchone()
+        return LinkRow(*row) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении ссылки из архива: {e}")
+        return None
+
+
+async def get_archived_links(user_id: int, offset: int, limit: int, query: Optional[str] = None) -> Tuple[List[Tuple], bool]:
+    """
+    Страница архива (id, title, short_url, archived_at), новые сверху, и признак
+    следующей страницы. С query — поиск по названию и адресам (LIKE: архив не в FTS).
+    """
+    sql = "SELECT id, title, short_url, archived_at FROM links_archive WHERE user_id = ?"
+    params: List[Any] = [user_id]
+    if query:
+        pattern = like_pattern(query)
+        sql += " AND (title LIKE ? ESCAPE '\\' OR original_url LIKE ? ESCAPE '\\' OR short_url LIKE ? ESCAPE '\\')"
+        params += [pattern, pattern, pattern]
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(sql + " ORDER BY id DESC LIMIT ? OFFSET ?", (*params, limit + 1, offset)) as cursor:
+                rows = await cursor.fetchall()
+        return rows[:limit], len(rows) > limit
+    except Exception as e:
+        logger.error(f"Ошибка при получении архива ссылок: {e}")
+        return [], False
+
+
+# Массовые действия над выбором (selection.py): ids и exclude=True означают «все ссылки, кроме ids»
+
+def _selection_filter(ids: List[int], exclude: bool) -> Tuple[str, str]:
+    """Условие на links.id для выбора; список передаётся одним JSON-параметром (без лимита переменных)."""
+    return f"id {'NOT IN' if exclude else 'IN'} (SELECT value FROM json_each(?))", json.dumps(list(ids))
+
+
+async def get_selected_links(user_id: int, ids: List[int], exclude: bool) -> List[Tuple]:
+    """Выбранные ссылки строками (id, title, short_url, created_at), как в списке."""
+    condition, param = _selection_filter(ids, exclude)
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                f"SELECT id, title, short_url, created_at FROM links WHERE user_id = ? AND {condition} ORDER BY id",
+                (user_id, param)
+            ) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при получении выбранных ссылок: {e}")
+        return []
+
+
+async def _log_undo(db, user_id: int, kind: str, payload) -> int:
+    now = time.time()
+    await db.execute("DELETE FROM undo_log WHERE expires_at < ?", (now,))
+    cursor = await db.execute(
+        "INSERT INTO undo_log (user_id, kind, payload, expires_at) VALUES (?, ?, ?, ?)",
+        (user_id, kind, json.dumps(payload, ensure_ascii=False), now + BULK_UNDO_SECONDS)
+    )
+    return cursor.lastrowid
+
+
+async def delete_links_bulk(user_id: int, ids: List[int], exclude: bool) -> Optional[Tuple[int, int]]:
+    """
+    Удаляет выбранные ссылки одной транзакцией, сохраняя строки для отмены
+    в течение BULK_UNDO_SECONDS. Возвращает (ID отмены, число удалённых) или None при ошибке.
+    """
+    condition, param = _selection_filter(ids, exclude)
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute(
+                "SELECT id, user_id, original_url, short_url, title, vk_key, created_at "
+                f"FROM links WHERE user_id = ? AND {condition}",
+                (user_id, param)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            await db.execute("DELETE FROM links WHERE user_id = ? AND id IN (SELECT value FROM json_each(?))",
+                             (user_id, json.dumps([row[0] for row in rows])))
+            undo_id = await _log_undo(db, user_id, "delete", rows)
+            await db.commit()
+        for row in rows:
+            link_cache.invalidate((user_id, row[0]))
+        return undo_id, len(rows)
+    except Exception as e:
+        logger.error(f"Ошибка при массовом удалении ссылок: {e}")
+        return None
+
+
+async def prefix_titles_bulk(user_id: int, ids: List[int], exclude: bool,
+                             prefix: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Добавляет префикс к названиям выбранных ссылок одной транзакцией с возможностью
+    отмены; названия длиннее MAX_TITLE_LENGTH обрезаются. Возвращает (ID отмены,
+    число ссылок, число обрезанных названий) или None при ошибке.
+    """
+    condition, param = _selection_filter(ids, exclude)
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute(
+                f"SELECT id, title FROM links WHERE user_id = ? AND {condition}",
+                (user_id, param)
+            ) as cursor:
+                rows = await cursor.fetchall()
+            await db.execute(
+                "UPDATE links SET title = substr(? || COALESCE(title, ''), 1, ?) "
+                "WHERE user_id = ? AND id IN (SELECT value FROM json_each(?))",
+                (prefix, MAX_TITLE_LENGTH, user_id, json.dumps([row[0] for row in rows]))
             )
+            undo_id = await _log_undo(db, user_id, "retitle", rows)
             await db.commit()
-            if cursor.rowcount == 0:
-                logger.warning(f"Попытка удалить несуществующую ссылку: id={link_id}, user_id={user_id}")
-            return cursor.rowcount > 0
+        for link_id, _ in rows:
+            link_cache.invalidate((user_id, link_id))
+        truncated = sum(1 for _, title in rows if len(prefix) + len(title or "") > MAX_TITLE_LENGTH)
+        return undo_id, len(rows), truncated
     except Exception as e:
-        logger.error(f"Ошибка при удалении ссылки: {e}")
-        return False
+        logger.error(f"Ошибка при массовом переименовании ссылок: {e}")
+        return None
 
 
-async def rename_link(link_id: int, user_id: int, new_title: str) -> bool:
+async def undo_bulk_action(undo_id: int, user_id: int) -> Optional[Tuple[str, int]]:
+    """
+    Отменяет массовое действие, если его окно отмены не истекло: удалённые ссылки
+    возвращаются с прежними ID (и статистикой), названия — прежние. Возвращает
+    (вид действия, число восстановленных ссылок) или None, если отменять нечего.
+    """
     try:
         async with aiosqlite.connect(DB_PATH) as db:
-            cursor = await db.execute(
-                "UPDATE links SET title = ? WHERE id = ? AND user_id = ?",
-                (new_title, link_id, user_id)
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute(
+                "SELECT kind, payload FROM undo_log WHERE id = ? AND user_id = ? AND expires_at >= ?",
+                (undo_id, user_id, time.time())
+            ) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                await db.rollback()
+                return None
+            kind, rows = row[0], json.loads(row[1])
+            if kind == "delete":
+                # Ссылку, которую за это время добавили заново, второй раз не вставляем
+                cursor = await db.executemany(
+                    "INSERT OR IGNORE INTO links (id, user_id, original_url, short_url, title, vk_key, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+            else:
+                cursor = await db.executemany(
+                    "UPDATE links SET title = ? WHERE id = ? AND user_id = ?",
+                    [(title, link_id, user_id) for link_id, title in rows]
+                )
+            restored = cursor.rowcount
+            await db.execute("DELETE FROM undo_log WHERE id = ?", (undo_id,))
+            await db.commit()
+        for link in rows:
+            link_cache.invalidate((user_id, link[0]))
+        return kind, restored
+    except Exception as e:
+        logger.error(f"Ошибка при отмене массового действия: {e}")
+        return None
+
+
+async def get_shared_short_link(canonical_url: str) -> Optional[Tuple[str, str]]:
+    """Ищет ранее сокращённый URL в общем кэше и увеличивает счётчик попаданий."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT short_url, vk_key FROM short_url_cache WHERE canonical_url = ?",
+                (canonical_url,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                await db.execute(
+                    "UPDATE short_url_cache SET hits = hits + 1 WHERE canonical_url = ?",
+                    (canonical_url,)
+                )
+                await db.commit()
+            return row
+    except Exception as e:
+        logger.error(f"Ошибка при чтении кэша сокращений: {e}")
+        return None
+
+
+async def save_shared_short_link(canonical_url: str, short_url: str, vk_key: str) -> bool:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "INSERT OR IGNORE INTO short_url_cache (canonical_url, short_url, vk_key, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                (canonical_url, short_url, vk_key, datetime.now().isoformat())
             )
             await db.commit()
-            return cursor.rowcount > 0
+            return True
     except Exception as e:
-        logger.error(f"Ошибка при переименовании ссылки: {e}")
+        logger.error(f"Ошибка при записи в кэш сокращений: {e}")
         return False
+
+
+async def get_shared_short_link_stats() -> Tuple[int, int]:
+    """Количество URL в общем кэше и суммарное число попаданий."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM short_url_cache") as cursor:
+                return await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Ошибка при получении статистики кэша сокращений: {e}")
+        return 0, 0
+
+
+async def get_qr_file_id(short_url: str) -> Optional[str]:
+    """file_id QR-кода, уже загруженного в Telegram для этого short_url."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute("SELECT file_id FROM qr_files WHERE short_url = ?", (short_url,)) as cursor:
+                row = await cursor.fetchone()
+            return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при чтении file_id QR-кода: {e}")
+        return None
+
+
+async def save_qr_file_id(short_url: str, file_id: Optional[str]) -> bool:
+    """Запоминает file_id QR-кода; None — забыть (Telegram больше не принимает этот file_id)."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            if file_id is None:
+                await db.execute("DELETE FROM qr_files WHERE short_url = ?", (short_url,))
+            else:
+                await db.execute(
+                    "INSERT OR REPLACE INTO qr_files (short_url, file_id) VALUES (?, ?)",
+                    (short_url, file_id)
+                )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при записи file_id QR-кода: {e}")
+        return False
+
+
+async def get_distinct_keys(user_id: int) -> bool:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT distinct_keys FROM user_settings WHERE user_id = ?",
+                (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return bool(row and row[0])
+    except Exception as e:
+        logger.error(f"Ошибка при чтении настроек пользователя: {e}")
+        return False
+
+
+async def set_distinct_keys(user_id: int, enabled: bool) -> bool:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "INSERT INTO user_settings (user_id, distinct_keys) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET distinct_keys = excluded.distinct_keys",
+                (user_id, int(enabled))
+            )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении настроек пользователя: {e}")
+        return False
+
+
+async def get_geo_names(kind: str, ids) -> Dict[int, str]:
+    ids = list(ids)
+    if not ids:
+        return {}
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            placeholders = ", ".join("?" * len(ids))
+            async with db.execute(
+                f"SELECT id, name FROM geo_names WHERE kind = ? AND id IN ({placeholders})",
+                [kind, *ids]
+            ) as cursor:
+                return dict(await cursor.fetchall())
+    except Exception as e:
+        logger.error(f"Ошибка при чтении кэша названий: {e}")
+        return {}
+
+
+async def save_geo_names(kind: str, names: Dict[int, str]) -> bool:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany(
+                "INSERT OR REPLACE INTO geo_names (kind, id, name) VALUES (?, ?, ?)",
+                [(kind, item_id, name) for item_id, name in names.items()]
+            )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении кэша названий: {e}")
+        return False
+
+
+async def get_full_links_by_user(user_id: int) -> List[Tuple]:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                f"SELECT {_ARCHIVE_COLUMNS} FROM links WHERE user_id = ? "
+                f"UNION ALL SELECT {_ARCHIVE_COLUMNS} FROM links_archive WHERE user_id = ? ORDER BY id",
+                (user_id, user_id)
+            ) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при выгрузке ссылок пользователя: {e}")
+        return []
+
+
+# Прирост считается относительно снимка, которому не меньше суток
+STATS_GROWTH_WINDOW = timedelta(days=1)
+
+_UPSERT_LINK_STATS = """
+    INSERT INTO link_stats (link_id, user_id, views, payload, summary, fetched_at, base_views, base_at, growth,
+                            views_changed_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
+    ON CONFLICT (link_id) DO UPDATE SET
+        views_changed_at = CASE WHEN excluded.views IS NOT link_stats.views
+                                THEN excluded.fetched_at ELSE link_stats.views_changed_at END,
+        base_views = CASE WHEN link_stats.base_at IS NULL OR link_stats.base_at < ?
+                          THEN link_stats.views ELSE link_stats.base_views END,
+        base_at = CASE WHEN link_stats.base_at IS NULL OR link_stats.base_at < ?
+                       THEN link_stats.fetched_at ELSE link_stats.base_at END,
+        growth = excluded.views - CASE WHEN link_stats.base_at IS NULL OR link_stats.base_at < ?
+                                       THEN link_stats.views ELSE link_stats.base_views END,
+        user_id = excluded.user_id,
+        views = excluded.views,
+        payload = excluded.payload,
+        summary = excluded.summary,
+        fetched_at = excluded.fetched_at
+"""
+
+
+def _link_stats_params(link_id: int, user_id: int, stats: dict, summary: Optional[dict] = None) -> tuple:
+    now = datetime.now()
+    window_start = (now - STATS_GROWTH_WINDOW).isoformat()
+    views = stats.get("views", 0)
+    return (
+        link_id, user_id, views, json.dumps(stats, ensure_ascii=False),
+        json.dumps(summary or summarize_stats(stats), ensure_ascii=False), now.isoformat(),
+        views, now.isoformat(), now.isoformat() if views else None, window_start, window_start, window_start
+    )
+
+
+async def save_link_stats(link_id: int, user_id: int, stats: dict, summary: Optional[dict] = None) -> bool:
+    return await save_link_stats_batch([(link_id, user_id, stats, summary)])
+
+
+async def save_link_stats_batch(entries: List[tuple]) -> bool:
+    """
+    Сохраняет снимки статистики (link_id, user_id, stats[, summary]) одной
+    транзакцией вместе с готовой к показу сводкой.
+    """
+    if not entries:
+        return True
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.executemany(
+                _UPSERT_LINK_STATS,
+                [_link_stats_params(*entry) for entry in entries]
+            )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении статистики ссылок: {e}")
+        return False
+
+
+async def get_stats_summary(link_id: int) -> Optional[Tuple[dict, str]]:
+    """Сохранённая сводка статистики ссылки и время снимка."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT summary, fetched_at FROM link_stats WHERE link_id = ? AND summary IS NOT NULL",
+                (link_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return (json.loads(row[0]), row[1]) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении сводки статистики: {e}")
+        return None
+
+
+async def get_stats_snapshots(link_ids: List[int]) -> Dict[int, Tuple[int, str]]:
+    """Сохранённые просмотры по списку ссылок: {link_id: (views, fetched_at)}."""
+    if not link_ids:
+        return {}
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            placeholders = ", ".join("?" * len(link_ids))
+            async with db.execute(
+                f"SELECT link_id, views, fetched_at FROM link_stats WHERE link_id IN ({placeholders})",
+                list(link_ids)
+            ) as cursor:
+                return {link_id: (views, fetched_at) for link_id, views, fetched_at in await cursor.fetchall()}
+    except Exception as e:
+        logger.error(f"Ошибка при получении снимков статистики: {e}")
+        return {}
+
+
+# Дайджест
+
+async def get_digest(user_id: int) -> Optional[str]:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute("SELECT digest FROM user_settings WHERE user_id = ?", (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                return row[0] if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при чтении настройки дайджеста: {e}")
+        return None
+
+
+async def set_digest(user_id: int, chat_id: Optional[int], period: Optional[str], next_at: Optional[float]) -> bool:
+    """Включает дайджест с периодом 'daily'/'weekly' или выключает его (period=None)."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "INSERT INTO user_settings (user_id, digest, digest_chat_id, digest_next_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET digest = excluded.digest, "
+                "digest_chat_id = excluded.digest_chat_id, digest_next_at = excluded.digest_next_at",
+                (user_id, period, chat_id, next_at)
+            )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении настройки дайджеста: {e}")
+        return False
+
+
+async def get_due_digests(now: float, limit: int) -> List[Tuple[int, int, str, float]]:
+    """Пользователи, чей дайджест пора собирать: (user_id, chat_id, period, next_at)."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT user_id, digest_chat_id, digest, digest_next_at FROM user_settings "
+                "WHERE digest IS NOT NULL AND digest_next_at <= ? ORDER BY digest_next_at LIMIT ?",
+                (now, limit)
+            ) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при выборке дайджестов: {e}")
+        return []
+
+
+async def reschedule_digest(user_id: int, expected_next_at: float, next_at: float) -> bool:
+    """Переносит следующий дайджест; False, если его уже перенёс другой процесс."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute(
+                "UPDATE user_settings SET digest_next_at = ? WHERE user_id = ? AND digest_next_at = ?",
+                (next_at, user_id, expected_next_at)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Ошибка при переносе дайджеста: {e}")
+        return False
+
+
+async def get_digest_rows(user_id: int) -> List[Tuple]:
+    """Снимки для дайджеста: (link_id, title, short_url, views, digest_views) по убыванию прироста."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT l.id, l.title, l.short_url, s.views, s.digest_views FROM link_stats s "
+                "JOIN links l ON l.id = s.link_id WHERE s.user_id = ? "
+                "ORDER BY s.views - COALESCE(s.digest_views, 0) DESC",
+                (user_id,)
+            ) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при получении данных дайджеста: {e}")
+        return []
+
+
+async def mark_digest_baseline(user_id: int) -> bool:
+    """Текущие просмотры становятся точкой отсчёта для следующего дайджеста."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("UPDATE link_stats SET digest_views = views WHERE user_id = ?", (user_id,))
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении базы дайджеста: {e}")
+        return False
+
+
+# Исходящие сообщения
+
+async def enqueue_outbox(chat_id: int, user_id: int, kind: str, text: str) -> Optional[int]:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute(
+                "INSERT INTO outbox (chat_id, user_id, kind, text, created_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, user_id, kind, text, datetime.now().isoformat())
+            )
+            await db.commit()
+            return cursor.lastrowid
+    except Exception as e:
+        logger.error(f"Ошибка при постановке сообщения в очередь отправки: {e}")
+        return None
+
+
+async def get_outbox_batch(limit: int) -> List[Tuple[int, int, int, str, str, int]]:
+    """Неотправленные сообщения по порядку: (id, chat_id, user_id, kind, text, attempts)."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT id, chat_id, user_id, kind, text, attempts FROM outbox "
+                "WHERE status = 'pending' ORDER BY id LIMIT ?",
+                (limit,)
+            ) as cursor:
+                return await cursor.fetchall()
+    except Exception as e:
+        logger.error(f"Ошибка при чтении очереди отправки: {e}")
+        return []
+
+
+async def finish_outbox(message_id: int, status: str, error: Optional[str] = None) -> bool:
+    """status: 'sent', 'failed' или 'pending' (повтор позже, attempts + 1)."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute(
+                "UPDATE outbox SET status = ?, error = ?, attempts = attempts + (? = 'pending'), "
+                "sent_at = CASE WHEN ? = 'sent' THEN ? ELSE sent_at END WHERE id = ?",
+                (status, error, status, status, datetime.now().isoformat(), message_id)
+            )
+            await db.commit()
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении очереди отправки: {e}")
+        return False
+
+
+# Очередь фоновых задач
+
+JOB_COLUMNS = (
+    "id", "user_id", "chat_id", "message_id", "kind", "status", "payload",
+    "total", "attempts", "locked_by", "heartbeat_at", "error", "created_at", "finished_at"
+)
+_JOB_FIELDS = ", ".join(JOB_COLUMNS)
+
+
+def _job_from_row(row) -> Dict[str, Any]:
+    job = dict(zip(JOB_COLUMNS, row))
+    job["payload"] = json.loads(job["payload"]) if job["payload"] else {}
+    return job
+
+
+async def create_job(user_id: int, chat_id: int, kind: str, payload: Optional[dict] = None,
+                     items: Optional[list] = None, message_id: Optional[int] = None) -> Optional[int]:
+    items = items or []
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute(
+                """
+                INSERT INTO jobs (user_id, chat_id, message_id, kind, payload, total, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (user_id, chat_id, message_id, kind, json.dumps(payload or {}, ensure_ascii=False),
+                 len(items), datetime.now().isoformat())
+            )
+            job_id = cursor.lastrowid
+            await db.executemany(
+                "INSERT INTO job_items (job_id, idx, payload) VALUES (?, ?, ?)",
+                [(job_id, idx, json.dumps(item, ensure_ascii=False)) for idx, item in enumerate(items)]
+            )
+            await db.commit()
+            return job_id
+    except Exception as e:
+        logger.error(f"Ошибка при создании задачи {kind}: {e}")
+        return None
+
+
+async def claim_job(worker_id: str, max_per_user: int, max_attempts: int,
+                    background_kinds: Tuple[str, ...] = (), max_background: int = 0) -> Optional[Dict[str, Any]]:
+    """
+    Захватывает ожидающую задачу, если у её владельца запущено меньше max_per_user
+    задач. Задачи из background_kinds (дайджесты, досчёт статистики) берутся после
+    остальных и не больше max_background одновременно, поэтому их очередь не
+    задерживает сокращения и импорт пользователей.
+    """
+    try:
+        background = json.dumps(list(background_kinds))
+        async with aiosqlite.connect(DB_PATH) as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute(
+                f"""
+                SELECT {_JOB_FIELDS} FROM jobs
+                WHERE status = 'pending' AND attempts < ?
+                  AND user_id NOT IN (
+                      SELECT user_id FROM jobs WHERE status = 'running'
+                      GROUP BY user_id HAVING COUNT(*) >= ?
+                  )
+                  AND (kind NOT IN (SELECT value FROM json_each(?))
+                       OR (SELECT COUNT(*) FROM jobs WHERE status = 'running'
+                           AND kind IN (SELECT value FROM json_each(?))) < ?)
+                ORDER BY kind IN (SELECT value FROM json_each(?)), id LIMIT 1
+                """,
+                (max_attempts, max_per_user, background, background, max_background, background)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                await db.commit()
+                return None
+            job = _job_from_row(row)
+            await db.execute(
+                "UPDATE jobs SET status = 'running', locked_by = ?, heartbeat_at = ?, attempts = attempts + 1 "
+                "WHERE id = ?",
+                (worker_id, time.time(), job["id"])
+            )
+            await db.commit()
+            job["status"], job["locked_by"], job["attempts"] = "running", worker_id, job["attempts"] + 1
+            return job
+    except Exception as e:
+        logger.error(f"Ошибка при захвате задачи: {e}")
+        return None
+
+
+async def heartbeat_job(job_id: int, worker_id: str) -> bool:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND locked_by = ? AND status = 'running'",
+                (time.time(), job_id, worker_id)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Ошибка при обновлении heartbeat задачи {job_id}: {e}")
+        return False
+
+
+async def finish_job(job_id: int, status: str, error: Optional[str] = None) -> bool:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute(
+                "UPDATE jobs SET status = ?, error = ?, locked_by = NULL, finished_at = ? WHERE id = ?",
+                (status, error, datetime.now().isoformat(), job_id)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Ошибка при завершении задачи {job_id}: {e}")
+        return False
+
+
+async def requeue_stale_jobs(stale_seconds: float, max_attempts: int) -> int:
+    """
+    Возвращает в очередь задачи, чей воркер перестал обновлять heartbeat
+    (например, процесс перезапустился посреди пакета).
+    """
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            deadline = time.time() - stale_seconds
+            await db.execute(
+                "UPDATE jobs SET status = 'failed', error = 'Превышено число попыток', locked_by = NULL, "
+                "finished_at = ? WHERE status = 'running' AND heartbeat_at < ? AND attempts >= ?",
+                (datetime.now().isoformat(), deadline, max_attempts)
+            )
+            cursor = await db.execute(
+                "UPDATE jobs SET status = 'pending', locked_by = NULL "
+                "WHERE status = 'running' AND heartbeat_at < ?",
+                (deadline,)
+            )
+            await db.commit()
+            if cursor.rowcount:
+                logger.info(f"Возвращено в очередь задач: {cursor.rowcount}")
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Ошибка при возврате зависших задач: {e}")
+        return 0
+
+
+async def release_jobs(worker_id: str) -> int:
+    """Отпускает задачи воркера при штатной остановке, чтобы их сразу подхватил новый процесс."""
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute(
+                "UPDATE jobs SET status = 'pending', locked_by = NULL, attempts = MAX(attempts - 1, 0) "
+                "WHERE status = 'running' AND locked_by = ?",
+                (worker_id,)
+            )
+            await db.commit()
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Ошибка при освобождении задач: {e}")
+        return 0
+
+
+async def get_job(job_id: int, user_id: int) -> Optional[Dict[str, Any]]:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                f"SELECT {_JOB_FIELDS} FROM jobs WHERE id = ? AND user_id = ?",
+                (job_id, user_id)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return _job_from_row(row) if row else None
+    except Exception as e:
+        logger.error(f"Ошибка при получении задачи {job_id}: {e}")
+        return None
+
+
+async def get_job_items(job_id: int) -> List[Dict[str, Any]]:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            async with db.execute(
+                "SELECT idx, payload, status, result FROM job_items WHERE job_id = ? ORDER BY idx",
+                (job_id,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [
+            {
+                "idx": idx,
+                "payload": json.loads(payload) if payload else None,
+                "status": status,
+                "result": json.loads(result) if result else None,
+            }
+            for idx, payload, status, result in rows
+        ]
+    except Exception as e:
+        logger.error(f"Ошибка при получении элементов задачи {job_id}: {e}")
+        return []
+
+
+async def complete_job_item(job_id: int, idx: int, result: dict) -> bool:
+    try:
+        async with aiosqlite.connect(DB_PATH) as db:
+            cursor = await db.execute(
+                "UPDATE job_items SET status = 'done', result = ? WHERE job_id = ? AND idx = ?",
+                (json.dumps(result, ensure_ascii=False), job_id, idx)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении результата задачи {job_id}: {e}")
+        return False
+
+
+# Не больше DB_CONCURRENCY одновременных обращений, фоновые задачи — в остаток после интерактивных
+db_gate = PriorityLimiter(DB_CONCURRENCY)
+# Записи через буфер групповой записи слот не держат: буфер пишет одним соединением, а
+# ожидание общего коммита в слоте ограничило бы пакет DB_CONCURRENCY операциями.
+# Без буфера запись идёт через _execute_direct — он в слоте.
+BUFFERED_WRITES = ("execute_write", "save_link", "rename_link", "delete_link")
+gate_module(globals(), db_gate, exclude=BUFFERED_WRITES)
+_execute_direct = db_gate.gate(_execute_direct)
+
+# Спаны db.<функция> вокруг всех публичных корутин модуля (при TRACING=1)
+instrument_module(globals(), "db")
@@ -0,0 +1,120 @@
+"""
+Идемпотентная обработка апдейтов.
+
+DedupMiddleware (outer на dp.update) помнит update_id за последние
+DEDUP_UPDATE_TTL секунд: повтор вебхука или апдейты, заново отданные после
+рестарта, отбрасываются до фильтров и обработчиков. ActionDedupMiddleware
+(inner на событиях роутера) срабатывает только для обработчиков с флагом
+"mutating" и гасит одинаковые действия пользователя за DEDUP_ACTION_SECONDS —
+двойное нажатие «Удалить» или повторно отправленный тот же список ссылок.
+Ключ сообщения включает состояние FSM и цель действия из его данных (какую
+ссылку переименовываем, какая позиция массового переименования), поэтому один и
+тот же текст для другой цели — новое действие. Если обработчик упал, ключ
+снимается, чтобы повтор мог пройти.
+"""
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from aiogram.dispatcher.flags import get_flag
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, Message
+
+from config import DEDUP_UPDATE_TTL, DEDUP_ACTION_SECONDS, DEDUP_MAX_KEYS
+
+logger = logging.getLogger(__name__)
+
+dedup_stats = {"updates": 0, "actions": 0}
+
+
+class TTLSet:
+    """Множество ключей с временем жизни и ограничением размера (старые вытесняются первыми)."""
+    def __init__(self, ttl: float, maxsize: int = DEDUP_MAX_KEYS):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def add(self, key: Hashable, now: Optional[float] = None) -> bool:
+        """Добавляет ключ; False, если он уже есть и не истёк."""
+        now = time.monotonic() if now is None else now
+        while self._data:
+            oldest, added = next(iter(self._data.items()))
+            if now - added < self.ttl and len(self._data) < self.maxsize:
+                break
+            del self._data[oldest]
+        if key in self._data:
+            return False
+        self._data[key] = now
+        return True
+
+    def discard(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+
+class DedupMiddleware:
+    """Outer-middleware dp.update: каждый update_id обрабатывается один раз."""
+    def __init__(self, ttl: float = DEDUP_UPDATE_TTL):
+        self.seen = TTLSet(ttl)
+
+    async def __call__(self, handler, event, data):
+        if not self.seen.add(event.update_id):
+            dedup_stats["updates"] += 1
+            logger.info(f"Повторный апдейт {event.update_id} пропущен")
+            return None
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.seen.discard(event.update_id)
+            raise
+
+
+# Данные FSM, которые задают цель действия, введённого сообщением
+ACTION_TARGET_FIELDS = ("rename_link_id", "rename_job", "rename_pos", "pending_url", "sel")
+
+
+async def action_key(event, action: str, state: Optional[FSMContext] = None) -> Optional[tuple]:
+    """Ключ идемпотентности: кто, каким обработчиком, над чем, что именно сделал."""
+    if isinstance(event, CallbackQuery):
+        message_id = event.message.message_id if event.message else None
+        return event.from_user.id, action, message_id, event.data
+    if isinstance(event, Message):
+        content = event.text or (event.document.file_unique_id if event.document else None)
+        if content is None:
+            return None
+        current, target = None, ()
+        if state is not None:
+            current = await state.get_state()
+            data = await state.get_data()
+            target = tuple(data.get(field) for field in ACTION_TARGET_FIELDS)
+        return (event.from_user.id, action, current, target,
+                hashlib.blake2b(content.encode(), digest_size=16).digest())
+    return None
+
+
+class ActionDedupMiddleware:
+    """Inner-middleware: повтор того же изменяющего действия за окно не выполняется."""
+    def __init__(self, window: float = DEDUP_ACTION_SECONDS):
+        self.seen = TTLSet(window)
+
+    async def __call__(self, handler, event, data):
+        if not get_flag(data, "mutating"):
+            return await handler(event, data)
+        key = await action_key(event, data["handler"].callback.__name__, data.get("state"))
+        if key is None:
+            return await handler(event, data)
+        if not self.seen.add(key):
+            dedup_stats["actions"] += 1
+            logger.info(f"Повторное действие пользователя {event.from_user.id} пропущено")
+            if isinstance(event, CallbackQuery):
+                await event.answer()
+            return None
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.seen.discard(key)
+            raise
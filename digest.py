@@ -0,0 +1,127 @@
+"""
+Дайджест просмотров: раз в сутки или неделю пользователь получает сообщение с
+приростом переходов по своим ссылкам.
+
+Планирование: у каждого пользователя своё место в окне рассылки
+(DIGEST_WINDOW_START_HOUR + DIGEST_WINDOW_HOURS) — доля окна по золотому сечению
+от user_id, поэтому пользователи распределены по окну равномерно при любом их
+числе, плюс случайный сдвиг до ±DIGEST_JITTER_SECONDS. Планировщик раз в
+DIGEST_TICK_SECONDS ставит подошедшим пользователям задачу "digest" в общую
+очередь (jobs.py): она обновляет устаревшие снимки пакетами execute по 25 ключей
+с ограничением DIGEST_VK_RPS, собирает текст из сохранённых снимков и кладёт его
+в очередь отправки (outbox.py), которая соблюдает лимит Telegram.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from aiogram.utils.text_decorations import html_decoration
+
+from config import (
+    DIGEST_WINDOW_START_HOUR,
+    DIGEST_WINDOW_HOURS,
+    DIGEST_WEEKDAY,
+    DIGEST_JITTER_SECONDS,
+    DIGEST_TICK_SECONDS,
+    DIGEST_BATCH,
+    DIGEST_VK_RPS,
+)
+from database import get_due_digests, reschedule_digest, get_links_by_user
+from jobs import enqueue_job
+from ratelimit import TokenBucket
+from vkcc import VK_EXECUTE_MAX_CALLS
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"daily": "за сутки", "weekly": "за неделю"}
+DIGEST_TOP = 10
+_GOLDEN = 0.6180339887498949
+
+# Общий для всех задач дайджеста бюджет запросов к VK
+vk_budget = TokenBucket(DIGEST_VK_RPS)
+
+
+def digest_slot(user_id: int) -> float:
+    """Смещение пользователя от начала окна рассылки, секунд."""
+    return ((user_id * _GOLDEN) % 1.0) * DIGEST_WINDOW_HOURS * 3600
+
+
+def next_digest_at(user_id: int, period: str, after: Optional[float] = None) -> float:
+    """Ближайшее после after время дайджеста пользователя (unix time)."""
+    after = time.time() if after is None else after
+    day = datetime.fromtimestamp(after).replace(hour=0, minute=0, second=0, microsecond=0)
+    offset = timedelta(hours=DIGEST_WINDOW_START_HOUR, seconds=digest_slot(user_id))
+    offset += timedelta(seconds=random.uniform(-DIGEST_JITTER_SECONDS, DIGEST_JITTER_SECONDS))
+    step = timedelta(days=7 if period == "weekly" else 1)
+    if period == "weekly":
+        day += timedelta(days=(DIGEST_WEEKDAY - day.weekday()) % 7)
+    candidate = day + offset
+    while candidate.timestamp() <= after:
+        candidate += step
+    return candidate.timestamp()
+
+
+def digest_items(links: List[Tuple]) -> List[dict]:
+    """Элементы задачи: пачки ссылок по размеру одного execute."""
+    return [
+        {"links": [list(link) for link in links[start:start + VK_EXECUTE_MAX_CALLS]]}
+        for start in range(0, len(links), VK_EXECUTE_MAX_CALLS)
+    ]
+
+
+def format_digest(period: str, rows: List[Tuple]) -> Optional[str]:
+    """Текст дайджеста по снимкам (link_id, title, short_url, views, digest_views); None — нечего слать."""
+    total = sum(views or 0 for _, _, _, views, _ in rows)
+    delta = sum((views or 0) - (base if base is not None else 0) for _, _, _, views, base in rows)
+    if not rows or delta <= 0:
+        return None
+    lines = [f"📬 <b>Дайджест {PERIODS.get(period, '')}</b>", f"👁 Всего переходов: {total} (+{delta})", ""]
+    for _, title, short_url, views, base in rows[:DIGEST_TOP]:
+        growth = (views or 0) - (base if base is not None else 0)
+        if growth <= 0:
+            break
+        # Рассылка уходит с parse_mode=HTML: «<» или «&» в названии иначе ломают каждую попытку
+        lines.append(f"📍 {html_decoration.quote(title or short_url)} — {views} (+{growth})")
+    return "\n".join(lines)
+
+
+class DigestScheduler:
+    """Раз в DIGEST_TICK_SECONDS ставит задачи дайджеста пользователям, чьё время подошло."""
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+        logger.info("Планировщик дайджестов запущен.")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                while await self.tick() >= DIGEST_BATCH:
+                    pass
+            except Exception as e:
+                logger.error(f"Ошибка планировщика дайджестов: {e}")
+            await asyncio.sleep(DIGEST_TICK_SECONDS)
+
+    async def tick(self, now: Optional[float] = None) -> int:
+        now = time.time() if now is None else now
+        due = await get_due_digests(now, DIGEST_BATCH)
+        for user_id, chat_id, period, next_at in due:
+            # Перенос через compare-and-set: задачу ставит только тот, кто перенёс
+            if not await reschedule_digest(user_id, next_at, next_digest_at(user_id, period, now)):
+                continue
+            links = await get_links_by_user(user_id)
+            if links:
+                await enqueue_job(user_id, chat_id, "digest", payload={"period": period}, items=digest_items(links))
+        if due:
+            logger.info(f"Дайджестов поставлено в очередь: {len(due)}")
+        return len(due)
@@ -0,0 +1,33 @@
+import json
+import logging
+from typing import Any, Dict
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_STATE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+state_stats = {"writes": 0, "bytes_total": 0, "bytes_max": 0, "over_limit": 0}
+
+
+def state_size(data: Dict[str, Any]) -> int:
+    """Размер данных состояния в байтах так, как их сериализует внешнее хранилище (JSON)."""
+    return len(json.dumps(data, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+class MeteredMemoryStorage(MemoryStorage):
+    """MemoryStorage, который считает размер каждой записи данных FSM."""
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        size = state_size(data)
+        state_stats["writes"] += 1
+        state_stats["bytes_total"] += size
+        state_stats["bytes_max"] = max(state_stats["bytes_max"], size)
+        if size > FSM_STATE_MAX_BYTES:
+            state_stats["over_limit"] += 1
+            logger.warning(
+                f"Состояние user_id={key.user_id} занимает {size} байт (лимит {FSM_STATE_MAX_BYTES}), "
+                f"ключи: {', '.join(data)}"
+            )
+        await super().set_data(key, data)
@@ -0,0 +1,247 @@
+"""
+Названия стран и городов VK по их ID.
+
+Порядок поиска: встроенный набор data/geo.bin (открывается через mmap при первом
+обращении) → кэш в памяти → постоянный кэш в таблице geo_names → пакетный запрос
+к VK (database.getCountriesById / database.getCitiesById, до 1000 ID за запрос).
+Найденные через VK названия сохраняются в geo_names, поэтому каждый ID
+разрешается через сеть не больше одного раза.
+
+Пересборка встроенного набора:
+    python geo.py build          # из SEED_* ниже
+    python geo.py build --vk     # все страны и крупные города из VK (нужен VK_TOKEN)
+"""
+import asyncio
+import bisect
+import logging
+import mmap
+import os
+import struct
+import sys
+from typing import Dict, Iterable, List, Optional
+
+from config import VK_TOKEN
+from database import get_geo_names, save_geo_names
+from session import create_session, close_session
+from vkcc import get_countries_by_id, get_cities_by_id, get_all_countries, get_major_cities
+
+logger = logging.getLogger(__name__)
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "geo.bin")
+
+# Формат geo.bin: заголовок MAGIC + число стран + число городов, затем для каждого
+# вида отсортированный массив записей (id, смещение, длина) и общий блок UTF-8 строк
+MAGIC = b"VKGEO1\0\0"
+HEADER = struct.Struct("<8sII")
+RECORD = struct.Struct("<IIH")
+
+COUNTRY = "country"
+CITY = "city"
+
+# Страны — по справочнику VK (database.getCountries, need_all=1): 1–18 — СНГ, Израиль, США и
+# Канада, дальше по алфавиту. Позднее добавленные VK страны (ID 138, 218 и выше) сюда не
+# вошли: их названия берутся из geo_names или один раз запрашиваются у VK
+SEED_COUNTRIES = {
+    1: "Россия", 2: "Украина", 3: "Беларусь", 4: "Казахстан", 5: "Азербайджан", 6: "Армения",
+    7: "Грузия", 8: "Израиль", 9: "США", 10: "Канада", 11: "Кыргызстан", 12: "Латвия", 13: "Литва",
+    14: "Эстония", 15: "Молдова", 16: "Таджикистан", 17: "Туркменистан", 18: "Узбекистан",
+    19: "Австралия", 20: "Австрия", 21: "Албания", 22: "Алжир", 23: "Американское Самоа",
+    24: "Ангилья", 25: "Ангола", 26: "Андорра", 27: "Антигуа и Барбуда", 28: "Аргентина",
+    29: "Аруба", 30: "Афганистан", 31: "Багамы", 32: "Бангладеш", 33: "Барбадос", 34: "Бахрейн",
+    35: "Белиз", 36: "Бельгия", 37: "Бенин", 38: "Бермуды", 39: "Болгария", 40: "Боливия",
+    41: "Босния и Герцеговина", 42: "Ботсвана", 43: "Бразилия", 44: "Бруней-Даруссалам",
+    45: "Буркина-Фасо", 46: "Бурунди", 47: "Бутан", 48: "Вануату", 49: "Великобритания",
+    50: "Венгрия", 51: "Венесуэла", 52: "Виргинские острова, Британские",
+    53: "Виргинские острова, США", 54: "Восточный Тимор", 55: "Вьетнам", 56: "Габон", 57: "Гаити",
+    58: "Гайана", 59: "Гамбия", 60: "Гана", 61: "Гваделупа", 62: "Гватемала", 63: "Гвинея",
+    64: "Гвинея-Бисау", 65: "Германия", 66: "Гибралтар", 67: "Гондурас", 68: "Гонконг",
+    69: "Гренада", 70: "Гренландия", 71: "Греция", 72: "Гуам", 73: "Дания", 74: "Доминика",
+    75: "Доминиканская Республика", 76: "Египет", 77: "Замбия", 78: "Западная Сахара",
+    79: "Зимбабве", 80: "Индия", 81: "Индонезия", 82: "Иордания", 83: "Ирак", 84: "Иран",
+    85: "Ирландия", 86: "Исландия", 87: "Испания", 88: "Италия", 89: "Йемен", 90: "Кабо-Верде",
+    91: "Камбоджа", 92: "Камерун", 93: "Катар", 94: "Кения", 95: "Кипр", 96: "Кирибати",
+    97: "Китай", 98: "Колумбия", 99: "Коморы", 100: "Конго",
+    101: "Конго, демократическая республика", 102: "Коста-Рика", 103: "Кот д`Ивуар", 104: "Куба",
+    105: "Кувейт", 106: "Лаос", 107: "Лесото", 108: "Либерия", 109: "Ливан", 110: "Ливия",
+    111: "Лихтенштейн", 112: "Люксембург", 113: "Маврикий", 114: "Мавритания", 115: "Мадагаскар",
+    116: "Макао", 117: "Македония", 118: "Малави", 119: "Малайзия", 120: "Мали", 121: "Мальдивы",
+    122: "Мальта", 123: "Марокко", 124: "Мартиника", 125: "Маршалловы Острова", 126: "Мексика",
+    127: "Микронезия, федеративные штаты", 128: "Мозамбик", 129: "Монако", 130: "Монголия",
+    131: "Монтсеррат", 132: "Мьянма", 133: "Намибия", 134: "Науру", 135: "Непал", 136: "Нигер",
+    137: "Нигерия", 139: "Нидерланды", 140: "Никарагуа", 141: "Ниуэ", 142: "Новая Зеландия",
+    143: "Новая Каледония", 144: "Норвегия", 145: "Объединенные Арабские Эмираты", 146: "Оман",
+    147: "Остров Мэн", 148: "Острова Кука", 149: "Палау", 150: "Палестинская автономия",
+    151: "Панама", 152: "Папуа - Новая Гвинея", 153: "Парагвай", 154: "Перу", 155: "Польша",
+    156: "Португалия", 157: "Пуэрто-Рико", 158: "Реюньон", 159: "Руанда", 160: "Румыния",
+    161: "Сальвадор", 162: "Самоа", 163: "Сан-Марино", 164: "Сан-Томе и Принсипи",
+    165: "Саудовская Аравия", 166: "Свазиленд", 167: "Святая Елена", 168: "Северная Корея",
+    169: "Сейшелы", 170: "Сенегал", 171: "Сент-Винсент", 172: "Сент-Китс и Невис",
+    173: "Сент-Люсия", 174: "Сент-Пьер и Микелон", 175: "Сербия", 176: "Сингапур",
+    177: "Сирийская Арабская Республика", 178: "Словакия", 179: "Словения",
+    180: "Соломоновы Острова", 181: "Сомали", 182: "Судан", 183: "Суринам", 184: "Сьерра-Леоне",
+    185: "Таиланд", 186: "Тайвань", 187: "Танзания", 188: "Того", 189: "Токелау", 190: "Тонга",
+    191: "Тринидад и Тобаго", 192: "Тувалу", 193: "Тунис", 194: "Турция", 195: "Уганда",
+    196: "Уоллис и Футуна", 197: "Уругвай", 198: "Фарерские острова", 199: "Фиджи",
+    200: "Филиппины", 201: "Финляндия", 202: "Фолклендские острова", 203: "Франция",
+    204: "Французская Гвиана", 205: "Французская Полинезия", 206: "Хорватия",
+    207: "Центрально-Африканская Республика", 208: "Чад", 209: "Чили", 210: "Швейцария",
+    211: "Швеция", 212: "Шпицберген и Ян Майен", 213: "Шри-Ланка", 214: "Эквадор",
+    215: "Экваториальная Гвинея", 216: "Эритрея", 217: "Эфиопия"
+}
+
+# Города — крупнейшие города России; полный список собирает python geo.py build --vk
+SEED_CITIES = {
+    1: "Москва", 2: "Санкт-Петербург", 49: "Екатеринбург", 60: "Казань",
+    95: "Нижний Новгород", 99: "Новосибирск", 151: "Уфа"
+}
+
+
+class GeoDataset:
+    """Только для чтения: бинарный поиск по записям прямо в mmap, без загрузки в память."""
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, countries, cities = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}: неизвестный формат")
+        self._tables = {
+            COUNTRY: (HEADER.size, countries),
+            CITY: (HEADER.size + countries * RECORD.size, cities),
+        }
+        self._strings = HEADER.size + (countries + cities) * RECORD.size
+        self._ids = {kind: _RecordIds(self._mm, start, count) for kind, (start, count) in self._tables.items()}
+
+    def get(self, kind: str, item_id: int) -> Optional[str]:
+        start, count = self._tables[kind]
+        pos = bisect.bisect_left(self._ids[kind], item_id)
+        if pos >= count:
+            return None
+        found_id, offset, length = RECORD.unpack_from(self._mm, start + pos * RECORD.size)
+        if found_id != item_id:
+            return None
+        return self._mm[self._strings + offset:self._strings + offset + length].decode("utf-8")
+
+
+class _RecordIds:
+    """Последовательность ID записей для bisect без копирования массива."""
+    def __init__(self, mm, start: int, count: int):
+        self._mm, self._start, self._count = mm, start, count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index: int) -> int:
+        return struct.unpack_from("<I", self._mm, self._start + index * RECORD.size)[0]
+
+
+def write_dataset(path: str, countries: Dict[int, str], cities: Dict[int, str]) -> None:
+    records, blob = [], bytearray()
+    for table in (countries, cities):
+        for item_id in sorted(table):
+            name = table[item_id].encode("utf-8")
+            records.append(RECORD.pack(item_id, len(blob), len(name)))
+            blob += name
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(countries), len(cities)))
+        f.write(b"".join(records))
+        f.write(blob)
+
+
+_dataset: Optional[GeoDataset] = None
+_dataset_loaded = False
+_names: Dict[str, Dict[int, str]] = {COUNTRY: {}, CITY: {}}
+
+
+def _get_dataset() -> Optional[GeoDataset]:
+    global _dataset, _dataset_loaded
+    if not _dataset_loaded:
+        _dataset_loaded = True
+        try:
+            _dataset = GeoDataset(DATASET_PATH)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Встроенный справочник стран и городов недоступен: {e}")
+    return _dataset
+
+
+def lookup(kind: str, item_id: int) -> Optional[str]:
+    """Название без обращения к БД и сети: встроенный набор и кэш в памяти."""
+    name = _names[kind].get(item_id)
+    if name is None:
+        dataset = _get_dataset()
+        name = dataset.get(kind, item_id) if dataset else None
+    return name
+
+
+async def resolve(kind: str, ids: Iterable[int], fetch: bool = True) -> Dict[int, str]:
+    """
+    Названия для набора ID. При fetch=False сеть не используется:
+    неизвестные ID просто отсутствуют в результате.
+    """
+    result, missing = {}, set()
+    for item_id in {i for i in ids if i is not None}:
+        name = lookup(kind, item_id)
+        if name is None:
+            missing.add(item_id)
+        else:
+            result[item_id] = name
+    if not missing:
+        return result
+
+    stored = await get_geo_names(kind, missing)
+    _names[kind].update(stored)
+    result.update(stored)
+    missing -= stored.keys()
+    if not missing or not fetch:
+        return result
+
+    fetched = await _fetch_from_vk(kind, sorted(missing))
+    if fetched:
+        await save_geo_names(kind, fetched)
+        _names[kind].update(fetched)
+        result.update(fetched)
+    return result
+
+
+async def _fetch_from_vk(kind: str, ids: List[int]) -> Dict[int, str]:
+    if not VK_TOKEN:
+        return {}
+    fetch = get_countries_by_id if kind == COUNTRY else get_cities_by_id
+    try:
+        return await fetch(ids, VK_TOKEN)
+    except ValueError as e:
+        logger.warning(f"Не удалось получить названия ({kind}) из VK: {e}")
+        return {}
+
+
+async def resolve_summary(summary: dict, fetch: bool = True) -> Dict[str, Dict[int, str]]:
+    """Названия стран и городов, упомянутых в сводке summarize_stats."""
+    return {
+        "countries": await resolve(COUNTRY, (row[0] for row in summary.get("countries", [])), fetch),
+        "cities": await resolve(CITY, (row[0] for row in summary.get("cities", [])), fetch),
+    }
+
+
+async def _build_from_vk() -> tuple:
+    await create_session()
+    try:
+        countries = await get_all_countries(VK_TOKEN)
+        cities = {}
+        for country_id in countries:
+            cities.update(await get_major_cities(country_id, VK_TOKEN))
+        return countries, cities
+    finally:
+        await close_session()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:2] != ["build"]:
+        print(__doc__)
+        sys.exit(1)
+    if "--vk" in sys.argv:
+        countries, cities = asyncio.run(_build_from_vk())
+    else:
+        countries, cities = SEED_COUNTRIES, SEED_CITIES
+    write_dataset(DATASET_PATH, countries, cities)
+    print(f"{DATASET_PATH}: стран {len(countries)}, городов {len(cities)}, {os.path.getsize(DATASET_PATH)} байт")
@@ -1,32 +1,91 @@
+import asyncio
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
+from typing import Optional
 from aiogram import Router, F
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import (
+    Message,
+    CallbackQuery,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineQuery,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    BufferedInputFile,
+)
 from aiogram.utils.markdown import hlink
+from aiogram.utils.text_decorations import html_decoration
 from aiogram.exceptions import TelegramBadRequest
 
 from keyboards import (
     get_main_inline_keyboard,
     get_link_card_keyboard,
+    get_archived_card_keyboard,
     get_stats_keyboard,
     get_delete_confirm_keyboard,
     get_rename_keyboard,
+    get_cancel_shorten_keyboard,
 )
+from fsm_storage import state_stats
+from dedup import ActionDedupMiddleware, dedup_stats
+from render import edit_text, edit_message, remember_sent, render_stats
+from sent_messages import registry, schedule_delete, sweeper_stats
+from selection import Selection
 from database import (
     save_link,
     get_links_by_user,
+    get_links_page,
     get_link_by_id,
-    get_link_by_original_url,
     delete_link,
     rename_link,
     check_duplicate_link,
+    get_job,
+    get_job_items,
+    search_links,
+    link_cache,
+    get_shared_short_link_stats,
+    get_distinct_keys,
+    set_distinct_keys,
+    get_digest,
+    set_digest,
+    db_gate,
+    mark_digest_baseline,
+    get_user_counters,
+    get_counter_totals,
+    rebuild_user_counters,
+    get_selected_links,
+    delete_links_bulk,
+    prefix_titles_bulk,
+    undo_bulk_action,
+    get_archived_link,
+    get_archived_links,
+    restore_archived_links,
+    restore_archived_url,
+    get_stats_snapshots,
+    get_qr_file_id,
+    save_qr_file_id,
 )
 from utils import is_valid_url, format_date, format_link_stats
-from vkcc import shorten_link, get_link_stats
-from config import VK_TOKEN, MAX_LINKS_PER_BATCH
+from ingest import ingest, parse_batch, exclude_existing
+from vkcc import vk_limiter
+from jobs import enqueue_job
+from digest import next_digest_at, PERIODS
+from stats import get_views_for_links, get_link_summary, get_link_views, vk_overloaded, stale_note, shed_stats
+from shortener import shorten_for_user, reuse_stats
+from geo import resolve_summary
+from config import (
+    VK_TOKEN,
+    MAX_LINKS_PER_BATCH,
+    MAX_LINKS_PER_IMPORT,
+    ADMIN_IDS,
+    MESSAGE_TTL_SECONDS,
+    BULK_UNDO_SECONDS,
+    ARCHIVE_AFTER_DAYS,
+    MAX_TITLE_LENGTH,
+)
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -36,6 +95,8 @@ class LinkStates(StatesGroup):
     waiting_for_title = State()
     waiting_for_mass_title = State()
     waiting_for_new_title = State()
+    waiting_for_import = State()
+    waiting_for_bulk_prefix = State()
 
 class ThrottlingMiddleware:
     """Ограничивает частоту текстовых команд."""
@@ -60,25 +121,20 @@ class ThrottlingMiddleware:
 
 # Применяем middleware только к текстовым сообщениям
 router.message.middleware(ThrottlingMiddleware())
+# Повтор изменяющего действия (флаг mutating) в течение нескольких секунд не выполняется
+action_dedup = ActionDedupMiddleware()
+router.message.middleware(action_dedup)
+router.callback_query.middleware(action_dedup)
 
 async def safe_edit(bot, chat_id, message_id, text, reply_markup=None):
     try:
-        return await bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=message_id,
-            text=text,
-            reply_markup=reply_markup,
-            parse_mode="HTML"
-        )
+        return await edit_text(bot, chat_id, message_id, text, reply_markup)
     except TelegramBadRequest as e:
-        if "message is not modified" in str(e).lower():
-            logger.debug(f"Сообщение не изменено: {e}")
-            return None
         logger.error(f"Ошибка редактирования сообщения: {e}")
-        return await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode="HTML")
     except Exception as e:
         logger.exception(f"Неизвестная ошибка при редактировании: {e}")
-        return await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode="HTML")
+    msg = await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup, parse_mode="HTML")
+    return remember_sent(msg, text, reply_markup)
 
 async def safe_delete(message: Message):
     try:
@@ -87,33 +143,39 @@ async def safe_delete(message: Message):
         logger.debug(f"Не удалось удалить сообщение {message.message_id}: {e}")
 
 async def cleanup_old_messages(bot, chat_id, message_id):
-    """Удаляет сообщения старше 5 минут."""
-    try:
-        message = await bot.get_message(chat_id, message_id)
-        if message.date < datetime.now() - timedelta(minutes=5):
-            await bot.delete_message(chat_id, message_id)
-    except TelegramBadRequest:
-        logger.debug(f"Сообщение {message_id} уже удалено или недоступно")
+    """
+    Отправляет в фоновое удаление меню этого чата старше MESSAGE_TTL_SECONDS.
+    Решение принимается по локальному реестру без запросов к Telegram; нажатое
+    сообщение остаётся — обработчик сейчас его отредактирует. Результаты задач и
+    сообщения с кнопкой отмены в реестре имеют своё назначение и не удаляются.
+    """
+    expired = registry.expired(chat_id, MESSAGE_TTL_SECONDS, keep=message_id)
+    if expired:
+        schedule_delete(chat_id, expired)
 
-async def process_and_save_link(url: str, title: str, message: Message, state: FSMContext) -> tuple[bool, str, str | None]:
+async def process_and_save_link(user_id: int, url: str, title: str | None) -> tuple[bool, str, str | None]:
+    title = title or ""
     if not VK_TOKEN:
         return False, "❌ Ошибка: VK_TOKEN не задан.\n\n<b>Что дальше?</b>", None
-    if len(title) > 100:
-        return False, "❌ Ошибка: Название слишком длинное (максимум 100 символов).\n\n<b>Что дальше?</b>", None
+    if len(title) > MAX_TITLE_LENGTH:
+        return False, f"❌ Ошибка: Название слишком длинное (максимум {MAX_TITLE_LENGTH} символов).\n\n<b>Что дальше?</b>", None
     if not is_valid_url(url):
         return False, f"❌ Ошибка: '{url}' — невалидная ссылка.\n\n<b>Что дальше?</b>", None
     try:
-        if check_duplicate_link(message.from_user.id, url):
+        restored = await restore_archived_url(user_id, url)
+        if restored:
+            return True, f"♻️ Ссылка была в архиве и возвращена в список: {hlink(title or 'Ссылка', restored)}\n\n<b>Что дальше?</b>", restored
+        if await check_duplicate_link(user_id, url):
             return False, f"❌ Ошибка: Ссылка '{url}' уже существует.\n\n<b>Что дальше?</b>", None
         
-        logger.info(f"Начинаю обработку ссылки: user_id={message.from_user.id}, url={url}")
-        short_url = await shorten_link(url, VK_TOKEN)
+        logger.info(f"Начинаю обработку ссылки: user_id={user_id}, url={url}")
+        short_url = await shorten_for_user(user_id, url)
         if not short_url:
             return False, "❌ Ошибка: Не удалось сократить ссылку (VK API не вернул short_url).\n\n<b>Что дальше?</b>", None
         logger.info(f"Ссылка сокращена: {short_url}")
         vk_key = short_url.split("/")[-1]
-        logger.info(f"Попытка сохранить ссылку: user_id={message.from_user.id}, short_url={short_url}, title={title}")
-        if save_link(message.from_user.id, url, short_url, title or "Без названия", vk_key):
+        logger.info(f"Попытка сохранить ссылку: user_id={user_id}, short_url={short_url}, title={title}")
+        if await save_link(user_id, url, short_url, title or "Без названия", vk_key):
             return True, f"✅ Ссылка сохранена: {hlink(title or 'Ссылка', short_url)}\n\n<b>Что дальше?</b>", short_url
         return False, f"❌ Ошибка: Не удалось сохранить ссылку '{url}'.\n\n<b>Что дальше?</b>", None
     except Exception as e:
@@ -140,7 +202,14 @@ async def cmd_help(message: Message, state: FSMContext):
         "📚 Помощь по vkcc-link-bot:\n"
         "➖ /start — Начать работу с ботом\n"
         "➖ 'Сократить ссылку' — Сократить одну или до 50 ссылок\n"
-        "➖ 'Мои ссылки' — Показать список ваших ссылок\n\n"
+        "➖ 'Мои ссылки' — Показать список ваших ссылок\n"
+        "➖ /find <запрос> — Найти ссылку по названию или адресу\n"
+        "➖ /import — Загрузить ссылки из текстового файла\n"
+        "➖ /export — Выгрузить ваши ссылки в CSV\n"
+        "➖ /refresh_stats — Обновить статистику всех ссылок\n"
+        "➖ /own_keys — Отдельные короткие ссылки со своей статистикой (вкл/выкл)\n"
+        "➖ /digest — Дайджест переходов: ежедневно, еженедельно или выкл\n"
+        "➖ /me — Сводка: сколько ссылок и переходов\n\n"
         "<b>Что дальше?</b>",
         reply_markup=get_main_inline_keyboard(),
         parse_mode="HTML"
@@ -151,9 +220,7 @@ async def cmd_help(message: Message, state: FSMContext):
 async def start_shorten(message: Message, state: FSMContext):
     await safe_delete(message)
     logger.info(f"Пользователь {message.from_user.id} начал сокращение ссылки")
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_shorten")]
-    ])
+    keyboard = get_cancel_shorten_keyboard()
     msg = await message.answer(
         "Введите ссылки (до 50, каждая с новой строки, можно с описанием: ссылка | описание).",
         reply_markup=keyboard
@@ -189,7 +256,7 @@ async def show_links_handler(callback: CallbackQuery, state: FSMContext):
         )
         return
     await cleanup_old_messages(callback.bot, callback.message.chat.id, callback.message.message_id)
-    await show_user_links(callback.message, state)
+    await show_user_links(callback.message, state, callback.from_user.id)
 
 @router.callback_query(F.data == "cancel_shorten")
 async def cancel_shorten_handler(callback: CallbackQuery, state: FSMContext):
@@ -212,17 +279,7 @@ async def cancel_shorten_handler(callback: CallbackQuery, state: FSMContext):
 async def noop_callback(callback: CallbackQuery):
     await callback.answer()
 
-@router.message(F.text)
-async def handle_unknown_message(message: Message):
-    logger.debug(f"Необработанное сообщение от user_id={message.from_user.id}: {message.text}")
-    await safe_delete(message)
-    await message.answer(
-        "❌ Неизвестная команда или сообщение. Используйте /start, /help или кнопки ниже.\n\n<b>Что дальше?</b>",
-        reply_markup=get_main_inline_keyboard(),
-        parse_mode="HTML"
-    )
-
-@router.message(LinkStates.waiting_for_url)
+@router.message(LinkStates.waiting_for_url, flags={"mutating": True})
 async def process_url(message: Message, state: FSMContext):
     await safe_delete(message)
     data = await state.get_data()
@@ -253,139 +310,407 @@ async def process_url(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    processed = []
-    failed = []
-    for url in urls:
-        if "|" in url:
-            u, t = map(str.strip, url.split("|", 1))
-            if len(t) > 100:
-                failed.append(f"❌ Ошибка: Название для {u} слишком длинное (максимум 100 символов).")
-                continue
-        else:
-            u, t = url.strip(), None
-        if not is_valid_url(u):
-            failed.append(f"❌ Ошибка: {u} — невалидная ссылка.")
-            continue
-        processed.append((u, t))
-
-    if failed:
-        await state.update_data(failed_links=failed)
+    result = await ingest(message.from_user.id, urls)
+    processed, failed = result.pairs, result.errors
     if not processed:
         text = "❌ Ошибка: Ни одной валидной ссылки.\n" + "\n".join(failed) + "\n\n<b>Что дальше?</b>"
         await safe_edit(message.bot, message.chat.id, initial_msg_id, text, get_main_inline_keyboard())
         await state.clear()
         return
 
-    await state.update_data(urls=processed, initial_msg=initial_msg_id, successful_links=[])
-    if len(processed) == 1:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_shorten")]
-        ])
+    if len(processed) == 1 and not failed and processed[0][1] is None:
+        await state.update_data(pending_url=processed[0][0], initial_msg=initial_msg_id)
+        keyboard = get_cancel_shorten_keyboard()
         await safe_edit(
             message.bot, message.chat.id, initial_msg_id,
             f"Введите описание для {processed[0][0]} (или оставьте пустым).",
             keyboard
         )
         await state.set_state(LinkStates.waiting_for_title)
-    else:
-        await state.set_state(LinkStates.waiting_for_mass_title)
-        await process_mass_urls(message, state)
+        return
 
-async def process_mass_urls(message: Message, state: FSMContext):
-    data = await state.get_data()
-    urls = data.get("urls", [])
-    initial_msg_id = data.get("initial_msg")
-    if not urls:
-        await finalize_mass_processing(message, state)
-        return
-    current_url, current_title = urls[0]
-    await state.update_data(
-        current_url=current_url,
-        current_title=current_title,
-        urls=urls[1:],
-        successful_links=data.get("successful_links", []),
-        failed_links=data.get("failed_links", [])
+    await enqueue_shorten_job(message, initial_msg_id, "shorten", processed, failed)
+    await state.clear()
+
+async def enqueue_shorten_job(message: Message, initial_msg_id: int, kind: str, processed: list, failed: list):
+    """Ставит сокращение в очередь: handler сразу освобождается, прогресс пишет воркер."""
+    items = [{"url": u, "title": t} for u, t in processed]
+    job_id = await enqueue_job(
+        message.from_user.id, message.chat.id, kind,
+        payload={"failed": failed}, items=items, message_id=initial_msg_id
+    )
+    if job_id is None:
+        await safe_edit(
+            message.bot, message.chat.id, initial_msg_id,
+            "❌ Ошибка: Не удалось поставить ссылки в очередь.\n\n<b>Что дальше?</b>",
+            get_main_inline_keyboard()
+        )
+        return
+    await safe_edit(
+        message.bot, message.chat.id, initial_msg_id,
+        f"⏳ Ссылок в очереди: {len(items)}. Я сообщу, когда всё будет готово."
     )
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_shorten")]
-    ])
-    await safe_edit(message.bot, message.chat.id, initial_msg_id, f"Сокращаю: {current_url}", keyboard)
 
-@router.message(LinkStates.waiting_for_title)
+@router.message(LinkStates.waiting_for_title, flags={"mutating": True})
 async def process_single_title(message: Message, state: FSMContext):
     await safe_delete(message)
     data = await state.get_data()
-    url, _ = data.get("urls", [(None, None)])[0]
+    url = data.get("pending_url")
     title = message.text.strip() if message.text else "Без названия"
     initial_msg_id = data.get("initial_msg")
-    success, result, short_url = await process_and_save_link(url, title, message, state)
-    link = get_link_by_original_url(message.from_user.id, url)
-    link_id = link[0] if link else None
-    keyboard = get_main_inline_keyboard()
-    if success and short_url and link_id:
-        keyboard.inline_keyboard.append([
-            InlineKeyboardButton(text="📋 Скопировать", callback_data=f"copy:{short_url}"),
-            InlineKeyboardButton(text="✏️ Переименовать", callback_data=f"rename:{link_id}")
-        ])
-    await safe_edit(message.bot, message.chat.id, initial_msg_id, result, keyboard)
     await state.clear()
+    if not url:
+        await safe_edit(
+            message.bot, message.chat.id, initial_msg_id,
+            "❌ Ошибка: Ссылка не найдена.\n\n<b>Что дальше?</b>",
+            get_main_inline_keyboard()
+        )
+        return
+    await enqueue_shorten_job(message, initial_msg_id, "shorten", [(url, title)], [])
 
-@router.message(LinkStates.waiting_for_mass_title)
+@router.message(LinkStates.waiting_for_mass_title, flags={"mutating": True})
 async def process_mass_title(message: Message, state: FSMContext):
+    """Поочерёдное переименование ссылок из последнего пакета."""
     await safe_delete(message)
     data = await state.get_data()
-    current_url, current_title = data.get("current_url"), data.get("current_title")
-    title = message.text.strip() if message.text else current_title or "Без названия"
-    initial_msg_id = data.get("initial_msg")
-    success, result, short_url = await process_and_save_link(current_url, title, message, state)
-    link = get_link_by_original_url(message.from_user.id, current_url)
-    link_id = link[0] if link else None
+    position = data.get("rename_pos", 0)
+    links = await get_job_links(data.get("rename_job"), message.from_user.id)
+    if position >= len(links):
+        await state.clear()
+        return
+    link = links[position]
+    title = message.text.strip() if message.text else ""
+    if len(title) > MAX_TITLE_LENGTH:
+        await message.answer(f"❌ Ошибка: Название слишком длинное (максимум {MAX_TITLE_LENGTH} символов). Попробуйте ещё раз.")
+        return
+    if title and not await rename_link(link["link_id"], message.from_user.id, title):
+        await message.answer(f"❌ Ошибка: Не удалось переименовать {link['short_url']}.")
+    position += 1
+    if position >= len(links):
+        await message.answer(
+            "✅ Переименование завершено.\n\n<b>Что дальше?</b>",
+            reply_markup=get_main_inline_keyboard(),
+            parse_mode="HTML"
+        )
+        await state.clear()
+        return
+    await state.update_data(rename_pos=position)
+    await message.answer(
+        f"✏️ Введите новое название для {links[position]['short_url']}.",
+        reply_markup=get_cancel_shorten_keyboard()
+    )
 
-    if len(title) > 100:
-        data.setdefault("failed_links", []).append(
-            f"❌ Ошибка: Название для {current_url} слишком длинное (максимум 100 символов)."
+@router.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext):
+    await safe_delete(message)
+    msg = await message.answer(
+        f"📥 Пришлите текстовый файл со ссылками (до {MAX_LINKS_PER_IMPORT}, каждая с новой строки, "
+        "можно с описанием: ссылка | описание).",
+        reply_markup=get_cancel_shorten_keyboard()
+    )
+    await state.update_data(initial_msg=msg.message_id)
+    await state.set_state(LinkStates.waiting_for_import)
+
+@router.message(LinkStates.waiting_for_import, F.document, flags={"mutating": True})
+async def process_import_file(message: Message, state: FSMContext):
+    data = await state.get_data()
+    initial_msg_id = data.get("initial_msg")
+    await state.clear()
+    try:
+        content = await message.bot.download(message.document)
+        lines = content.read().decode("utf-8-sig", errors="replace").splitlines()
+    except Exception as e:
+        logger.error(f"Ошибка загрузки файла импорта: {e}")
+        await safe_edit(
+            message.bot, message.chat.id, initial_msg_id,
+            "❌ Ошибка: Не удалось прочитать файл.\n\n<b>Что дальше?</b>",
+            get_main_inline_keyboard()
         )
-    else:
-        if success and link_id:
-            data.setdefault("successful_links", []).append({"title": title, "short_url": short_url, "link_id": link_id})
-        else:
-            data.setdefault("failed_links", []).append(result)
+        return
+    finally:
+        await safe_delete(message)
+    # Файл может быть на десятки тысяч строк: разбор в потоке не держит цикл событий
+    result = await asyncio.to_thread(parse_batch, lines)
+    if len(result.accepted) > MAX_LINKS_PER_IMPORT:
+        await safe_edit(
+            message.bot, message.chat.id, initial_msg_id,
+            f"❌ Ошибка: Лимит импорта — {MAX_LINKS_PER_IMPORT} ссылок.\n\n<b>Что дальше?</b>",
+            get_main_inline_keyboard()
+        )
+        return
+    result = await exclude_existing(message.from_user.id, result)
+    processed, failed = result.pairs, result.errors
+    if not processed:
+        text = "❌ Ошибка: Ни одной валидной ссылки.\n" + "\n".join(failed[:20]) + "\n\n<b>Что дальше?</b>"
+        await safe_edit(message.bot, message.chat.id, initial_msg_id, text, get_main_inline_keyboard())
+        return
+    await enqueue_shorten_job(message, initial_msg_id, "import", processed, failed)
 
-    await state.update_data(successful_links=data["successful_links"], failed_links=data["failed_links"])
+@router.message(Command("find"))
+async def cmd_find(message: Message, command: CommandObject, state: FSMContext):
+    await safe_delete(message)
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer(
+            "🔎 Укажите запрос: /find <часть названия или адреса>\n\n<b>Что дальше?</b>",
+            reply_markup=get_main_inline_keyboard(),
+            parse_mode="HTML"
+        )
+        return
+    await state.update_data(search_query=query)
+    await send_search_page(message, message.from_user.id, query, 1)
 
-    if data.get("urls"):
-        await process_mass_urls(message, state)
+async def send_search_page(message: Message, user_id: int, query: str, page: int, edit: bool = False):
+    per_page = 5
+    links, has_more = await search_links(user_id, query, per_page, (page - 1) * per_page)
+    archive_button = InlineKeyboardButton(text="🗄 Искать в архиве", callback_data="find_archive:1")
+    if not links and page == 1:
+        await message.answer(
+            f"🔎 По запросу «{html_decoration.quote(query)}» ничего не найдено.\n\n<b>Что дальше?</b>",
+            reply_markup=get_main_inline_keyboard([archive_button]),
+            parse_mode="HTML"
+        )
+        return
+    keyboard = [[InlineKeyboardButton(text=f"📍 {title}", callback_data=f"link:{link_id}")]
+                for link_id, title, _, _ in links]
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton(text="◄ Назад", callback_data=f"find:{page - 1}"))
+    if has_more:
+        nav.append(InlineKeyboardButton(text="📄 Далее", callback_data=f"find:{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    if not has_more:
+        keyboard.append([archive_button])
+    text = f"<b>🔎 Результаты по «{html_decoration.quote(query)}» (страница {page}):</b>"
+    markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
+    if edit:
+        await safe_edit(message.bot, message.chat.id, message.message_id, text, markup)
     else:
-        await finalize_mass_processing(message, state)
+        await message.answer(text, reply_markup=markup, parse_mode="HTML")
 
-async def finalize_mass_processing(message: Message, state: FSMContext):
+@router.callback_query(F.data.startswith("find:"))
+async def handle_search_pagination(callback: CallbackQuery, state: FSMContext):
+    try:
+        page = max(1, int(callback.data.split(":")[1]))
+    except (IndexError, ValueError):
+        await callback.answer("Ошибка: неверный номер страницы", show_alert=True)
+        return
     data = await state.get_data()
-    initial_msg_id = data.get("initial_msg")
-    s = data.get("successful_links", [])
-    f = data.get("failed_links", [])
-    partial_success = len(s) > 0
-
-    text = f"{'✅' if partial_success else '❌'} Готово! Добавлено: {len(s)}\n"
-    for i, link in enumerate(s, 1):
-        text += f"{i}. {link['title']} — {hlink(link['title'], link['short_url'])}\n"
-    if f:
-        text += "\n❌ Ошибки:\n" + "\n".join(f)
-    text += "\n<b>Что дальше?</b>"
+    query = data.get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите /find", show_alert=True)
+        return
+    await send_search_page(callback.message, callback.from_user.id, query, page, edit=True)
+    await callback.answer()
 
-    keyboard = get_main_inline_keyboard()
-    if partial_success:
-        keyboard.inline_keyboard.append([
-            InlineKeyboardButton(text="📋 Скопировать все", callback_data="copy_all"),
-            InlineKeyboardButton(text="✏️ Переименовать", callback_data="rename_mass")
-        ])
-    await safe_edit(message.bot, message.chat.id, initial_msg_id, text, keyboard)
+@router.callback_query(F.data.startswith("find_archive:"))
+async def search_archive(callback: CallbackQuery, state: FSMContext):
+    query = (await state.get_data()).get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите /find", show_alert=True)
+        return
+    try:
+        page = max(1, int(callback.data.split(":")[1]))
+    except (IndexError, ValueError):
+        await callback.answer("Ошибка: неверный номер страницы", show_alert=True)
+        return
+    await send_archive_page(callback, page, query)
+    await callback.answer()
+
+@router.inline_query()
+async def inline_search(inline_query: InlineQuery):
+    per_page = 20
+    try:
+        offset = int(inline_query.offset or 0)
+    except ValueError:
+        offset = 0
+    links, has_more = await search_links(inline_query.from_user.id, inline_query.query, per_page, offset)
+    results = [
+        InlineQueryResultArticle(
+            id=str(link_id),
+            title=title or "Без названия",
+            description=short_url,
+            input_message_content=InputTextMessageContent(message_text=short_url)
+        )
+        for link_id, title, short_url, _ in links
+    ]
+    await inline_query.answer(
+        results,
+        cache_time=5,
+        is_personal=True,
+        next_offset=str(offset + per_page) if has_more else ""
+    )
+
+@router.message(Command("cache"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_cache_stats(message: Message):
+    await safe_delete(message)
+    # QR и резервные копии подгружаются при первом обращении, а не при импорте обработчиков
+    from backup import backup_stats
+    from qr import qr_cache, qr_stats
+    stats = link_cache.stats()
+    vk = vk_limiter.stats()
+    qr = qr_cache.stats()
+    shared_urls, shared_hits = await get_shared_short_link_stats()
+    await message.answer(
+        "<b>🗄 Кэш ссылок</b>\n"
+        f"Записей: {stats['size']} из {stats['maxsize']}\n"
+        f"Попаданий: {stats['hits']}, промахов: {stats['misses']} ({stats['hit_rate']:.1%})\n"
+        f"Вытеснено: {stats['evictions']}, сброшено: {stats['invalidations']}\n\n"
+        "<b>♻️ Общий кэш сокращений</b>\n"
+        f"URL: {shared_urls}, попаданий за всё время: {shared_hits}\n"
+        f"С запуска: попаданий {reuse_stats['hits']}, запросов к VK {reuse_stats['misses']}, "
+        f"в обход кэша {reuse_stats['bypassed']}\n\n"
+        "<b>✏️ Редактирования</b>\n"
+        f"Отправлено: {render_stats['edits']}, пропущено без изменений: {render_stats['skipped']}\n\n"
+        "<b>🧾 Состояние FSM</b>\n"
+        f"Записей: {state_stats['writes']}, средний размер: "
+        f"{state_stats['bytes_total'] // max(1, state_stats['writes'])} байт, "
+        f"максимум: {state_stats['bytes_max']} байт, сверх лимита: {state_stats['over_limit']}\n\n"
+        "<b>🧹 Реестр сообщений</b>\n"
+        f"Записей: {len(registry)} из {registry.maxsize}, вытеснено: {registry.evictions}\n"
+        f"Удалено устаревших: {sweeper_stats['deleted']} из {sweeper_stats['scheduled']} "
+        f"за {sweeper_stats['calls']} вызовов, не удалось: {sweeper_stats['failed']}\n\n"
+        "<b>🔁 Повторы</b>\n"
+        f"Пропущено апдейтов: {dedup_stats['updates']}, действий: {dedup_stats['actions']}\n\n"
+        "<b>🚦 Запросы к VK</b>\n"
+        f"Предел: {vk['limit']:.1f}, в работе: {vk['in_flight']}, в очереди: {vk['queued']}\n"
+        f"Запросов: {vk['requests']}, снижений из-за перегрузки: {vk['drops']}, "
+        f"задержка: {vk['recent_ms']:.0f} мс (базовая {vk['baseline_ms']:.0f} мс)\n"
+        f"Фоновых в очереди: {vk['queued_bulk']}, показано из снимков при перегрузке: {shed_stats['shed']}\n\n"
+        "<b>🗃 Обращения к базе</b>\n"
+        f"Занято: {db_gate.in_flight} из {int(db_gate.limit)}, в очереди: {db_gate.queued}\n\n"
+        "<b>💾 Резервные копии</b>\n"
+        f"Снято: {backup_stats['created']}, ошибок: {backup_stats['failed']}, последняя: "
+        f"{backup_stats['last_path'] or '—'} ({backup_stats['last_size'] // 1024} КБ, "
+        f"{backup_stats['last_seconds']:.1f} с)\n\n"
+        "<b>🔳 QR-коды</b>\n"
+        f"На диске: {qr['files']} ({qr['bytes'] // 1024} из {qr['max_bytes'] // 1024} КБ), "
+        f"нарисовано: {qr_stats['rendered']}, с диска: {qr_stats['disk']}, по file_id: {qr_stats['file_id']}, "
+        f"вытеснено: {qr_stats['evicted']}",
+        parse_mode="HTML"
+    )
+
+def format_activity(last_activity: Optional[str]) -> str:
+    if not last_activity:
+        return "—"
+    try:
+        return datetime.fromisoformat(last_activity).strftime("%d.%m.%Y %H:%M")
+    except ValueError:
+        return last_activity[:16]
+
+@router.message(Command("me"))
+async def cmd_me(message: Message):
+    await safe_delete(message)
+    link_count, archived_count, total_views, last_activity = await get_user_counters(message.from_user.id)
+    await message.answer(
+        "<b>👤 Ваша сводка</b>\n"
+        f"Ссылок: {link_count} (в архиве: {archived_count})\n"
+        f"Переходов (по последним снимкам статистики): {total_views}\n"
+        f"Последнее изменение: {format_activity(last_activity)}\n\n"
+        "<b>Что дальше?</b>",
+        reply_markup=get_main_inline_keyboard(),
+        parse_mode="HTML"
+    )
+
+@router.message(Command("summary"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_summary(message: Message):
+    await safe_delete(message)
+    users, links, archived, views, last_activity = await get_counter_totals()
+    await message.answer(
+        "<b>📈 Сводка по боту</b>\n"
+        f"Пользователей со ссылками: {users}\n"
+        f"Ссылок: {links} (в архиве: {archived})\n"
+        f"Переходов: {views}\n"
+        f"Последнее изменение: {format_activity(last_activity)}\n\n"
+        "Проверить и пересчитать счётчики: /recount",
+        parse_mode="HTML"
+    )
+
+@router.message(Command("recount"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_recount(message: Message):
+    await safe_delete(message)
+    result = await rebuild_user_counters()
+    if result is None:
+        await message.answer("❌ Ошибка: Не удалось пересчитать счётчики.")
+        return
+    mismatched, totals_mismatched = result
+    await message.answer(
+        "🧮 Счётчики пересчитаны по данным. "
+        + (f"Расхождений у пользователей: {mismatched}, в общих итогах: {'да' if totals_mismatched else 'нет'}."
+           if mismatched or totals_mismatched else "Расхождений не было.")
+    )
+
+@router.message(Command("backup"), F.from_user.id.in_(ADMIN_IDS), flags={"mutating": True})
+async def cmd_backup(message: Message):
+    from backup import create_backup
+    await safe_delete(message)
+    try:
+        info = await create_backup()
+    except Exception as e:
+        logger.error(f"Ошибка резервного копирования: {e}")
+        await message.answer("❌ Ошибка: Не удалось снять резервную копию.")
+        return
+    await message.answer(
+        f"💾 Резервная копия: {info.path}\n"
+        f"{info.size // 1024} КБ → {info.compressed // 1024} КБ, {info.seconds:.1f} с, проверена integrity_check."
+    )
+
+# Переключатели без флага mutating: повторная команда — новое переключение, а не повтор
+@router.message(Command("own_keys"))
+async def cmd_own_keys(message: Message):
+    await safe_delete(message)
+    enabled = not await get_distinct_keys(message.from_user.id)
+    if not await set_distinct_keys(message.from_user.id, enabled):
+        await message.answer("❌ Ошибка: Не удалось сохранить настройку.\n\n<b>Что дальше?</b>", parse_mode="HTML")
+        return
+    text = (
+        "🔑 Отдельные ключи включены: новые ссылки всегда получают собственный vk.cc-адрес "
+        "и отдельную статистику."
+        if enabled else
+        "♻️ Отдельные ключи выключены: если такую ссылку уже сокращали, бот переиспользует "
+        "готовый vk.cc-адрес (статистика переходов по нему общая)."
+    )
+    await message.answer(text + "\n\n<b>Что дальше?</b>", reply_markup=get_main_inline_keyboard(), parse_mode="HTML")
+
+DIGEST_CYCLE = {None: "daily", "daily": "weekly", "weekly": None}
+
+@router.message(Command("digest"))
+async def cmd_digest(message: Message):
+    """Переключает дайджест: выключен → ежедневный → еженедельный → выключен."""
+    await safe_delete(message)
+    user_id = message.from_user.id
+    period = DIGEST_CYCLE.get(await get_digest(user_id))
+    next_at = next_digest_at(user_id, period) if period else None
+    if not await set_digest(user_id, message.chat.id, period, next_at):
+        await message.answer("❌ Ошибка: Не удалось сохранить настройку.\n\n<b>Что дальше?</b>", parse_mode="HTML")
+        return
+    if period:
+        # Прирост в первом дайджесте считается от текущих сохранённых просмотров
+        await mark_digest_baseline(user_id)
+        when = datetime.fromtimestamp(next_at).strftime("%d.%m %H:%M")
+        text = (
+            f"📬 Дайджест {PERIODS[period]} включён: прирост переходов по вашим ссылкам. "
+            f"Ближайший — {when}. Повторите /digest, чтобы сменить период или выключить."
+        )
+    else:
+        text = "📭 Дайджест выключен."
+    await message.answer(text + "\n\n<b>Что дальше?</b>", reply_markup=get_main_inline_keyboard(), parse_mode="HTML")
+
+@router.message(Command("export"), flags={"mutating": True})
+async def cmd_export(message: Message, state: FSMContext):
+    await safe_delete(message)
     await state.clear()
+    job_id = await enqueue_job(message.from_user.id, message.chat.id, "export")
+    text = "⏳ Готовлю выгрузку, файл придёт отдельным сообщением." if job_id else \
+        "❌ Ошибка: Не удалось запустить выгрузку.\n\n<b>Что дальше?</b>"
+    await message.answer(text, parse_mode="HTML")
 
-@router.message(F.text.lower().strip() == "мои ссылки")
-async def show_user_links(message: Message, state: FSMContext):
+@router.message(Command("refresh_stats"), flags={"mutating": True})
+async def cmd_refresh_stats(message: Message, state: FSMContext):
     await safe_delete(message)
-    logger.info(f"Запрос списка ссылок для user_id={message.from_user.id}")
-    links = get_links_by_user(message.from_user.id)
+    await state.clear()
+    links = await get_links_by_user(message.from_user.id)
     if not links:
         await message.answer(
             "У вас пока нет сохранённых ссылок.\n\n<b>Что дальше?</b>",
@@ -393,29 +718,113 @@ async def show_user_links(message: Message, state: FSMContext):
             parse_mode="HTML"
         )
         return
-    await state.update_data(links=links, page=1, last_msg_id=None)
-    await send_links_page(message, links, 1, state)
+    msg = await message.answer(f"⏳ Обновляю статистику {len(links)} ссылок...")
+    job_id = await enqueue_job(
+        message.from_user.id, message.chat.id, "stats_backfill",
+        items=[{"link_id": link[0]} for link in links], message_id=msg.message_id
+    )
+    if job_id is None:
+        await safe_edit(
+            message.bot, message.chat.id, msg.message_id,
+            "❌ Ошибка: Не удалось запустить обновление статистики.\n\n<b>Что дальше?</b>",
+            get_main_inline_keyboard()
+        )
 
-async def send_links_page(message: Message, links, page, state: FSMContext):
-    per_page = 5
-    total_pages = max(1, len(links) // per_page + (1 if len(links) % per_page else 0))
-    page = max(1, min(page, total_pages))
-    start = (page - 1) * per_page
-    end = start + per_page
-    current_links = links[start:end]
+@router.message(F.text.lower().strip() == "мои ссылки")
+async def show_user_links(message: Message, state: FSMContext, user_id: int | None = None):
+    await safe_delete(message)
+    user_id = user_id or message.from_user.id
+    logger.info(f"Запрос списка ссылок для user_id={user_id}")
+    await state.update_data(page=1, last_msg_id=None)
+    await send_links_page(message, 1, state, user_id)
+
+LINK_SORT_BUTTONS = (("date", "🕒 Дата"), ("views", "👁 Переходы"), ("growth", "📈 Рост"))
+LINKS_PER_PAGE = 5
+
+def get_selection(data: dict) -> Selection | None:
+    """Выбор ссылок из данных FSM; None — режим выбора выключен."""
+    encoded = data.get("sel")
+    return Selection.decode(encoded) if encoded is not None else None
+
+async def set_selection(state: FSMContext, selection: Selection | None) -> None:
+    data = await state.get_data()
+    data.pop("sel", None)
+    if selection is not None:
+        data["sel"] = selection.encode()
+    await state.set_data(data)
+
+async def render_links_page(user_id: int, page: int, data: dict) -> tuple[int, int, str, InlineKeyboardMarkup]:
+    """Номер страницы, число ссылок, текст и клавиатура списка; в режиме выбора кнопки ссылок отмечают их."""
+    per_page = LINKS_PER_PAGE
+    sort = data.get("sort")
+    current_sort = sort or "date"
+    selection = get_selection(data)
+    page = max(1, page)
+    current_links, total, archived = await get_links_page(user_id, sort, (page - 1) * per_page, per_page)
+    total_pages = max(1, total // per_page + (1 if total % per_page else 0))
+    if page > total_pages:  # список сократился, например после удаления
+        page = total_pages
+        current_links, total, archived = await get_links_page(user_id, sort, (page - 1) * per_page, per_page)
+    archive_button = InlineKeyboardButton(text=f"🗄 Архив ({archived})", callback_data="archive:1")
+    if not total:
+        if archived:
+            return page, 0, "В списке нет ссылок, остальные — в архиве.\n\n<b>Что дальше?</b>", \
+                get_main_inline_keyboard([archive_button])
+        return page, 0, "У вас пока нет сохранённых ссылок.\n\n<b>Что дальше?</b>", get_main_inline_keyboard()
+    overloaded = vk_overloaded()
+    views = await get_views_for_links(user_id, current_links)
 
     keyboard = []
     for link in current_links:
         link_id, title, short_url, created_at = link
-        created_str = format_date(created_at)
-        keyboard.append([InlineKeyboardButton(text=f"📍 {title}", callback_data=f"link:{link_id}")])
+        link_views = views.get(link_id)
+        views_str = f" · 👁 {link_views}" if link_views is not None else ""
+        if selection is None:
+            keyboard.append([InlineKeyboardButton(text=f"📍 {title}{views_str}", callback_data=f"link:{link_id}")])
+        else:
+            mark = "✅" if link_id in selection else "⬜"
+            keyboard.append([InlineKeyboardButton(text=f"{mark} {title}{views_str}", callback_data=f"pick:{link_id}")])
     if total_pages > page:
         keyboard.append([InlineKeyboardButton(text="📄 Далее", callback_data=f"page:{page+1}")])
     if page > 1:
         keyboard.append([InlineKeyboardButton(text="◄ Назад", callback_data=f"page:{page-1}")])
 
+    if selection is None:
+        keyboard.append([
+            InlineKeyboardButton(text=f"• {label}" if key == current_sort else label, callback_data=f"sort:{key}")
+            for key, label in LINK_SORT_BUTTONS
+        ])
+        keyboard.append([InlineKeyboardButton(text="☑️ Выбрать несколько", callback_data="select:on")])
+        if archived:
+            keyboard.append([archive_button])
+    else:
+        selected = selection.count(total)
+        keyboard.append([
+            InlineKeyboardButton(text="☑️ Страницу", callback_data="pick:page"),
+            InlineKeyboardButton(text="☑️ Все", callback_data="pick:all"),
+            InlineKeyboardButton(text="⬜ Снять", callback_data="pick:none"),
+        ])
+        keyboard.append([
+            InlineKeyboardButton(text=f"🗑 Удалить ({selected})", callback_data="bulk:delete"),
+            InlineKeyboardButton(text="✏️ Префикс", callback_data="bulk:prefix"),
+            InlineKeyboardButton(text="🔄 Обновить", callback_data="bulk:refresh"),
+        ])
+        keyboard.append([InlineKeyboardButton(text="✖️ Готово", callback_data="select:off")])
+
     text = f"<b>📎 Ваши ссылки (страница {page} из {total_pages}):</b>"
+    if selection is not None:
+        text += f"\nВыбрано: {selected} из {total}"
+    if overloaded:
+        text += "\n⏳ VK перегружен, просмотры могут быть устаревшими"
+    return page, total, text, InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+async def send_links_page(message: Message, page, state: FSMContext, user_id: int):
+    """Страница списка: в состоянии хранятся только номер страницы, сортировка, выбор и id сообщения."""
     data = await state.get_data()
+    page, total, text, keyboard = await render_links_page(user_id, page, data)
+    if not total:
+        await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+        return
     last_msg_id = data.get("last_msg_id")
     if last_msg_id:
         try:
@@ -423,8 +832,15 @@ async def send_links_page(message: Message, links, page, state: FSMContext):
         except TelegramBadRequest:
             logger.debug(f"Не удалось удалить сообщение {last_msg_id}, возможно, оно уже удалено")
 
-    new_msg = await message.answer(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="HTML")
-    await state.update_data(links=links, page=page, last_msg_id=new_msg.message_id)
+    new_msg = await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
+    await state.update_data(page=page, last_msg_id=new_msg.message_id)
+
+async def redraw_links_page(callback: CallbackQuery, state: FSMContext):
+    """Перерисовывает список в нажатом сообщении (отметки в режиме выбора)."""
+    data = await state.get_data()
+    page, _, text, keyboard = await render_links_page(callback.from_user.id, data.get("page", 1), data)
+    await edit_message(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
+    await state.update_data(page=page, last_msg_id=callback.message.message_id)
 
 @router.callback_query(F.data.startswith("page:"))
 async def handle_pagination(callback: CallbackQuery, state: FSMContext):
@@ -434,18 +850,258 @@ async def handle_pagination(callback: CallbackQuery, state: FSMContext):
     except (IndexError, ValueError):
         await callback.answer("Ошибка: неверный номер страницы", show_alert=True)
         return
-    data = await state.get_data()
-    links = data.get("links", get_links_by_user(callback.from_user.id))
-    await send_links_page(callback.message, links, page, state)
+    await send_links_page(callback.message, page, state, callback.from_user.id)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("sort:"))
+async def handle_sort(callback: CallbackQuery, state: FSMContext):
+    sort = callback.data.split(":", 1)[1]
+    if sort not in dict(LINK_SORT_BUTTONS):
+        await callback.answer("Ошибка: неизвестная сортировка", show_alert=True)
+        return
+    await state.update_data(sort=None if sort == "date" else sort)
+    await send_links_page(callback.message, 1, state, callback.from_user.id)
     await callback.answer()
 
 @router.callback_query(F.data == "back_to_links")
 async def back_to_links(callback: CallbackQuery, state: FSMContext):
     await cleanup_old_messages(callback.bot, callback.message.chat.id, callback.message.message_id)
     data = await state.get_data()
-    links = get_links_by_user(callback.from_user.id)
-    page = data.get("page", 1)
-    await send_links_page(callback.message, links, page, state)
+    await send_links_page(callback.message, data.get("page", 1), state, callback.from_user.id)
+    await callback.answer()
+
+async def send_archive_page(callback: CallbackQuery, page: int, query: str | None = None):
+    """Страница архива (или поиска по нему) в нажатом сообщении; ссылки открываются как обычно."""
+    per_page = LINKS_PER_PAGE
+    links, has_more = await get_archived_links(callback.from_user.id, (page - 1) * per_page, per_page, query)
+    prefix = "find_archive" if query else "archive"
+    keyboard = [[InlineKeyboardButton(text=f"🗄 {title}", callback_data=f"link:{link_id}")]
+                for link_id, title, _, _ in links]
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton(text="◄ Назад", callback_data=f"{prefix}:{page - 1}"))
+    if has_more:
+        nav.append(InlineKeyboardButton(text="📄 Далее", callback_data=f"{prefix}:{page + 1}"))
+    if nav:
+        keyboard.append(nav)
+    if links and not query:
+        keyboard.append([InlineKeyboardButton(text="♻️ Вернуть все", callback_data="restore:all")])
+    keyboard.append([InlineKeyboardButton(text="◀️ К списку", callback_data="back_to_links")])
+    if query:
+        quoted = html_decoration.quote(query)
+        text = f"<b>🗄 Архив: результаты по «{quoted}» (страница {page}):</b>" if links else \
+            f"🗄 В архиве по запросу «{quoted}» ничего не найдено."
+    else:
+        text = f"<b>🗄 Архив (страница {page}):</b>\nСсылки без переходов дольше {ARCHIVE_AFTER_DAYS:g} дн." \
+            if links else "🗄 Архив пуст."
+    await edit_message(callback.message, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+                       parse_mode="HTML")
+
+@router.callback_query(F.data.startswith("archive:"))
+async def show_archive(callback: CallbackQuery):
+    await cleanup_old_messages(callback.bot, callback.message.chat.id, callback.message.message_id)
+    try:
+        page = max(1, int(callback.data.split(":")[1]))
+    except (IndexError, ValueError):
+        await callback.answer("Ошибка: неверный номер страницы", show_alert=True)
+        return
+    await send_archive_page(callback, page)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("restore:"), flags={"mutating": True})
+async def restore_from_archive(callback: CallbackQuery, state: FSMContext):
+    target = callback.data.split(":", 1)[1]
+    try:
+        ids = None if target == "all" else [int(target)]
+    except ValueError:
+        await callback.answer("Ошибка: неверный ID ссылки", show_alert=True)
+        return
+    restored = await restore_archived_links(callback.from_user.id, ids)
+    if not restored:
+        await callback.answer("❌ Не удалось вернуть: ссылки уже нет в архиве или она есть в списке", show_alert=True)
+        return
+    await redraw_links_page(callback, state)
+    await callback.answer(f"♻️ Возвращено в список: {restored}")
+
+async def show_archived_card(callback: CallbackQuery, link_id: int) -> bool:
+    """Карточка ссылки из архива: просмотры из сохранённого снимка, без запроса к VK."""
+    link = await get_archived_link(link_id, callback.from_user.id)
+    if not link:
+        return False
+    snapshot = (await get_stats_snapshots([link_id])).get(link_id)
+    views = f"👁 {snapshot[0]} переходов на {format_date(snapshot[1])}" if snapshot else "👁 Переходов не было"
+    text = (
+        f"🗄 {link.title} (в архиве)\n"
+        f"🔗 <a href='{link.short_url}'>Короткая ссылка</a>\n"
+        f"🌐 <a href='{link.original_url}'>Исходная ссылка</a>\n"
+        f"📆 {format_date(link.created_at)}\n"
+        f"{views}"
+    )
+    await edit_message(callback.message, text, reply_markup=get_archived_card_keyboard(link_id), parse_mode="HTML")
+    await callback.answer()
+    return True
+
+@router.callback_query(F.data.startswith("select:"))
+async def toggle_selection_mode(callback: CallbackQuery, state: FSMContext):
+    await cleanup_old_messages(callback.bot, callback.message.chat.id, callback.message.message_id)
+    await set_selection(state, Selection() if callback.data == "select:on" else None)
+    await redraw_links_page(callback, state)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("pick:"))
+async def pick_links(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    selection = get_selection(data)
+    if selection is None:
+        await callback.answer("Режим выбора выключен", show_alert=True)
+        return
+    target = callback.data.split(":", 1)[1]
+    if target == "all":
+        selection.select_all()
+    elif target == "none":
+        selection.clear()
+    elif target == "page":
+        page = data.get("page", 1)
+        links, _, _ = await get_links_page(callback.from_user.id, data.get("sort"), (page - 1) * LINKS_PER_PAGE, LINKS_PER_PAGE)
+        selection.add(link[0] for link in links)
+    else:
+        try:
+            selection.toggle(int(target))
+        except ValueError:
+            await callback.answer("Ошибка: неверный ID ссылки", show_alert=True)
+            return
+    await set_selection(state, selection)
+    await redraw_links_page(callback, state)
+    await callback.answer()
+
+async def selected_or_alert(callback: CallbackQuery, state: FSMContext) -> Selection | None:
+    """Текущий выбор, если в нём есть ссылки; иначе предупреждение."""
+    selection = get_selection(await state.get_data())
+    if selection is None or not (selection.exclude or selection.ids):
+        await callback.answer("Сначала отметьте ссылки", show_alert=True)
+        return None
+    return selection
+
+def undo_keyboard(undo_id: int) -> InlineKeyboardMarkup:
+    return get_main_inline_keyboard([InlineKeyboardButton(text="↩️ Отменить", callback_data=f"undo:{undo_id}")])
+
+@router.callback_query(F.data == "bulk:delete")
+async def confirm_bulk_delete(callback: CallbackQuery, state: FSMContext):
+    selection = await selected_or_alert(callback, state)
+    if selection is None:
+        return
+    link_count, archived_count, _, _ = await get_user_counters(callback.from_user.id)
+    total = link_count - archived_count
+    await edit_message(callback.message,
+        f"🗑 Удалить выбранные ссылки ({selection.count(total)})? "
+        f"Отменить удаление можно будет в течение {BULK_UNDO_SECONDS} с.\n\n<b>Подтвердите удаление:</b>",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Да, удалить", callback_data="bulk:delete:yes")],
+            [InlineKeyboardButton(text="❌ Нет", callback_data="bulk:back")],
+        ]),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+@router.callback_query(F.data == "bulk:back")
+async def back_to_selection(callback: CallbackQuery, state: FSMContext):
+    await redraw_links_page(callback, state)
+    await callback.answer()
+
+@router.callback_query(F.data == "bulk:delete:yes", flags={"mutating": True})
+async def bulk_delete(callback: CallbackQuery, state: FSMContext):
+    selection = await selected_or_alert(callback, state)
+    if selection is None:
+        return
+    result = await delete_links_bulk(callback.from_user.id, list(selection.ids), selection.exclude)
+    if result is None:
+        await edit_message(callback.message,
+            "❌ Ошибка: Не удалось удалить ссылки.\n\n<b>Что дальше?</b>",
+            reply_markup=get_main_inline_keyboard(),
+            parse_mode="HTML"
+        )
+        await callback.answer()
+        return
+    undo_id, deleted = result
+    await set_selection(state, None)
+    await edit_message(callback.message,
+        f"✅ Удалено ссылок: {deleted}. Отменить можно в течение {BULK_UNDO_SECONDS} с.\n\n<b>Что дальше?</b>",
+        reply_markup=undo_keyboard(undo_id),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+@router.callback_query(F.data == "bulk:prefix")
+async def ask_bulk_prefix(callback: CallbackQuery, state: FSMContext):
+    selection = await selected_or_alert(callback, state)
+    if selection is None:
+        return
+    await state.set_state(LinkStates.waiting_for_bulk_prefix)
+    await callback.message.answer(
+        "✏️ Введите префикс: он будет добавлен в начало названий выбранных ссылок.",
+        reply_markup=get_cancel_shorten_keyboard()
+    )
+    await callback.answer()
+
+@router.message(LinkStates.waiting_for_bulk_prefix, flags={"mutating": True})
+async def set_bulk_prefix(message: Message, state: FSMContext):
+    await safe_delete(message)
+    await state.set_state(None)
+    prefix = (message.text or "").strip()
+    selection = get_selection(await state.get_data())
+    if not prefix or len(prefix) > 50 or selection is None:
+        await message.answer(
+            "❌ Ошибка: Префикс не может быть пустым или длиннее 50 символов.\n\n<b>Что дальше?</b>",
+            reply_markup=get_main_inline_keyboard(),
+            parse_mode="HTML"
+        )
+        return
+    result = await prefix_titles_bulk(message.from_user.id, list(selection.ids), selection.exclude, prefix + " ")
+    if result is None:
+        await message.answer(
+            "❌ Ошибка: Не удалось обновить названия.\n\n<b>Что дальше?</b>",
+            reply_markup=get_main_inline_keyboard(),
+            parse_mode="HTML"
+        )
+        return
+    undo_id, renamed, truncated = result
+    await set_selection(state, None)
+    note = f"\n✂️ Обрезано до {MAX_TITLE_LENGTH} символов: {truncated}." if truncated else ""
+    await message.answer(
+        f"✅ Переименовано ссылок: {renamed}. Отменить можно в течение {BULK_UNDO_SECONDS} с.{note}\n\n<b>Что дальше?</b>",
+        reply_markup=undo_keyboard(undo_id),
+        parse_mode="HTML"
+    )
+
+@router.callback_query(F.data == "bulk:refresh", flags={"mutating": True})
+async def bulk_refresh(callback: CallbackQuery, state: FSMContext):
+    selection = await selected_or_alert(callback, state)
+    if selection is None:
+        return
+    if vk_overloaded():
+        await callback.answer("⏳ VK перегружен, попробуйте обновить позже", show_alert=True)
+        return
+    links = await get_selected_links(callback.from_user.id, list(selection.ids), selection.exclude)
+    # max_age=0: все выбранные идут в VK пакетами execute и сохраняются одной транзакцией
+    views = await get_views_for_links(callback.from_user.id, links, max_age=0)
+    await redraw_links_page(callback, state)
+    await callback.answer(f"🔄 Обновлено ссылок: {len(views)}")
+
+@router.callback_query(F.data.startswith("undo:"), flags={"mutating": True})
+async def undo_bulk(callback: CallbackQuery):
+    try:
+        undo_id = int(callback.data.split(":", 1)[1])
+    except ValueError:
+        await callback.answer("Ошибка: неверное действие", show_alert=True)
+        return
+    result = await undo_bulk_action(undo_id, callback.from_user.id)
+    if result is None:
+        await callback.answer("Отменить уже нельзя: время вышло", show_alert=True)
+        return
+    kind, restored = result
+    text = f"↩️ Восстановлено ссылок: {restored}." if kind == "delete" else f"↩️ Прежние названия возвращены: {restored}."
+    await edit_message(callback.message, text + "\n\n<b>Что дальше?</b>",
+                       reply_markup=get_main_inline_keyboard(), parse_mode="HTML")
     await callback.answer()
 
 @router.callback_query(F.data.startswith("link:"))
@@ -457,10 +1113,12 @@ async def show_link_card(callback: CallbackQuery, state: FSMContext):
         await callback.answer("Ошибка: неверный ID ссылки", show_alert=True)
         return
     user_id = callback.from_user.id
-    link = get_link_by_id(link_id, user_id)
+    link = await get_link_by_id(link_id, user_id)
     if not link:
+        if await show_archived_card(callback, link_id):
+            return
         await callback.answer("❌ Ошибка: Ссылка не найдена", show_alert=True)
-        await callback.message.edit_text(
+        await edit_message(callback.message, 
             "❌ Ошибка: Ссылка не найдена.\n\n<b>Что дальше?</b>",
             reply_markup=get_main_inline_keyboard(),
             parse_mode="HTML"
@@ -468,17 +1126,16 @@ async def show_link_card(callback: CallbackQuery, state: FSMContext):
         return
     _, _, long_url, short_url, title, vk_key, created_at = link
     created_str = format_date(created_at)
-    stats = await get_link_stats(vk_key, VK_TOKEN)
-    views = stats.get("views", 0)
+    views, fetched_at = await get_link_views(link_id, user_id, vk_key)
 
     text = (
         f"📍 {title}\n"
         f"🔗 <a href='{short_url}'>Короткая ссылка</a>\n"
         f"🌐 <a href='{long_url}'>Исходная ссылка</a>\n"
         f"📆 {created_str}\n"
-        f"👁 {views} переходов"
+        f"👁 {views} переходов{stale_note(fetched_at)}"
     )
-    await callback.message.edit_text(
+    await edit_message(callback.message, 
         text,
         reply_markup=get_link_card_keyboard(link_id),
         parse_mode="HTML"
@@ -495,28 +1152,66 @@ async def show_stats(callback: CallbackQuery):
         await callback.answer("Ошибка: неверный ID ссылки", show_alert=True)
         return
     user_id = callback.from_user.id
-    link = get_link_by_id(link_id, user_id)
+    link = await get_link_by_id(link_id, user_id) or await get_archived_link(link_id, user_id)
     if not link:
         await callback.answer("❌ Ошибка: Ссылка не найдена", show_alert=True)
-        await callback.message.edit_text(
+        await edit_message(callback.message, 
             "❌ Ошибка: Ссылка не найдена.\n\n<b>Что дальше?</b>",
             reply_markup=get_main_inline_keyboard(),
             parse_mode="HTML"
         )
         return
     _, _, _, short_url, _, vk_key, _ = link
-    stats = await get_link_stats(vk_key, VK_TOKEN)
-    text = f"📊 Статистика по {hlink(short_url, short_url)}\n{format_link_stats(stats, short_url)}"
-    await callback.message.edit_text(text, reply_markup=get_stats_keyboard(), parse_mode="HTML")
+    summary, fetched_at = await get_link_summary(link_id, user_id, vk_key)
+    names = await resolve_summary(summary, fetch=False)
+    text = (
+        f"📊 Статистика по {hlink(short_url, short_url)}\n{format_link_stats(summary, short_url, names)}"
+        f"{stale_note(fetched_at)}"
+    )
+    await edit_message(callback.message, text, reply_markup=get_stats_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("qr:"))
+async def send_qr(callback: CallbackQuery):
+    from qr import qr_cache, qr_stats
+    try:
+        link_id = int(callback.data.split(":")[1])
+    except (IndexError, ValueError):
+        await callback.answer("Ошибка: неверный ID ссылки", show_alert=True)
+        return
+    user_id = callback.from_user.id
+    link = await get_link_by_id(link_id, user_id) or await get_archived_link(link_id, user_id)
+    if not link:
+        await callback.answer("❌ Ошибка: Ссылка не найдена", show_alert=True)
+        return
+    short_url = link[3]
+    caption = f"🔳 QR-код для {short_url}"
+    # Уже загруженная картинка отправляется по file_id: без отрисовки и без загрузки
+    file_id = await get_qr_file_id(short_url)
+    if file_id:
+        try:
+            await callback.message.answer_photo(file_id, caption=caption)
+            qr_stats["file_id"] += 1
+            await callback.answer()
+            return
+        except TelegramBadRequest as e:
+            logger.warning(f"file_id QR-кода {short_url} не принят, загружаю заново: {e}")
+            await save_qr_file_id(short_url, None)
+    try:
+        png = await qr_cache.get_png(short_url)
+    except Exception as e:
+        logger.error(f"Ошибка при построении QR-кода {short_url}: {e}")
+        await callback.answer("❌ Ошибка: Не удалось построить QR-код", show_alert=True)
+        return
+    sent = await callback.message.answer_photo(BufferedInputFile(png, "qr.png"), caption=caption)
+    await save_qr_file_id(short_url, sent.photo[-1].file_id)
     await callback.answer()
 
 @router.callback_query(F.data == "back_from_stats")
 async def back_from_stats(callback: CallbackQuery, state: FSMContext):
     await cleanup_old_messages(callback.bot, callback.message.chat.id, callback.message.message_id)
     data = await state.get_data()
-    links = get_links_by_user(callback.from_user.id)
-    page = data.get("page", 1)
-    await send_links_page(callback.message, links, page, state)
+    await send_links_page(callback.message, data.get("page", 1), state, callback.from_user.id)
     await callback.answer()
 
 @router.callback_query(F.data.startswith("rename:"))
@@ -550,7 +1245,7 @@ async def rename_single_link(callback: CallbackQuery, state: FSMContext):
         link_id = int(callback.data.split(":", 2)[1])
     except (IndexError, ValueError):
         await callback.answer("Ошибка: неверный ID ссылки", show_alert=True)
-        await callback.message.edit_text(
+        await edit_message(callback.message, 
             "❌ Ошибка: Ссылка не найдена.\n\n<b>Что дальше?</b>",
             reply_markup=get_main_inline_keyboard(),
             parse_mode="HTML"
@@ -561,13 +1256,26 @@ async def rename_single_link(callback: CallbackQuery, state: FSMContext):
     await callback.message.answer("✏️ Введите новое название ссылки:", reply_markup=get_rename_keyboard(link_id))
     await callback.answer()
 
-@router.callback_query(F.data == "copy_all")
+def callback_job_id(callback: CallbackQuery) -> int | None:
+    """ID задачи из callback_data вида 'copy_all:<job_id>'."""
+    try:
+        return int(callback.data.split(":", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+async def get_job_links(job_id: int | None, user_id: int) -> list:
+    """Успешно сохранённые ссылки пакета; сам список хранится в job_items, а не в FSM."""
+    if job_id is None or not await get_job(job_id, user_id):
+        return []
+    items = await get_job_items(job_id)
+    return [item["result"] for item in items if item["result"] and item["result"].get("ok")]
+
+@router.callback_query(F.data.startswith("copy_all"))
 async def copy_all_links(callback: CallbackQuery, state: FSMContext):
     await cleanup_old_messages(callback.bot, callback.message.chat.id, callback.message.message_id)
-    data = await state.get_data()
-    successful_links = data.get("successful_links", [])
+    successful_links = await get_job_links(callback_job_id(callback), callback.from_user.id)
     if not successful_links:
-        await callback.message.edit_text(
+        await edit_message(callback.message, 
             "❌ Ошибка: Нет ссылок для копирования.\n\n<b>Что дальше?</b>",
             reply_markup=get_main_inline_keyboard(),
             parse_mode="HTML"
@@ -577,38 +1285,30 @@ async def copy_all_links(callback: CallbackQuery, state: FSMContext):
     for i, link in enumerate(successful_links, 1):
         text += f"{i}. {link['title']} — {link['short_url']}\n"
     text += "\n<b>Что дальше?</b>"
-    await callback.message.edit_text(text, reply_markup=get_main_inline_keyboard(), parse_mode="HTML")
+    await edit_message(callback.message, text, reply_markup=get_main_inline_keyboard(), parse_mode="HTML")
     await callback.answer()
 
-@router.callback_query(F.data == "rename_mass")
+@router.callback_query(F.data.startswith("rename_mass"))
 async def rename_mass_links(callback: CallbackQuery, state: FSMContext):
     await cleanup_old_messages(callback.bot, callback.message.chat.id, callback.message.message_id)
-    data = await state.get_data()
-    successful_links = data.get("successful_links", [])
+    job_id = callback_job_id(callback)
+    successful_links = await get_job_links(job_id, callback.from_user.id)
     if not successful_links:
-        await callback.message.edit_text(
+        await edit_message(callback.message, 
             "❌ Ошибка: Нет ссылок для переименования.\n\n<b>Что дальше?</b>",
             reply_markup=get_main_inline_keyboard(),
             parse_mode="HTML"
         )
         return
     await state.set_state(LinkStates.waiting_for_mass_title)
-    await state.update_data(
-        urls=[(link["short_url"], link["title"], link["link_id"]) for link in successful_links],
-        current_url=successful_links[0]["short_url"],
-        current_title=successful_links[0]["title"],
-        successful_links=[],
-        failed_links=data.get("failed_links", [])
-    )
+    await state.update_data(rename_job=job_id, rename_pos=0)
     await callback.message.answer(
-        f"✏️ Введите новое название для {successful_links[0]['short_url']} (или оставьте пустым).",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_shorten")]
-        ])
+        f"✏️ Введите новое название для {successful_links[0]['short_url']}.",
+        reply_markup=get_cancel_shorten_keyboard()
     )
     await callback.answer()
 
-@router.message(LinkStates.waiting_for_new_title)
+@router.message(LinkStates.waiting_for_new_title, flags={"mutating": True})
 async def set_new_title(message: Message, state: FSMContext):
     await safe_delete(message)
     new_title = message.text.strip()
@@ -616,38 +1316,31 @@ async def set_new_title(message: Message, state: FSMContext):
     link_id = data.get("rename_link_id")
     card_msg_id = data.get("card_msg_id")
     user_id = message.from_user.id
-    if not new_title or len(new_title) > 100:
+    if not new_title or len(new_title) > MAX_TITLE_LENGTH:
         await message.answer(
-            "❌ Ошибка: Название не может быть пустым или длиннее 100 символов.\n\n<b>Что дальше?</b>",
+            f"❌ Ошибка: Название не может быть пустым или длиннее {MAX_TITLE_LENGTH} символов.\n\n<b>Что дальше?</b>",
             reply_markup=get_main_inline_keyboard(),
             parse_mode="HTML"
         )
         await state.clear()
         return
     await message.answer("Обновляю название...")
-    if rename_link(link_id, user_id, new_title):
-        link = get_link_by_id(link_id, user_id)
+    if await rename_link(link_id, user_id, new_title):
+        link = await get_link_by_id(link_id, user_id)
         if link:
             _, _, long_url, short_url, _, vk_key, created_at = link
             created_str = format_date(created_at)
-            stats = await get_link_stats(vk_key, VK_TOKEN)
-            views = stats.get("views", 0)
+            views, fetched_at = await get_link_views(link_id, user_id, vk_key)
             text = (
                 f"✅ Название обновлено!\n"
                 f"📍 {new_title}\n"
                 f"🔗 <a href='{short_url}'>Короткая ссылка</a>\n"
                 f"🌐 <a href='{long_url}'>Исходная ссылка</a>\n"
                 f"📆 {created_str}\n"
-                f"👁 {views} переходов\n\n<b>Что дальше?</b>"
+                f"👁 {views} переходов{stale_note(fetched_at)}\n\n<b>Что дальше?</b>"
             )
             try:
-                await message.bot.edit_message_text(
-                    chat_id=message.chat.id,
-                    message_id=card_msg_id,
-                    text=text,
-                    reply_markup=get_link_card_keyboard(link_id),
-                    parse_mode="HTML"
-                )
+                await edit_text(message.bot, message.chat.id, card_msg_id, text, get_link_card_keyboard(link_id))
             except TelegramBadRequest as e:
                 logger.error(f"Ошибка редактирования сообщения: {e}")
                 await message.answer(
@@ -669,7 +1362,7 @@ async def set_new_title(message: Message, state: FSMContext):
         )
     await state.clear()
 
-@router.callback_query(F.data.startswith("delete:"))
+@router.callback_query(F.data.startswith("delete:"), flags={"mutating": True})
 async def confirm_delete(callback: CallbackQuery):
     await cleanup_old_messages(callback.bot, callback.message.chat.id, callback.message.message_id)
     parts = callback.data.split(":")
@@ -683,7 +1376,7 @@ async def confirm_delete(callback: CallbackQuery):
 
     if action == "yes":
         await callback.message.answer("Удаляю ссылку...")
-        if delete_link(link_id, user_id):
+        if await delete_link(link_id, user_id):
             try:
                 await callback.message.delete()
                 await callback.message.answer(
@@ -699,16 +1392,16 @@ async def confirm_delete(callback: CallbackQuery):
                     parse_mode="HTML"
                 )
         else:
-            await callback.message.edit_text(
+            await edit_message(callback.message, 
                 "❌ Ошибка: Не удалось удалить ссылку.\n\n<b>Что дальше?</b>",
                 reply_markup=get_main_inline_keyboard(),
                 parse_mode="HTML"
             )
     elif action == "no":
-        link = get_link_by_id(link_id, user_id)
+        link = await get_link_by_id(link_id, user_id)
         if not link:
             await callback.answer("❌ Ошибка: Ссылка не найдена", show_alert=True)
-            await callback.message.edit_text(
+            await edit_message(callback.message, 
                 "❌ Ошибка: Ссылка не найдена.\n\n<b>Что дальше?</b>",
                 reply_markup=get_main_inline_keyboard(),
                 parse_mode="HTML"
@@ -716,25 +1409,24 @@ async def confirm_delete(callback: CallbackQuery):
             return
         _, _, long_url, short_url, title, vk_key, created_at = link
         created_str = format_date(created_at)
-        stats = await get_link_stats(vk_key, VK_TOKEN)
-        views = stats.get("views", 0)
+        views, fetched_at = await get_link_views(link_id, user_id, vk_key)
         text = (
             f"📍 {title}\n"
             f"🔗 <a href='{short_url}'>Короткая ссылка</a>\n"
             f"🌐 <a href='{long_url}'>Исходная ссылка</a>\n"
             f"📆 {created_str}\n"
-            f"👁 {views} переходов"
+            f"👁 {views} переходов{stale_note(fetched_at)}"
         )
-        await callback.message.edit_text(
+        await edit_message(callback.message, 
             text,
             reply_markup=get_link_card_keyboard(link_id),
             parse_mode="HTML"
         )
     else:
-        link = get_link_by_id(link_id, user_id)
+        link = await get_link_by_id(link_id, user_id)
         if not link:
             await callback.answer("❌ Ошибка: Ссылка не найдена", show_alert=True)
-            await callback.message.edit_text(
+            await edit_message(callback.message, 
                 "❌ Ошибка: Ссылка не найдена.\n\n<b>Что дальше?</b>",
                 reply_markup=get_main_inline_keyboard(),
                 parse_mode="HTML"
@@ -742,21 +1434,31 @@ async def confirm_delete(callback: CallbackQuery):
             return
         _, _, long_url, short_url, title, vk_key, created_at = link
         created_str = format_date(created_at)
-        stats = await get_link_stats(vk_key, VK_TOKEN)
-        views = stats.get("views", 0)
+        views, fetched_at = await get_link_views(link_id, user_id, vk_key)
         text = (
             f"📍 {title}\n"
             f"🔗 <a href='{short_url}'>Короткая ссылка</a>\n"
             f"🌐 <a href='{long_url}'>Исходная ссылка</a>\n"
             f"📆 {created_str}\n"
-            f"👁 {views} переходов\n\n<b>Подтвердите удаление:</b>"
+            f"👁 {views} переходов{stale_note(fetched_at)}\n\n<b>Подтвердите удаление:</b>"
         )
-        await callback.message.edit_text(
+        await edit_message(callback.message, 
             text,
             reply_markup=get_delete_confirm_keyboard(link_id),
             parse_mode="HTML"
         )
     await callback.answer()
 
+# Регистрируется последним: иначе перехватывает команды и ввод в состояниях FSM
+@router.message(F.text)
+async def handle_unknown_message(message: Message):
+    logger.debug(f"Необработанное сообщение от user_id={message.from_user.id}: {message.text}")
+    await safe_delete(message)
+    await message.answer(
+        "❌ Неизвестная команда или сообщение. Используйте /start, /help или кнопки ниже.\n\n<b>Что дальше?</b>",
+        reply_markup=get_main_inline_keyboard(),
+        parse_mode="HTML"
+    )
+
 def setup_handlers(dp):
     dp.include_router(router)
@@ -0,0 +1,111 @@
+"""
+Разбор списка ссылок от пользователя (сообщение или файл импорта).
+
+Строки вида «ссылка» или «ссылка | описание» проверяются за один проход заранее
+скомпилированным URL_PATTERN; каждая ссылка приводится к каноническому виду по
+группам того же совпадения (canonicalize_match, без повторного urlsplit), и
+повторы внутри списка отсеиваются по нему. Затем один запрос с IN (…) по всему
+списку отсеивает ссылки, которые у пользователя уже есть.
+Результат — принятые и отклонённые строки с номером строки и причиной; тексты
+ошибок совпадают с теми, что бот показывал раньше.
+"""
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from config import MAX_TITLE_LENGTH
+from database import get_existing_original_urls
+from utils import URL_PATTERN, canonicalize_match
+
+INVALID = "invalid"
+TITLE_TOO_LONG = "title_too_long"
+DUPLICATE = "duplicate"        # повтор внутри списка
+EXISTS = "exists"              # уже сохранена у пользователя
+
+
+class Accepted(NamedTuple):
+    line: int
+    url: str
+    canonical: str
+    title: Optional[str]       # None — описания не было, "" — пустое после «|»
+
+
+class Rejected(NamedTuple):
+    line: int
+    url: str
+    reason: str
+    error: str
+
+
+class IngestResult(NamedTuple):
+    accepted: List[Accepted]
+    rejected: List[Rejected]
+
+    @property
+    def pairs(self) -> List[Tuple[str, Optional[str]]]:
+        return [(item.url, item.title) for item in self.accepted]
+
+    @property
+    def errors(self) -> List[str]:
+        return [item.error for item in self.rejected]
+
+
+def parse_batch(lines: Iterable[str], max_title: int = MAX_TITLE_LENGTH) -> IngestResult:
+    """Проверка, канонизация и отсев повторов внутри списка — без обращений к базе."""
+    accepted, rejected = [], []
+    accept, reject = accepted.append, rejected.append
+    seen = set()
+    seen_raw = set()  # точные повторы строки отсеиваются до проверки и канонизации
+    match = URL_PATTERN.match
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        url, separator, title = line.partition("|")
+        if separator:
+            url, title = url.strip(), title.strip()
+            if len(title) > max_title:
+                reject(Rejected(number, url, TITLE_TOO_LONG,
+                                f"❌ Ошибка: Название для {url} слишком длинное "
+                                f"(максимум {max_title} символов)."))
+                continue
+        else:
+            title = None
+        if url in seen_raw:
+            reject(Rejected(number, url, DUPLICATE, f"❌ Ошибка: {url} уже есть выше в списке."))
+            continue
+        parsed = match(url)
+        if parsed is None:
+            reject(Rejected(number, url, INVALID, f"❌ Ошибка: {url} — невалидная ссылка."))
+            continue
+        canonical = canonicalize_match(parsed)
+        if canonical in seen:
+            reject(Rejected(number, url, DUPLICATE, f"❌ Ошибка: {url} уже есть выше в списке."))
+            continue
+        seen.add(canonical)
+        seen_raw.add(url)
+        accept(Accepted(number, url, canonical, title))
+    return IngestResult(accepted, rejected)
+
+
+async def exclude_existing(user_id: int, result: IngestResult) -> IngestResult:
+    """
+    Отклоняет ссылки, уже сохранённые у пользователя. В базе хранится адрес в том
+    виде, в каком его прислали, поэтому сравниваются и исходный, и канонический вид.
+    """
+    if not result.accepted:
+        return result
+    candidates = {item.url for item in result.accepted} | {item.canonical for item in result.accepted}
+    existing = await get_existing_original_urls(user_id, list(candidates))
+    if not existing:
+        return result
+    accepted, rejected = [], list(result.rejected)
+    for item in result.accepted:
+        if item.url in existing or item.canonical in existing:
+            rejected.append(Rejected(item.line, item.url, EXISTS, f"❌ Ошибка: Ссылка '{item.url}' уже существует."))
+        else:
+            accepted.append(item)
+    rejected.sort(key=lambda item: item.line)
+    return IngestResult(accepted, rejected)
+
+
+async def ingest(user_id: int, lines: Iterable[str], max_title: int = MAX_TITLE_LENGTH) -> IngestResult:
+    return await exclude_existing(user_id, parse_batch(lines, max_title))
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import os
+import socket
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from config import (
+    JOB_WORKERS,
+    JOB_MAX_PER_USER,
+    JOB_MAX_ATTEMPTS,
+    JOB_POLL_SECONDS,
+    JOB_HEARTBEAT_SECONDS,
+    JOB_STALE_SECONDS,
+    JOB_BACKGROUND_WORKERS,
+)
+from sent_messages import registry
+from tracing import trace
+from ratelimit import priority, BULK
+from database import (
+    create_job,
+    claim_job,
+    heartbeat_job,
+    finish_job,
+    requeue_stale_jobs,
+    release_jobs,
+    get_job_items,
+    complete_job_item,
+)
+
+logger = logging.getLogger(__name__)
+
+ItemHandler = Callable[[Any, Dict[str, Any], Dict[str, Any]], Awaitable[dict]]
+FinalizeHandler = Callable[[Any, Dict[str, Any], List[Dict[str, Any]]], Awaitable[None]]
+
+_kinds: Dict[str, "JobKind"] = {}
+_queue: Optional["JobQueue"] = None
+
+
+class JobKind:
+    """
+    Описание типа задачи: process_item вызывается для каждого ещё не выполненного
+    элемента (результат сохраняется в job_items), finalize — один раз в конце.
+    process_item должен быть идемпотентным: после перезапуска элемент может
+    выполниться повторно, если процесс упал до записи результата. Фоновые
+    (background) задачи берутся после остальных и занимают не всех воркеров.
+    """
+    def __init__(self, name: str, process_item: Optional[ItemHandler] = None,
+                 finalize: Optional[FinalizeHandler] = None, background: bool = False):
+        self.name = name
+        self.process_item = process_item
+        self.finalize = finalize
+        self.background = background
+
+
+def register_job_kind(name: str, process_item: Optional[ItemHandler] = None,
+                      finalize: Optional[FinalizeHandler] = None, background: bool = False) -> JobKind:
+    kind = JobKind(name, process_item, finalize, background)
+    _kinds[name] = kind
+    return kind
+
+
+async def enqueue_job(user_id: int, chat_id: int, kind: str, payload: Optional[dict] = None,
+                      items: Optional[list] = None, message_id: Optional[int] = None) -> Optional[int]:
+    job_id = await create_job(user_id, chat_id, kind, payload, items, message_id)
+    if job_id is not None:
+        logger.info(f"Задача {kind} #{job_id} поставлена в очередь: user_id={user_id}, элементов={len(items or [])}")
+        if _queue:
+            _queue.wake()
+    return job_id
+
+
+class JobQueue:
+    """Пул воркеров внутри процесса бота, разбирающий таблицу jobs."""
+    def __init__(self, bot, workers: int = JOB_WORKERS, max_per_user: int = JOB_MAX_PER_USER,
+                 background_workers: int = JOB_BACKGROUND_WORKERS):
+        self.bot = bot
+        self.workers = workers
+        self.max_per_user = max_per_user
+        # Фоновые задачи не занимают всех воркеров (кроме пула из одного воркера)
+        self.background_workers = max(1, min(background_workers, workers - 1))
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+    def wake(self):
+        self._wake.set()
+
+    async def start(self):
+        global _queue
+        _queue = self
+        await requeue_stale_jobs(JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Очередь задач запущена: воркеров={self.workers}, id={self.worker_id}")
+
+    async def stop(self):
+        global _queue
+        # В 3.11 wait_for может проглотить отмену, если событие сработало одновременно с ней —
+        # флаг гарантирует, что такой воркер выйдет на следующей итерации
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        released = await release_jobs(self.worker_id)
+        if _queue is self:
+            _queue = None
+        logger.info(f"Очередь задач остановлена, возвращено в очередь: {released}")
+
+    async def _worker(self):
+        # Запросы воркеров к VK и базе уступают очередь нажатиям пользователей
+        priority.set(BULK)
+        while not self._stopping:
+            background = tuple(name for name, kind in _kinds.items() if kind.background)
+            job = await claim_job(self.worker_id, self.max_per_user, JOB_MAX_ATTEMPTS,
+                                  background, self.background_workers)
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    await requeue_stale_jobs(JOB_STALE_SECONDS, JOB_MAX_ATTEMPTS)
+                continue
+            await self._run(job)
+            # Освободился слот пользователя — другие воркеры могут взять его следующую задачу
+            self.wake()
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            await heartbeat_job(job_id, self.worker_id)
+
+    async def _run(self, job: Dict[str, Any]):
+        with trace(f"job.{job['kind']}", job_id=job["id"], user_id=job["user_id"]):
+            await self._execute(job)
+
+    async def _execute(self, job: Dict[str, Any]):
+        kind = _kinds.get(job["kind"])
+        if kind is None:
+            logger.error(f"Неизвестный тип задачи {job['kind']} #{job['id']}")
+            await finish_job(job["id"], "failed", "Неизвестный тип задачи")
+            return
+        heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+        try:
+            items = await get_job_items(job["id"])
+            for item in items:
+                if item["status"] == "done" or kind.process_item is None:
+                    continue
+                try:
+                    result = await kind.process_item(self.bot, job, item)
+                except Exception as e:
+                    logger.error(f"Ошибка элемента {item['idx']} задачи #{job['id']}: {e}")
+                    result = {"ok": False, "error": str(e)}
+                await complete_job_item(job["id"], item["idx"], result)
+                item["status"], item["result"] = "done", result
+            if kind.finalize:
+                await kind.finalize(self.bot, job, items)
+            if job["message_id"]:
+                # Итог задачи выведен в сообщение прогресса — очистка меню его не удаляет
+                registry.mark(job["chat_id"], job["message_id"], "result")
+            await finish_job(job["id"], "done")
+            logger.info(f"Задача {job['kind']} #{job['id']} выполнена")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Ошибка выполнения задачи {job['kind']} #{job['id']}: {e}")
+            await finish_job(job["id"], "failed", str(e))
+        finally:
+            heartbeat.cancel()
@@ -1,39 +1,79 @@
+from functools import lru_cache
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
-# Главное меню
-def get_main_inline_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📂 Мои ссылки", callback_data="show_links")],
-        [InlineKeyboardButton(text="➖ Сократить ссылку", callback_data="shorten_link")]
-    ])
+
+def _freeze(rows) -> InlineKeyboardMarkup:
+    """
+    Клавиатура-шаблон: строки хранятся кортежами, поэтому один экземпляр можно
+    отдавать во все сообщения — случайный append в обработчике упадёт, а не
+    испортит клавиатуру для всех.
+    """
+    return InlineKeyboardMarkup.model_construct(inline_keyboard=tuple(tuple(row) for row in rows))
+
+
+MAIN_KEYBOARD = _freeze([
+    [InlineKeyboardButton(text="📂 Мои ссылки", callback_data="show_links")],
+    [InlineKeyboardButton(text="➖ Сократить ссылку", callback_data="shorten_link")]
+])
+
+STATS_KEYBOARD = _freeze([
+    [InlineKeyboardButton(text="◀️ Назад", callback_data="back_from_stats")]
+])
+
+CANCEL_SHORTEN_KEYBOARD = _freeze([
+    [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_shorten")]
+])
+
+RENAME_KEYBOARD = _freeze([
+    [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_rename")]
+])
+
+# Главное меню; extra_rows добавляются в новую клавиатуру, шаблон не меняется
+def get_main_inline_keyboard(*extra_rows) -> InlineKeyboardMarkup:
+    if not extra_rows:
+        return MAIN_KEYBOARD
+    return _freeze([*MAIN_KEYBOARD.inline_keyboard, *extra_rows])
 
 # Кнопки действий над ссылкой
+@lru_cache(maxsize=1024)
 def get_link_card_keyboard(link_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📊 Статистика", callback_data=f"stats:{link_id}")],
+    return _freeze([
+        [InlineKeyboardButton(text="📊 Статистика", callback_data=f"stats:{link_id}"),
+         InlineKeyboardButton(text="🔳 QR", callback_data=f"qr:{link_id}")],
         [InlineKeyboardButton(text="✏️ Переименовать", callback_data=f"rename:{link_id}")],
         [InlineKeyboardButton(text="❌ Удалить", callback_data=f"delete:{link_id}")],
         [InlineKeyboardButton(text="◀️ Назад", callback_data="back_to_links")]
     ])
 
+# Ссылка в архиве: статистика и возврат в список
+@lru_cache(maxsize=1024)
+def get_archived_card_keyboard(link_id: int) -> InlineKeyboardMarkup:
+    return _freeze([
+        [InlineKeyboardButton(text="📊 Статистика", callback_data=f"stats:{link_id}")],
+        [InlineKeyboardButton(text="♻️ Вернуть в список", callback_data=f"restore:{link_id}")],
+        [InlineKeyboardButton(text="◀️ Назад", callback_data="archive:1")]
+    ])
+
 # Кнопка "Назад" из статистики
 def get_stats_keyboard() -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="◀️ Назад", callback_data="back_from_stats")]
-    ])
+    return STATS_KEYBOARD
 
 # Подтверждение удаления
+@lru_cache(maxsize=1024)
 def get_delete_confirm_keyboard(link_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Да, удалить", callback_data=f"delete_yes_{link_id}")],
-        [InlineKeyboardButton(text="❌ Нет", callback_data=f"delete_no_{link_id}")]
+    return _freeze([
+        [InlineKeyboardButton(text="✅ Да, удалить", callback_data=f"delete:yes:{link_id}")],
+        [InlineKeyboardButton(text="❌ Нет", callback_data=f"delete:no:{link_id}")]
     ])
 
 # Отмена переименования
 def get_rename_keyboard(link_id: int) -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_rename")]
-    ])
+    return RENAME_KEYBOARD
+
+# Отмена сокращения
+def get_cancel_shorten_keyboard() -> InlineKeyboardMarkup:
+    return CANCEL_SHORTEN_KEYBOARD
 
 # Пагинация (листалка по страницам ссылок)
 def get_pagination_keyboard(page: int, total_pages: int) -> InlineKeyboardMarkup:
@@ -48,4 +88,3 @@ def get_pagination_keyboard(page: int, total_pages: int) -> InlineKeyboardMarkup
         buttons.append(InlineKeyboardButton(text="▶️ Далее", callback_data=f"page_{page + 1}"))
 
     return InlineKeyboardMarkup(inline_keyboard=[buttons])
-
@@ -1,37 +1,105 @@
 import asyncio
 import logging
-import gettext
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from aiogram.fsm.strategy import FSMStrategy
 
-from config import BOT_TOKEN
-from routers.handlers import router as handlers_router
-from database import init_db
+from config import BOT_TOKEN, TELEGRAM_API_URL, PROFILING_ENABLED, TRACING_ENABLED
+from handlers import router as handlers_router
+from database import init_db, start_write_buffer, stop_write_buffer
 from session import create_session, close_session
-from middleware.throttle import ThrottlingMiddleware
+from jobs import JobQueue
+from digest import DigestScheduler
+from outbox import Outbox
+from sent_messages import MessageRegistryMiddleware, MessageSweeper
+from fsm_storage import MeteredMemoryStorage
+from dedup import DedupMiddleware
+import tasks  # noqa: F401 — регистрирует типы фоновых задач
 
-logging.basicConfig(level=logging.INFO)
+if TRACING_ENABLED:
+    from tracing import install_log_record_factory
+    install_log_record_factory()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:%(trace_id)s:%(message)s", force=True)
+else:
+    logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# i18n setup
-gettext.install('bot', localedir='locale')
+
+def setup_i18n():
+    # gettext грузится только здесь, параллельно с сетевой частью старта
+    import gettext
+    gettext.install('bot', localedir='locale')
+
+
+def create_bot() -> Bot:
+    session = None
+    if TELEGRAM_API_URL:
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2))
+    bot.session.middleware(MessageRegistryMiddleware())
+    if TRACING_ENABLED:
+        from tracing import BotRequestMiddleware
+        bot.session.middleware(BotRequestMiddleware())
+    return bot
+
 
 async def main():
-    await create_session()
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN_V2))
-    await bot.delete_webhook(drop_pending_updates=True)
-    dp = Dispatcher(fsm_strategy=FSMStrategy.USER_IN_CHAT)
-    await init_db()
+    bot = create_bot()
+    dp = Dispatcher(storage=MeteredMemoryStorage(), fsm_strategy=FSMStrategy.USER_IN_CHAT)
+    dp.update.outer_middleware(DedupMiddleware())
+    if TRACING_ENABLED:
+        from tracing import TracingMiddleware
+        dp.update.outer_middleware(TracingMiddleware())
+    # Шаги старта не зависят друг от друга: база, HTTP-сессия для VK и сброс вебхука идут одновременно
+    await asyncio.gather(
+        init_db(),
+        create_session(),
+        bot.delete_webhook(drop_pending_updates=True),
+        asyncio.to_thread(setup_i18n),
+    )
+    await start_write_buffer()
+    if PROFILING_ENABLED:
+        from profiling import ProfilingMiddleware
+        profiling = ProfilingMiddleware()
+        for observer in (handlers_router.message, handlers_router.callback_query, handlers_router.inline_query):
+            observer.middleware(profiling)
+        logger.info("Профилирование апдейтов включено.")
     dp.include_router(handlers_router)
-    dp.message.middleware(ThrottlingMiddleware())
+    job_queue = JobQueue(bot)
+    await job_queue.start()
+    outbox = Outbox(bot)
+    await outbox.start()
+    digest_scheduler = DigestScheduler()
+    await digest_scheduler.start()
+    sweeper = MessageSweeper(bot)
+    await sweeper.start()
+    # Фоновые подсистемы импортируются здесь, после запуска основных: их модули
+    # (пул процессов QR, сжатие копий) не нужны, пока бот не дошёл до старта
+    from archive import Archiver
+    from backup import BackupScheduler
+    from qr import qr_cache
+    archiver = Archiver()
+    await archiver.start()
+    backups = BackupScheduler()
+    await backups.start()
+    qr_cache.start()
     logger.info("Бот запущен!")
     try:
         await dp.start_polling(bot)
     except Exception as e:
         logger.error(f"Ошибка при запуске: {e}")
     finally:
+        qr_cache.stop()
+        await backups.stop()
+        await archiver.stop()
+        await sweeper.stop()
+        await digest_scheduler.stop()
+        await outbox.stop()
+        await job_queue.stop()
+        await stop_write_buffer()
         await close_session()
         logger.info("HTTP-сессия закрыта. Бот завершил работу.")
 
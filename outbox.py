@@ -0,0 +1,98 @@
+"""
+Очередь исходящих сообщений для рассылок (таблица outbox).
+
+Сообщения отправляются по порядку не чаще OUTBOX_MESSAGES_PER_SECOND, что ниже
+общего лимита Telegram; на 429 отправитель ждёт retry_after и повторяет то же
+сообщение. Заблокировавшим бота пользователям дайджест отключается.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError
+
+from config import OUTBOX_MESSAGES_PER_SECOND, OUTBOX_MAX_ATTEMPTS
+from database import enqueue_outbox, get_outbox_batch, finish_outbox, set_digest
+from keyboards import get_main_inline_keyboard
+from ratelimit import TokenBucket
+from sent_messages import registry
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_POLL_SECONDS = 5.0
+
+_outbox: Optional["Outbox"] = None
+
+
+async def send_later(chat_id: int, user_id: int, kind: str, text: str) -> Optional[int]:
+    """Кладёт сообщение в очередь отправки и будит отправителя."""
+    message_id = await enqueue_outbox(chat_id, user_id, kind, text)
+    if message_id is not None and _outbox:
+        _outbox.wake()
+    return message_id
+
+
+class Outbox:
+    def __init__(self, bot, rate: float = OUTBOX_MESSAGES_PER_SECOND):
+        self.bot = bot
+        self.limiter = TokenBucket(rate)
+        self.sent = 0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def wake(self):
+        self._wake.set()
+
+    async def start(self):
+        global _outbox
+        _outbox = self
+        self._task = asyncio.create_task(self._loop())
+        logger.info(f"Очередь отправки запущена: до {self.limiter.rate:g} сообщений/с")
+
+    async def stop(self):
+        global _outbox
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if _outbox is self:
+            _outbox = None
+
+    async def _loop(self):
+        while True:
+            batch = await get_outbox_batch(100)
+            if not batch:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), OUTBOX_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            for row in batch:
+                await self._send(*row)
+
+    async def _send(self, message_id: int, chat_id: int, user_id: int, kind: str, text: str, attempts: int):
+        while True:
+            await self.limiter.acquire()
+            try:
+                sent = await self.bot.send_message(
+                    chat_id, text, parse_mode="HTML", reply_markup=get_main_inline_keyboard()
+                )
+                # Рассылку не удаляем вместе с устаревшими меню
+                registry.register(sent.chat.id, sent.message_id, kind)
+                await finish_outbox(message_id, "sent")
+                self.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                logger.warning(f"Telegram просит подождать {e.retry_after} с перед отправкой")
+                await asyncio.sleep(e.retry_after)
+            except TelegramForbiddenError:
+                await finish_outbox(message_id, "failed", "Бот заблокирован пользователем")
+                if kind == "digest":
+                    await set_digest(user_id, None, None, None)
+                return
+            except Exception as e:
+                logger.error(f"Ошибка отправки сообщения #{message_id}: {e}")
+                status = "failed" if attempts + 1 >= OUTBOX_MAX_ATTEMPTS else "pending"
+                await finish_outbox(message_id, status, str(e))
+                return
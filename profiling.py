@@ -0,0 +1,188 @@
+"""
+Профилирование обработки апдейтов (включается PROFILING=1).
+
+Два источника:
+- доля апдейтов (PROFILE_SAMPLE_RATE) целиком выполняется под cProfile и
+  сохраняется как .pstats. cProfile видит весь поток, поэтому в профиль могут
+  попасть и другие апдейты, выполнявшиеся в это время;
+- для всех апдейтов таймер в event loop раз в PROFILE_SAMPLE_INTERVAL секунд
+  снимает цепочку await обработчика. Это почти ничего не стоит и показывает,
+  где обработчик ждёт (SQLite, VK, Bot API). Если апдейт обрабатывался дольше
+  PROFILE_SLOW_SECONDS, стеки пишутся в .collapsed (формат flamegraph.pl).
+
+Имена файлов: <время>-<мс>ms+<обработчик>+<префикс callback_data или команды>.
+
+Сводка для flame graph:
+    python profiling.py report [каталог] [--out profile.folded]
+"""
+import asyncio
+import cProfile
+import glob
+import logging
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from config import PROFILE_DIR, PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS, PROFILE_SAMPLE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def event_tag(event) -> str:
+    """Префикс callback_data, команда или тип события — для имени файла профиля."""
+    data = getattr(event, "data", None)
+    if isinstance(data, str):
+        return data.split(":", 1)[0] or "callback"
+    text = getattr(event, "text", None)
+    if text and text.startswith("/"):
+        return text.split(maxsplit=1)[0][1:].split("@", 1)[0] or "command"
+    return type(event).__name__.lower()
+
+
+def _frame_name(frame) -> str:
+    module = frame.f_globals.get("__name__", "?")
+    return f"{module}:{frame.f_code.co_name}"
+
+
+def await_stack(task: asyncio.Task, root_code=None) -> Optional[str]:
+    """Цепочка await приостановленной задачи в формате "a;b;c" (от корня к листу)."""
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        if root_code is not None and frame.f_code is root_code:
+            frames.clear()
+        else:
+            frames.append(_frame_name(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return ";".join(frames) if frames else None
+
+
+class AwaitSampler:
+    """Периодически снимает стеки отслеживаемых задач, пока хотя бы одна активна."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.tracked: Dict[asyncio.Task, Counter] = {}
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    def track(self, task: asyncio.Task) -> Counter:
+        samples = self.tracked[task] = Counter()
+        if self._handle is None:
+            self._handle = asyncio.get_running_loop().call_later(self.interval, self._tick)
+        return samples
+
+    def untrack(self, task: asyncio.Task) -> None:
+        self.tracked.pop(task, None)
+        if not self.tracked and self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self) -> None:
+        for task, samples in self.tracked.items():
+            stack = await_stack(task, ProfilingMiddleware.__call__.__code__)
+            if stack:
+                samples[stack] += 1
+        self._handle = asyncio.get_running_loop().call_later(self.interval, self._tick)
+
+
+def _safe_name(value: str) -> str:
+    return re.sub(r"[^\w.-]+", "_", value)[:40]
+
+
+class ProfilingMiddleware:
+    """Профилирует обработчики: выборочно cProfile, медленные апдейты — всегда по стекам await."""
+    def __init__(self, sample_rate: float = PROFILE_SAMPLE_RATE, slow_seconds: float = PROFILE_SLOW_SECONDS,
+                 interval: float = PROFILE_SAMPLE_INTERVAL, directory: str = PROFILE_DIR):
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.directory = directory
+        self.sampler = AwaitSampler(interval)
+        self._profiling = False  # cProfile может быть активен только один
+        os.makedirs(directory, exist_ok=True)
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        handler_name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        task = asyncio.current_task()
+        samples = self.sampler.track(task)
+        profiler = None
+        if not self._profiling and random.random() < self.sample_rate:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+            self.sampler.untrack(task)
+            try:
+                self._save(handler_name, event_tag(event), elapsed, profiler, samples)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении профиля: {e}")
+
+    def _save(self, handler_name: str, tag: str, elapsed: float, profiler, samples: Counter) -> None:
+        slow = elapsed >= self.slow_seconds
+        if profiler is None and not slow:
+            return
+        base = os.path.join(
+            self.directory,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms+{_safe_name(handler_name)}+{_safe_name(tag)}",
+        )
+        if profiler is not None:
+            profiler.dump_stats(base + ".pstats")
+        if slow and samples:
+            with open(base + ".collapsed", "w", encoding="utf-8") as f:
+                for stack, count in samples.items():
+                    f.write(f"{stack} {count}\n")
+        if slow:
+            logger.warning(f"Медленный апдейт: {handler_name} [{tag}] {elapsed:.2f} с, профиль {base}")
+
+
+def build_report(directory: str, out: str) -> None:
+    """Склеивает .collapsed в один файл для flamegraph.pl/speedscope, .pstats — в один pstats."""
+    import pstats
+
+    folded = Counter()
+    for path in glob.glob(os.path.join(directory, "*.collapsed")):
+        # <время>-<мс>ms+<обработчик>+<тег>.collapsed → корень стека "обработчик[тег]"
+        _, handler_name, tag = os.path.basename(path)[:-len(".collapsed")].split("+", 2)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack:
+                    folded[f"{handler_name}[{tag}];{stack}"] += int(count)
+    with open(out, "w", encoding="utf-8") as f:
+        for stack, count in folded.most_common():
+            f.write(f"{stack} {count}\n")
+    print(f"{out}: {len(folded)} стеков")
+
+    stats_files = glob.glob(os.path.join(directory, "*.pstats"))
+    if stats_files:
+        merged = pstats.Stats(*stats_files)
+        merged.dump_stats(out + ".pstats")
+        merged.sort_stats("cumulative").print_stats(20)
+        print(f"{out}.pstats: {len(stats_files)} профилей cProfile")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] != ["report"]:
+        print(__doc__)
+        sys.exit(1)
+    args = sys.argv[2:]
+    out = "profile.folded"
+    if "--out" in args:
+        index = args.index("--out")
+        out = args[index + 1]
+        del args[index:index + 2]
+    build_report(args[0] if args else PROFILE_DIR, out)
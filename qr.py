@@ -0,0 +1,149 @@
+"""
+QR-коды коротких ссылок.
+
+Картинка рисуется (segno, PNG) в пуле процессов QR_WORKERS, поэтому цикл событий
+не занят ни на миллисекунду кодирования; одновременные запросы одного адреса ждут
+одну отрисовку. Готовые PNG лежат в QR_CACHE_DIR под хэшем short_url; когда
+суммарный размер превышает QR_CACHE_MAX_BYTES, удаляются давно не читанные
+(LRU: при чтении файлу обновляется mtime). После первой отправки Telegram возвращает file_id —
+он хранится в базе (qr_files), и повторная отправка того же кода не рисует и не
+загружает картинку заново.
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from config import QR_CACHE_DIR, QR_CACHE_MAX_BYTES, QR_SCALE, QR_WORKERS
+
+logger = logging.getLogger(__name__)
+
+qr_stats = {"file_id": 0, "disk": 0, "rendered": 0, "evicted": 0}
+
+
+def render_png(data: str, path: str, scale: int = QR_SCALE) -> bytes:
+    """Выполняется в процессе пула: рисует QR-код, атомарно кладёт PNG на диск и возвращает его."""
+    import io
+
+    import segno
+
+    buffer = io.BytesIO()
+    segno.make(data, error="m", micro=False).save(buffer, kind="png", scale=scale, border=4)
+    png = buffer.getvalue()
+    with open(path + ".part", "wb") as f:
+        f.write(png)
+    os.replace(path + ".part", path)
+    return png
+
+
+def _warm() -> None:
+    import segno  # noqa: F401
+
+
+def _read(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            png = f.read()
+        os.utime(path)
+        return png
+    except FileNotFoundError:
+        return None
+
+
+class QRCache:
+    """Дисковый кэш PNG с вытеснением по суммарному размеру и пул отрисовки."""
+    def __init__(self, directory: str = QR_CACHE_DIR, max_bytes: int = QR_CACHE_MAX_BYTES,
+                 workers: int = QR_WORKERS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._total = 0
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".png") and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        self._sizes.clear()
+        for _, path, size in sorted(entries):
+            self._sizes[path] = size
+        self._total = sum(self._sizes.values())
+        self._evict()
+        if self._executor is None:
+            # К этому моменту в процессе уже есть потоки (aiosqlite, to_thread), и fork
+            # мог бы унаследовать чужую захваченную блокировку — воркеры запускаются
+            # через forkserver (spawn там, где его нет)
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+            # Процессы пула создаются и импортируют segno при старте, а не на первом нажатии
+            for _ in range(self.workers):
+                self._executor.submit(_warm)
+        logger.info(f"QR-коды: {len(self._sizes)} в кэше ({self._total // 1024} КБ), воркеров {self.workers}.")
+
+    def stop(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def path(self, short_url: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(short_url.encode()).hexdigest() + ".png")
+
+    async def get_png(self, short_url: str) -> bytes:
+        """PNG с диска или из пула; одновременные запросы одного адреса ждут одну отрисовку."""
+        if self._executor is None:
+            self.start()
+        path = self.path(short_url)
+        if path in self._sizes:
+            png = await asyncio.to_thread(_read, path)
+            if png is not None:
+                self._sizes.move_to_end(path)
+                qr_stats["disk"] += 1
+                return png
+            self._forget(path)
+        pending = self._pending.get(path)
+        if pending is None:
+            pending = asyncio.get_running_loop().run_in_executor(self._executor, render_png, short_url, path)
+            self._pending[path] = pending
+            pending.add_done_callback(lambda future: self._rendered(path, future))
+        # shield: отменённый запрос одного пользователя не отменяет отрисовку для остальных
+        return await asyncio.shield(pending)
+
+    def _rendered(self, path: str, future: asyncio.Future) -> None:
+        del self._pending[path]
+        if not future.cancelled() and future.exception() is None:
+            qr_stats["rendered"] += 1
+            self._add(path, len(future.result()))
+
+    def _add(self, path: str, size: int) -> None:
+        self._forget(path)
+        self._sizes[path] = size
+        self._total += size
+        self._evict()
+
+    def _forget(self, path: str) -> None:
+        self._total -= self._sizes.pop(path, 0)
+
+    def _evict(self) -> None:
+        while self._total > self.max_bytes and len(self._sizes) > 1:
+            path, size = self._sizes.popitem(last=False)
+            self._total -= size
+            qr_stats["evicted"] += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        return {"files": len(self._sizes), "bytes": self._total, "max_bytes": self.max_bytes}
+
+
+qr_cache = QRCache()
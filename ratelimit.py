@@ -0,0 +1,217 @@
+import asyncio
+import functools
+import inspect
+import math
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# Приоритет текущей работы: обработчики апдейтов — INTERACTIVE, воркеры очереди задач — BULK
+INTERACTIVE, BULK = 0, 1
+priority: ContextVar[int] = ContextVar("priority", default=INTERACTIVE)
+
+
+class TokenBucket:
+    """Ограничитель частоты: в среднем rate операций в секунду, всплеск до burst."""
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1.0) -> None:
+        # Под замком ожидающие обслуживаются по очереди и не обгоняют друг друга
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+class PriorityLimiter:
+    """
+    Предел одновременных операций с двумя очередями ожидания.
+
+    Интерактивные операции получают освободившийся слот раньше фоновых, а
+    фоновым достаётся не больше limit - reserve слотов: часть ёмкости всегда
+    свободна для нажатий пользователей. Приоритет берётся из contextvar
+    priority. С prioritize=False обе очереди — одна общая FIFO (для сравнения).
+    """
+    def __init__(self, limit: float, reserve: float = 0.25):
+        self.limit = float(limit)
+        self.reserve = reserve
+        self.prioritize = True
+        self.in_flight = 0
+        self.requests = 0
+        self._waiters: Tuple[Deque[asyncio.Future], Deque[asyncio.Future]] = (deque(), deque())
+        self._held: ContextVar[bool] = ContextVar(f"held_{id(self)}", default=False)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters[INTERACTIVE]) + len(self._waiters[BULK])
+
+    def capacity(self, level: int) -> int:
+        limit = int(self.limit)
+        if level == BULK and self.prioritize and limit > 1:
+            return max(1, limit - max(1, int(limit * self.reserve)))
+        return limit
+
+    async def acquire(self) -> float:
+        """Ждёт свободный слот; возвращает момент начала операции для release."""
+        level = priority.get() if self.prioritize else BULK
+        ahead = self._waiters[INTERACTIVE] if level == INTERACTIVE else self.queued
+        if ahead or self.in_flight >= self.capacity(level):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[level].append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Слот уже выдан — возвращаем его следующему
+                    self.in_flight -= 1
+                    self._wake()
+                elif waiter in self._waiters[level]:
+                    self._waiters[level].remove(waiter)
+                raise
+        else:
+            self.in_flight += 1
+        self.requests += 1
+        return time.monotonic()
+
+    def release(self, started: float, outcome: str = "ok") -> None:
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        for level in (INTERACTIVE, BULK):
+            waiters = self._waiters[level]
+            while waiters and self.in_flight < self.capacity(level):
+                waiter = waiters.popleft()
+                if not waiter.done():
+                    self.in_flight += 1
+                    waiter.set_result(None)
+
+    def gate(self, func):
+        """Декоратор корутины: выполняется в слоте; вложенные вызовы в том же контексте слот не берут."""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if self._held.get():
+                return await func(*args, **kwargs)
+            started = await self.acquire()
+            token = self._held.set(True)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self._held.reset(token)
+                self.release(started)
+        return wrapper
+
+
+def gate_module(namespace: Dict[str, Any], limiter: PriorityLimiter, exclude=()) -> None:
+    """Пропускает все публичные корутины модуля через limiter."""
+    module = namespace["__name__"]
+    for attr, value in list(namespace.items()):
+        if attr.startswith("_") or attr in exclude:
+            continue
+        if not inspect.iscoroutinefunction(value) or value.__module__ != module:
+            continue
+        namespace[attr] = limiter.gate(value)
+
+
+class AdaptiveLimiter(PriorityLimiter):
+    """
+    Адаптивный предел одновременных запросов (AIMD).
+
+    Пока задержка ответов держится у базовой (минимальной за окно), предел
+    растёт примерно на 1 за каждый «круг» запросов. Ошибка перегрузки (флуд,
+    таймаут) режет его в backoff раз и приостанавливает фоновые запросы на
+    cooldown секунд (интерактивные идут дальше в уменьшенном пределе); рост
+    задержки выше базовой в tolerance раз — на 10%.
+    Ответы на запросы, начатые до последнего снижения, предел повторно не
+    снижают: одна волна ошибок — одно снижение. Очереди — как у PriorityLimiter.
+    """
+    WINDOW = 200  # ответов, после которых базовая задержка пересчитывается заново
+
+    def __init__(self, initial: float, min_limit: float = 1, max_limit: float = 64,
+                 backoff: float = 0.5, tolerance: float = 1.5, cooldown: float = 1.0):
+        super().__init__(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.cooldown = cooldown
+        self.baseline: Optional[float] = None
+        self.recent: Optional[float] = None
+        self.drops = 0
+        self._window_min = math.inf
+        self._window_count = 0
+        self._last_decrease = 0.0
+        self._resume_at = 0.0
+
+    async def acquire(self) -> float:
+        await super().acquire()
+        level = priority.get() if self.prioritize else BULK
+        delay = self._resume_at - time.monotonic()
+        if level == BULK and delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self.in_flight -= 1
+                self._wake()
+                raise
+        return time.monotonic()
+
+    def release(self, started: float, outcome: str = "ok") -> None:
+        """outcome: "ok" — успешный ответ, "drop" — перегрузка, иное — ответ без сигнала о нагрузке."""
+        busy = self.in_flight
+        self.in_flight -= 1
+        now = time.monotonic()
+        if outcome == "drop":
+            if started >= self._last_decrease:
+                self._decrease(self.backoff, now)
+                self._resume_at = now + self.cooldown
+                self.drops += 1
+        elif outcome == "ok":
+            latency = now - started
+            self._observe(latency)
+            if self.recent > self.baseline * self.tolerance:
+                if started >= self._last_decrease:
+                    self._decrease(0.9, now)
+            elif busy >= self.limit / 2:
+                # Растём, только если предел действительно используется
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "queued_bulk": len(self._waiters[BULK]),
+            "requests": self.requests,
+            "drops": self.drops,
+            "baseline_ms": (self.baseline or 0) * 1000,
+            "recent_ms": (self.recent or 0) * 1000,
+        }
+
+    def _decrease(self, factor: float, now: float) -> None:
+        self.limit = max(self.min_limit, self.limit * factor)
+        self._last_decrease = now
+
+    def _observe(self, latency: float) -> None:
+        self.recent = latency if self.recent is None else self.recent * 0.8 + latency * 0.2
+        self._window_min = min(self._window_min, latency)
+        self._window_count += 1
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        if self._window_count >= self.WINDOW:
+            # Базовая задержка может и вырасти (сменился маршрут, VK стал медленнее) — берём минимум окна
+            self.baseline = self._window_min
+            self._window_min = math.inf
+            self._window_count = 0
@@ -0,0 +1,74 @@
+import logging
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from config import RENDER_CACHE_SIZE
+
+logger = logging.getLogger(__name__)
+
+# Отпечаток последнего отправленного содержимого по (chat_id, message_id)
+_fingerprints: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+render_stats = {"edits": 0, "skipped": 0}
+
+
+def fingerprint(text: str, reply_markup: Optional[InlineKeyboardMarkup], parse_mode: Optional[str]) -> int:
+    rows = ()
+    if reply_markup is not None:
+        rows = tuple(
+            tuple((button.text, button.callback_data, button.url) for button in row)
+            for row in reply_markup.inline_keyboard
+        )
+    return hash((text, rows, parse_mode))
+
+
+def remember(chat_id: int, message_id: int, value: int) -> None:
+    key = (chat_id, message_id)
+    _fingerprints[key] = value
+    _fingerprints.move_to_end(key)
+    while len(_fingerprints) > RENDER_CACHE_SIZE:
+        _fingerprints.popitem(last=False)
+
+
+def forget(chat_id: int, message_id: int) -> None:
+    _fingerprints.pop((chat_id, message_id), None)
+
+
+def remember_sent(message: Message, text: str, reply_markup=None, parse_mode: Optional[str] = "HTML") -> Message:
+    """Запоминает содержимое только что отправленного сообщения, чтобы не редактировать его на то же самое."""
+    if message is not None:
+        remember(message.chat.id, message.message_id, fingerprint(text, reply_markup, parse_mode))
+    return message
+
+
+async def edit_text(bot, chat_id: int, message_id: int, text: str, reply_markup=None, parse_mode: Optional[str] = "HTML"):
+    """
+    edit_message_text, который не ходит в Telegram, если текст и клавиатура
+    не изменились с последней отправки. Прочие ошибки пробрасываются.
+    """
+    value = fingerprint(text, reply_markup, parse_mode)
+    if _fingerprints.get((chat_id, message_id)) == value:
+        render_stats["skipped"] += 1
+        return None
+    try:
+        result = await bot.edit_message_text(
+            chat_id=chat_id,
+            message_id=message_id,
+            text=text,
+            reply_markup=reply_markup,
+            parse_mode=parse_mode
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            raise
+        logger.debug(f"Сообщение не изменено: {e}")
+        result = None
+    render_stats["edits"] += 1
+    remember(chat_id, message_id, value)
+    return result
+
+
+async def edit_message(message: Message, text: str, reply_markup=None, parse_mode: Optional[str] = "HTML"):
+    return await edit_text(message.bot, message.chat.id, message.message_id, text, reply_markup, parse_mode)
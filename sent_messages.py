@@ -0,0 +1,196 @@
+"""
+Реестр отправленных ботом сообщений и фоновое удаление устаревших.
+
+Каждое сообщение, которое бот отправил или отредактировал, попадает в
+ограниченный по размеру реестр: (chat_id, message_id) -> (время, назначение).
+Запись делает request-middleware сессии, поэтому реестр видит все вызовы Bot API
+независимо от того, где в коде они сделаны. Решение «это меню устарело»
+принимается по реестру, без запросов к Telegram; сами удаления копятся и раз в
+MESSAGE_SWEEP_SECONDS уходят пачками delete_messages до 100 ID на вызов.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import InlineKeyboardMarkup, Message
+
+from config import MESSAGE_REGISTRY_SIZE, MESSAGE_SWEEP_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH = 100  # максимум ID в одном deleteMessages
+# Назначения, которые можно удалять, когда они устарели: остальное (документы, дайджесты,
+# результаты задач, сообщения с кнопкой отмены) не трогаем
+CLEANUP_PURPOSES = {"menu"}
+UNDO_CALLBACK_PREFIX = "undo:"
+
+
+class SentMessage(NamedTuple):
+    sent_at: float
+    purpose: str
+
+
+class MessageRegistry:
+    """LRU-реестр сообщений бота с индексом по чату."""
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Tuple[int, int], SentMessage]" = OrderedDict()
+        self._by_chat: Dict[int, Set[int]] = {}
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def register(self, chat_id: int, message_id: int, purpose: str, sent_at: Optional[float] = None) -> None:
+        key = (chat_id, message_id)
+        self._data[key] = SentMessage(time.time() if sent_at is None else sent_at, purpose)
+        self._data.move_to_end(key)
+        self._by_chat.setdefault(chat_id, set()).add(message_id)
+        while len(self._data) > self.maxsize:
+            (old_chat, old_id), _ = self._data.popitem(last=False)
+            self._drop_index(old_chat, old_id)
+            self.evictions += 1
+
+    def touch(self, chat_id: int, message_id: int, purpose: Optional[str] = None) -> None:
+        """Сообщение отредактировано — считаем его свежим; без purpose назначение сохраняется."""
+        entry = self._data.get((chat_id, message_id))
+        if entry is not None:
+            self.register(chat_id, message_id, purpose or entry.purpose)
+
+    def mark(self, chat_id: int, message_id: int, purpose: str) -> None:
+        """Меняет назначение сообщения, не трогая время (например, меню стало результатом задачи)."""
+        entry = self._data.get((chat_id, message_id))
+        if entry is None:
+            self.register(chat_id, message_id, purpose)
+        else:
+            self._data[(chat_id, message_id)] = entry._replace(purpose=purpose)
+
+    def get(self, chat_id: int, message_id: int) -> Optional[SentMessage]:
+        return self._data.get((chat_id, message_id))
+
+    def forget(self, chat_id: int, message_id: int) -> None:
+        if self._data.pop((chat_id, message_id), None) is not None:
+            self._drop_index(chat_id, message_id)
+
+    def expired(self, chat_id: int, ttl: float, keep: Optional[int] = None, now: Optional[float] = None) -> List[int]:
+        """ID сообщений чата с удаляемым назначением, не обновлявшихся дольше ttl (кроме keep)."""
+        deadline = (time.time() if now is None else now) - ttl
+        result = []
+        for message_id in self._by_chat.get(chat_id, ()):
+            entry = self._data[(chat_id, message_id)]
+            if message_id != keep and entry.purpose in CLEANUP_PURPOSES and entry.sent_at < deadline:
+                result.append(message_id)
+        return sorted(result)
+
+    def _drop_index(self, chat_id: int, message_id: int) -> None:
+        ids = self._by_chat.get(chat_id)
+        if ids is not None:
+            ids.discard(message_id)
+            if not ids:
+                del self._by_chat[chat_id]
+
+
+registry = MessageRegistry(MESSAGE_REGISTRY_SIZE)
+sweeper_stats = {"scheduled": 0, "deleted": 0, "calls": 0, "failed": 0}
+
+# Удаления, ожидающие следующего прохода: chat_id -> ID сообщений
+_pending: Dict[int, Set[int]] = {}
+
+
+def schedule_delete(chat_id: int, message_ids: Iterable[int]) -> int:
+    """Откладывает удаление сообщений до следующего прохода очистки."""
+    ids = _pending.setdefault(chat_id, set())
+    added = 0
+    for message_id in message_ids:
+        registry.forget(chat_id, message_id)
+        if message_id not in ids:
+            ids.add(message_id)
+            added += 1
+    if not ids:
+        del _pending[chat_id]
+    sweeper_stats["scheduled"] += added
+    return added
+
+
+def message_purpose(method) -> str:
+    if method.__api_method__ == "sendDocument":
+        return "document"
+    markup = getattr(method, "reply_markup", None)
+    if isinstance(markup, InlineKeyboardMarkup):
+        # Удалив сообщение с кнопкой отмены, мы бы отняли у пользователя отмену
+        if any((button.callback_data or "").startswith(UNDO_CALLBACK_PREFIX)
+               for row in markup.inline_keyboard for button in row):
+            return "undo"
+        return "menu"
+    return "notice"
+
+
+class MessageRegistryMiddleware:
+    """Request-middleware сессии aiogram: ведёт реестр по ответам Bot API."""
+    async def __call__(self, make_request, bot, method):
+        result = await make_request(bot, method)
+        name = method.__api_method__
+        if isinstance(result, Message) and name.startswith("send"):
+            registry.register(result.chat.id, result.message_id, message_purpose(method))
+        elif name in ("editMessageText", "editMessageReplyMarkup") and method.message_id is not None:
+            # Назначение — по тому, что сообщение показывает после правки
+            registry.touch(method.chat_id, method.message_id, message_purpose(method))
+        elif name == "deleteMessage":
+            registry.forget(method.chat_id, method.message_id)
+        elif name == "deleteMessages":
+            for message_id in method.message_ids:
+                registry.forget(method.chat_id, message_id)
+        return result
+
+
+class MessageSweeper:
+    """Раз в MESSAGE_SWEEP_SECONDS удаляет накопленные сообщения пачками deleteMessages."""
+    def __init__(self, bot, interval: float = MESSAGE_SWEEP_SECONDS):
+        self.bot = bot
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+        logger.info("Очистка устаревших сообщений запущена.")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка очистки сообщений: {e}")
+
+    async def flush(self) -> int:
+        deleted = 0
+        while _pending:
+            chat_id, ids = _pending.popitem()
+            ids = sorted(ids)
+            for start in range(0, len(ids), DELETE_BATCH):
+                chunk = ids[start:start + DELETE_BATCH]
+                try:
+                    await self.bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+                    deleted += len(chunk)
+                    sweeper_stats["deleted"] += len(chunk)
+                except TelegramRetryAfter as e:
+                    # Остаток чата вернётся в очередь и уйдёт на следующем проходе
+                    _pending.setdefault(chat_id, set()).update(ids[start:])
+                    logger.warning(f"Telegram просит подождать {e.retry_after} с перед удалением сообщений")
+                    return deleted
+                except TelegramBadRequest as e:
+                    # Сообщения старше 48 часов или уже удалённые Telegram удалить не даст
+                    sweeper_stats["failed"] += len(chunk)
+                    logger.debug(f"Не удалось удалить сообщения чата {chat_id}: {e}")
+                sweeper_stats["calls"] += 1
+        return deleted
@@ -1,13 +1,19 @@
 import aiohttp
 import logging
 
+from config import TRACING_ENABLED
+
 logger = logging.getLogger(__name__)
 session: aiohttp.ClientSession = None
 
 async def create_session():
     global session
     if session is None or session.closed:
-        session = aiohttp.ClientSession()
+        trace_configs = []
+        if TRACING_ENABLED:
+            from tracing import aiohttp_trace_config
+            trace_configs.append(aiohttp_trace_config())
+        session = aiohttp.ClientSession(trace_configs=trace_configs)
         logger.info("HTTP-сессия создана.")
 
 async def close_session():
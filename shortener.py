@@ -0,0 +1,35 @@
+import logging
+
+from config import VK_TOKEN
+from database import get_shared_short_link, save_shared_short_link, get_distinct_keys
+from utils import canonicalize_url
+from vkcc import shorten_link
+
+logger = logging.getLogger(__name__)
+
+# Счётчики общего кэша сокращений с момента запуска процесса
+reuse_stats = {"hits": 0, "misses": 0, "bypassed": 0}
+
+
+async def shorten_for_user(user_id: int, url: str) -> str:
+    """
+    Сокращает URL, переиспользуя короткую ссылку, уже полученную для того же
+    канонического URL любым пользователем. Пользователи с включёнными отдельными
+    ключами (/own_keys) всегда получают новый ключ и не пополняют общий кэш.
+    """
+    if await get_distinct_keys(user_id):
+        reuse_stats["bypassed"] += 1
+        return await shorten_link(url, VK_TOKEN)
+
+    canonical = canonicalize_url(url)
+    cached = await get_shared_short_link(canonical)
+    if cached:
+        reuse_stats["hits"] += 1
+        logger.info(f"Короткая ссылка взята из общего кэша: {url} -> {cached[0]}")
+        return cached[0]
+
+    reuse_stats["misses"] += 1
+    short_url = await shorten_link(url, VK_TOKEN)
+    if short_url:
+        await save_shared_short_link(canonical, short_url, short_url.split("/")[-1])
+    return short_url
@@ -0,0 +1,125 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import vkcc
+from config import VK_TOKEN, STATS_TTL_SECONDS, VK_SHED_QUEUE
+from database import get_stats_snapshots, save_link_stats_batch, get_stats_summary, save_link_stats
+from geo import COUNTRY, CITY, resolve
+from utils import summarize_stats
+from ratelimit import TokenBucket, priority, INTERACTIVE
+from vkcc import get_links_stats_batch, get_link_stats, VK_EXECUTE_MAX_CALLS
+
+logger = logging.getLogger(__name__)
+
+shed_stats = {"shed": 0}
+
+
+def vk_overloaded() -> bool:
+    """
+    Очередь к VK длиннее VK_SHED_QUEUE: интерактивный запрос не встаёт в неё,
+    а показывает сохранённый снимок с пометкой. Фоновые задачи всегда ждут.
+    """
+    return priority.get() == INTERACTIVE and vkcc.vk_limiter.queued >= VK_SHED_QUEUE
+
+
+def stale_note(fetched_at: Optional[str]) -> str:
+    """Пометка для данных, показанных из снимка вместо запроса к VK."""
+    if not fetched_at:
+        return ""
+    try:
+        when = datetime.fromisoformat(fetched_at).strftime("%d.%m %H:%M")
+    except ValueError:
+        when = fetched_at[:16]
+    return f"\n⏳ VK перегружен, данные на {when}"
+
+
+def vk_key_from_short_url(short_url: str) -> str:
+    return short_url.rstrip("/").split("/")[-1]
+
+
+async def get_views_for_links(user_id: int, links: List[Tuple], max_age: float = STATS_TTL_SECONDS,
+                              limiter: Optional[TokenBucket] = None) -> Dict[int, int]:
+    """
+    Просмотры для строк (id, title, short_url, created_at): сначала сохранённые снимки,
+    затем один пакетный запрос к VK для отсутствующих и старше max_age секунд.
+    С limiter каждый запрос execute ждёт токен (фоновые рассылки не выбирают лимит VK).
+    Если VK недоступен или перегружен (vk_overloaded), возвращаются устаревшие значения.
+    """
+    snapshots = await get_stats_snapshots([link[0] for link in links])
+    views = {link_id: snapshot_views for link_id, (snapshot_views, _) in snapshots.items()}
+
+    fresh_after = (datetime.now() - timedelta(seconds=max_age)).isoformat()
+    stale = {
+        vk_key_from_short_url(short_url): link_id
+        for link_id, _, short_url, _ in links
+        if link_id not in snapshots or snapshots[link_id][1] < fresh_after
+    }
+    if not stale or not VK_TOKEN:
+        return views
+    if vk_overloaded():
+        shed_stats["shed"] += 1
+        return views
+
+    fetched = {}
+    keys = list(stale)
+    try:
+        for start in range(0, len(keys), VK_EXECUTE_MAX_CALLS):
+            if limiter:
+                await limiter.acquire()
+            fetched.update(await get_links_stats_batch(keys[start:start + VK_EXECUTE_MAX_CALLS], VK_TOKEN))
+    except ValueError as e:
+        logger.warning(f"Не удалось обновить просмотры для списка: {e}")
+        if not fetched:
+            return views
+
+    entries = [(stale[key], user_id, stats, summarize_stats(stats)) for key, stats in fetched.items()]
+    await save_link_stats_batch(entries)
+    await warm_geo_names([summary for _, _, _, summary in entries])
+    for link_id, _, stats, _ in entries:
+        views[link_id] = stats.get("views", 0)
+    return views
+
+
+async def get_link_summary(link_id: int, user_id: int, vk_key: str) -> Tuple[dict, Optional[str]]:
+    """
+    Сводка статистики для карточки: сохранённая, если она свежее STATS_TTL_SECONDS,
+    иначе запрос к VK с сохранением снимка. Возвращает (сводка, время снимка), если
+    из-за перегрузки VK показан устаревший снимок, иначе (сводка, None).
+    """
+    stored = await get_stats_summary(link_id)
+    fresh_after = (datetime.now() - timedelta(seconds=STATS_TTL_SECONDS)).isoformat()
+    if stored and stored[1] >= fresh_after:
+        return stored[0], None
+    if stored and vk_overloaded():
+        shed_stats["shed"] += 1
+        return stored
+    stats = await get_link_stats(vk_key, VK_TOKEN)
+    summary = summarize_stats(stats)
+    await save_link_stats(link_id, user_id, stats, summary)
+    await warm_geo_names([summary])
+    return summary, None
+
+
+async def get_link_views(link_id: int, user_id: int, vk_key: str) -> Tuple[int, Optional[str]]:
+    """
+    Просмотры для карточки ссылки: запрос к VK с сохранением снимка, а при перегрузке
+    VK — сохранённый снимок. Возвращает (просмотры, время снимка или None).
+    """
+    if vk_overloaded():
+        snapshot = (await get_stats_snapshots([link_id])).get(link_id)
+        if snapshot:
+            shed_stats["shed"] += 1
+            return snapshot
+    stats = await get_link_stats(vk_key, VK_TOKEN)
+    await save_link_stats(link_id, user_id, stats)
+    return stats.get("views", 0), None
+
+
+async def warm_geo_names(summaries: List[dict]) -> None:
+    """
+    Разрешает названия стран и городов из свежих сводок одним пакетом при получении
+    статистики, чтобы при показе хватало встроенного набора и кэша.
+    """
+    await resolve(COUNTRY, (row[0] for s in summaries for row in s.get("countries", [])))
+    await resolve(CITY, (row[0] for s in summaries for row in s.get("cities", [])))
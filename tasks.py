@@ -0,0 +1,168 @@
+import io
+import logging
+import time
+
+from aiogram.types import BufferedInputFile, InlineKeyboardButton
+from aiogram.utils.markdown import hlink
+
+from config import VK_TOKEN, DIGEST_FRESH_SECONDS
+from database import (
+    get_link_by_id,
+    get_link_by_original_url,
+    get_full_links_by_user,
+    save_link_stats,
+    get_digest_rows,
+    mark_digest_baseline,
+)
+from digest import format_digest, vk_budget
+from handlers import safe_edit, process_and_save_link
+from jobs import register_job_kind
+from keyboards import get_main_inline_keyboard
+from outbox import send_later
+from stats import warm_geo_names, get_views_for_links
+from utils import summarize_stats
+from vkcc import get_link_stats
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_EDIT_INTERVAL = 2.0  # не чаще одного редактирования прогресса раз в N секунд на задачу
+
+_last_progress = {}
+
+
+async def report_progress(bot, job, text: str):
+    if not job["message_id"]:
+        return
+    now = time.monotonic()
+    if now - _last_progress.get(job["id"], 0) < PROGRESS_EDIT_INTERVAL:
+        return
+    _last_progress[job["id"]] = now
+    await safe_edit(bot, job["chat_id"], job["message_id"], text)
+
+
+# Сокращение и импорт ссылок
+
+async def shorten_item(bot, job, item) -> dict:
+    user_id = job["user_id"]
+    url, title = item["payload"]["url"], item["payload"]["title"]
+    await report_progress(bot, job, f"Сокращаю {item['idx'] + 1} из {job['total']}: {url}")
+
+    # Ссылка могла быть сохранена до перезапуска, но результат элемента не успел записаться
+    existing = await get_link_by_original_url(user_id, url)
+    if existing and existing[6] >= job["created_at"]:
+        link_id, _, _, short_url, saved_title, _, _ = existing
+        return {"ok": True, "link_id": link_id, "title": saved_title, "short_url": short_url}
+
+    success, text, short_url = await process_and_save_link(user_id, url, title)
+    if not success:
+        return {"ok": False, "error": text}
+    link = await get_link_by_original_url(user_id, url)
+    if not link:
+        return {"ok": False, "error": f"❌ Ошибка: Не удалось сохранить ссылку '{url}'."}
+    return {"ok": True, "link_id": link[0], "title": link[4], "short_url": short_url, "text": text}
+
+
+async def finalize_shorten(bot, job, items):
+    _last_progress.pop(job["id"], None)
+    results = [item["result"] or {} for item in items]
+    keyboard = get_main_inline_keyboard()
+
+    if job["total"] == 1 and not job["payload"].get("failed"):
+        result = results[0]
+        if result.get("ok"):
+            text = result.get("text") or \
+                f"✅ Ссылка сохранена: {hlink(result['title'], result['short_url'])}\n\n<b>Что дальше?</b>"
+            keyboard = get_main_inline_keyboard([
+                InlineKeyboardButton(text="📋 Скопировать", callback_data=f"copy:{result['short_url']}"),
+                InlineKeyboardButton(text="✏️ Переименовать", callback_data=f"rename:{result['link_id']}")
+            ])
+        else:
+            text = result.get("error", "❌ Ошибка: Не удалось сократить ссылку.\n\n<b>Что дальше?</b>")
+        await safe_edit(bot, job["chat_id"], job["message_id"], text, keyboard)
+        return
+
+    s = [r for r in results if r.get("ok")]
+    f = list(job["payload"].get("failed", [])) + [r["error"] for r in results if not r.get("ok")]
+    partial_success = len(s) > 0
+
+    text = f"{'✅' if partial_success else '❌'} Готово! Добавлено: {len(s)}\n"
+    for i, link in enumerate(s, 1):
+        text += f"{i}. {link['title']} — {hlink(link['title'], link['short_url'])}\n"
+    if f:
+        text += "\n❌ Ошибки:\n" + "\n".join(f)
+    text += "\n<b>Что дальше?</b>"
+
+    if partial_success:
+        keyboard = get_main_inline_keyboard([
+            InlineKeyboardButton(text="📋 Скопировать все", callback_data=f"copy_all:{job['id']}"),
+            InlineKeyboardButton(text="✏️ Переименовать", callback_data=f"rename_mass:{job['id']}")
+        ])
+    await safe_edit(bot, job["chat_id"], job["message_id"], text, keyboard)
+
+
+# Выгрузка
+
+async def finalize_export(bot, job, items):
+    links = await get_full_links_by_user(job["user_id"])
+    import csv  # нужен только для выгрузки, не грузим при старте
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["title", "original_url", "short_url", "created_at"])
+    for _, _, original_url, short_url, title, _, created_at in links:
+        writer.writerow([title, original_url, short_url, created_at])
+    document = BufferedInputFile(buffer.getvalue().encode("utf-8-sig"), filename="links.csv")
+    await bot.send_document(
+        job["chat_id"],
+        document,
+        caption=f"📤 Выгрузка ссылок: {len(links)}",
+        reply_markup=get_main_inline_keyboard()
+    )
+
+
+# Обновление статистики
+
+async def backfill_stats_item(bot, job, item) -> dict:
+    await report_progress(bot, job, f"⏳ Обновляю статистику: {item['idx'] + 1} из {job['total']}")
+    link = await get_link_by_id(item["payload"]["link_id"], job["user_id"])
+    if not link:
+        return {"ok": False, "error": "Ссылка не найдена"}
+    stats = await get_link_stats(link[5], VK_TOKEN)
+    summary = summarize_stats(stats)
+    await save_link_stats(link[0], job["user_id"], stats, summary)
+    await warm_geo_names([summary])
+    return {"ok": True, "views": stats.get("views", 0)}
+
+
+async def finalize_stats_backfill(bot, job, items):
+    _last_progress.pop(job["id"], None)
+    results = [item["result"] or {} for item in items]
+    updated = [r for r in results if r.get("ok")]
+    total_views = sum(r.get("views", 0) for r in updated)
+    text = (
+        f"📊 Статистика обновлена: {len(updated)} из {len(results)} ссылок.\n"
+        f"👁 Всего переходов: {total_views}\n\n<b>Что дальше?</b>"
+    )
+    await safe_edit(bot, job["chat_id"], job["message_id"], text, get_main_inline_keyboard())
+
+
+# Дайджест
+
+async def digest_item(bot, job, item) -> dict:
+    links = [tuple(link) for link in item["payload"]["links"]]
+    views = await get_views_for_links(job["user_id"], links, DIGEST_FRESH_SECONDS, vk_budget)
+    return {"ok": True, "links": len(views)}
+
+
+async def finalize_digest(bot, job, items):
+    text = format_digest(job["payload"].get("period"), await get_digest_rows(job["user_id"]))
+    if text:
+        await send_later(job["chat_id"], job["user_id"], "digest", text)
+    await mark_digest_baseline(job["user_id"])
+
+
+register_job_kind("shorten", shorten_item, finalize_shorten)
+register_job_kind("import", shorten_item, finalize_shorten)
+register_job_kind("export", finalize=finalize_export)
+register_job_kind("stats_backfill", backfill_stats_item, finalize_stats_backfill, background=True)
+register_job_kind("digest", digest_item, finalize_digest, background=True)
@@ -0,0 +1,34 @@
+import asyncio
+import os
+import tempfile
+
+import aiosqlite
+
+import database
+from config import MAX_TITLE_LENGTH
+
+USER_ID = 1
+
+
+def test_prefix_truncates_to_max_title_length_and_reports_it(monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", os.path.join(tempfile.mkdtemp(), "links.db"))
+
+    async def scenario():
+        await database.init_db()
+        titles = ["Короткое", "x" * MAX_TITLE_LENGTH, None]
+        for i, title in enumerate(titles):
+            await database.save_link(USER_ID, f"https://example.com/{i}", f"https://vk.cc/p{i}", title, f"p{i}")
+        async with aiosqlite.connect(database.DB_PATH) as db:
+            async with db.execute("SELECT id FROM links ORDER BY id") as cursor:
+                ids = [row[0] for row in await cursor.fetchall()]
+        undo_id, renamed, truncated = await database.prefix_titles_bulk(USER_ID, ids, False, "[Архив] ")
+        assert (renamed, truncated) == (3, 1)
+        new_titles = [(await database.get_link_by_id(link_id, USER_ID)).title for link_id in ids]
+        assert new_titles[0] == "[Архив] Короткое"
+        assert len(new_titles[1]) == MAX_TITLE_LENGTH
+        assert new_titles[2] == "[Архив] "
+        # Отмена возвращает исходные, необрезанные названия
+        assert await database.undo_bulk_action(undo_id, USER_ID)
+        assert [(await database.get_link_by_id(link_id, USER_ID)).title for link_id in ids] == titles
+
+    asyncio.run(scenario())
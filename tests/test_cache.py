@@ -0,0 +1,113 @@
+import asyncio
+import os
+import tempfile
+
+import aiosqlite
+import pytest
+
+import database
+from cache import LRUCache
+
+USER_ID = 1
+
+
+def test_put_after_invalidate_is_dropped():
+    cache = LRUCache(4)
+    epoch = cache.epoch
+    cache.invalidate(("u", 1))
+    cache.put(("u", 1), "старое", epoch)
+    assert cache.get(("u", 1)) is None
+    cache.put(("u", 1), "новое", cache.epoch)
+    assert cache.get(("u", 1)) == "новое"
+
+
+def test_lru_eviction_and_stats():
+    cache = LRUCache(2)
+    for key in "abc":
+        cache.put(key, key.upper(), cache.epoch)
+    assert cache.get("a") is None
+    assert cache.get("c") == "C"
+    assert cache.stats()["evictions"] == 1
+
+
+class PausedRead:
+    """aiosqlite.connect, у которого первое соединение «застревает» перед закрытием:
+    строка уже прочитана, но get_link_by_id ещё не положил её в кэш."""
+    def __init__(self):
+        self.read_done = asyncio.Event()
+        self.resume = asyncio.Event()
+        self._paused = False
+        self._connect = aiosqlite.connect
+
+    def __call__(self, *args, **kwargs):
+        connection = self._connect(*args, **kwargs)
+        if self._paused:
+            return connection
+        self._paused = True
+        probe = self
+
+        class Paused:
+            async def __aenter__(self):
+                return await connection.__aenter__()
+
+            async def __aexit__(self, *exc):
+                probe.read_done.set()
+                await probe.resume.wait()
+                return await connection.__aexit__(*exc)
+
+        return Paused()
+
+
+@pytest.fixture
+def link_id(monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", os.path.join(tempfile.mkdtemp(), "links.db"))
+    monkeypatch.setattr(database, "link_cache", LRUCache(16))
+
+    async def prepare():
+        await database.init_db()
+        await database.save_link(USER_ID, "https://example.com", "https://vk.cc/abc", "Старое", "abc")
+        async with aiosqlite.connect(database.DB_PATH) as db:
+            async with db.execute("SELECT id FROM links") as cursor:
+                return (await cursor.fetchone())[0]
+
+    return asyncio.run(prepare())
+
+
+async def race(monkeypatch, link_id, write):
+    """Чтение ссылки, во время которого выполняется write; возвращает, что вернуло чтение."""
+    paused = PausedRead()
+    monkeypatch.setattr(database.aiosqlite, "connect", paused)
+    read = asyncio.create_task(database.get_link_by_id(link_id, USER_ID))
+    await paused.read_done.wait()
+    assert await write()
+    paused.resume.set()
+    return await read
+
+
+def test_rename_during_read_does_not_cache_stale_title(monkeypatch, link_id):
+    async def scenario():
+        stale = await race(monkeypatch, link_id, lambda: database.rename_link(link_id, USER_ID, "Новое"))
+        assert stale.title == "Старое"
+        assert database.link_cache.get((USER_ID, link_id)) is None
+        assert (await database.get_link_by_id(link_id, USER_ID)).title == "Новое"
+
+    asyncio.run(scenario())
+
+
+def test_delete_during_read_does_not_cache_deleted_link(monkeypatch, link_id):
+    async def scenario():
+        await race(monkeypatch, link_id, lambda: database.delete_link(link_id, USER_ID))
+        assert database.link_cache.get((USER_ID, link_id)) is None
+        assert await database.get_link_by_id(link_id, USER_ID) is None
+
+    asyncio.run(scenario())
+
+
+def test_rename_invalidates_cached_link(link_id):
+    async def scenario():
+        assert (await database.get_link_by_id(link_id, USER_ID)).title == "Старое"
+        assert database.link_cache.get((USER_ID, link_id)) is not None
+        await database.rename_link(link_id, USER_ID, "Новое")
+        assert (await database.get_link_by_id(link_id, USER_ID)).title == "Новое"
+
+    asyncio.run(scenario())
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message
+
+from dedup import ActionDedupMiddleware
+
+USER_ID = 42
+
+
+def message(text: str, message_id: int) -> Message:
+    return Message.model_validate({
+        "message_id": message_id, "date": int(time.time()), "text": text,
+        "chat": {"id": USER_ID, "type": "private"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "U"},
+    })
+
+
+def fsm() -> FSMContext:
+    return FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=USER_ID, user_id=USER_ID))
+
+
+async def feed(middleware, callback, text: str, message_id: int, state: FSMContext) -> bool:
+    """True, если обработчик выполнился."""
+    calls = []
+
+    async def handler(event, data):
+        calls.append(event)
+
+    data = {"handler": SimpleNamespace(callback=callback, flags={"mutating": True}), "state": state}
+    await middleware(handler, message(text, message_id), data)
+    return bool(calls)
+
+
+async def set_new_title(message, state):
+    pass
+
+
+async def process_mass_title(message, state):
+    pass
+
+
+def test_same_title_for_different_links_is_not_dropped():
+    async def scenario():
+        middleware, state = ActionDedupMiddleware(), fsm()
+        await state.set_state("LinkStates:waiting_for_new_title")
+        await state.update_data(rename_link_id=1)
+        first = await feed(middleware, set_new_title, "Отчёт", 1, state)
+        await state.update_data(rename_link_id=2)
+        second = await feed(middleware, set_new_title, "Отчёт", 2, state)
+        return first, second
+
+    assert asyncio.run(scenario()) == (True, True)
+
+
+def test_mass_rename_advances_on_repeated_title():
+    async def scenario():
+        middleware, state = ActionDedupMiddleware(), fsm()
+        await state.set_state("LinkStates:waiting_for_mass_title")
+        results = []
+        for position in range(3):
+            await state.update_data(rename_job=7, rename_pos=position)
+            results.append(await feed(middleware, process_mass_title, "Акция", 10 + position, state))
+        return results
+
+    assert asyncio.run(scenario()) == [True, True, True]
+
+
+def test_repeat_for_same_target_is_dropped():
+    async def scenario():
+        middleware, state = ActionDedupMiddleware(), fsm()
+        await state.set_state("LinkStates:waiting_for_new_title")
+        await state.update_data(rename_link_id=1)
+        return (await feed(middleware, set_new_title, "Отчёт", 1, state),
+                await feed(middleware, set_new_title, "Отчёт", 2, state))
+
+    assert asyncio.run(scenario()) == (True, False)
+
+
+def test_toggle_commands_are_not_deduplicated():
+    from handlers import router
+
+    flags = {handler.callback.__name__: handler.flags for handler in router.message.handlers}
+    assert not flags["cmd_own_keys"].get("mutating")
+    assert not flags["cmd_digest"].get("mutating")
@@ -0,0 +1,8 @@
+from digest import format_digest
+
+
+def test_digest_escapes_titles():
+    rows = [(1, "<b>Скидки & акции", "https://vk.cc/a", 10, 2), (2, None, "https://vk.cc/b?x=1&y=2", 5, 0)]
+    text = format_digest("daily", rows)
+    assert "📍 &lt;b&gt;Скидки &amp; акции — 10 (+8)" in text
+    assert "📍 https://vk.cc/b?x=1&amp;y=2 — 5 (+5)" in text
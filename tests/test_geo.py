@@ -0,0 +1,24 @@
+import os
+import tempfile
+
+import geo
+
+
+def test_dataset_round_trip():
+    path = os.path.join(tempfile.mkdtemp(), "geo.bin")
+    geo.write_dataset(path, {1: "Россия", 65: "Германия"}, {2: "Санкт-Петербург"})
+    dataset = geo.GeoDataset(path)
+    assert dataset.get(geo.COUNTRY, 65) == "Германия"
+    assert dataset.get(geo.CITY, 2) == "Санкт-Петербург"
+    assert dataset.get(geo.COUNTRY, 2) is None
+    assert dataset.get(geo.CITY, 999) is None
+
+
+def test_shipped_dataset_matches_vk_country_ids():
+    dataset = geo.GeoDataset(geo.DATASET_PATH)
+    for country_id, name in geo.SEED_COUNTRIES.items():
+        assert dataset.get(geo.COUNTRY, country_id) == name
+    assert len(geo.SEED_COUNTRIES) > 200
+    assert dataset.get(geo.COUNTRY, 9) == "США"
+    assert dataset.get(geo.COUNTRY, 65) == "Германия"
+    assert dataset.get(geo.CITY, 1) == "Москва"
@@ -0,0 +1,25 @@
+from ingest import DUPLICATE, INVALID, parse_batch
+from utils import URL_PATTERN, canonicalize_match, canonicalize_url
+
+URLS = [
+    "https://example.com/a/b.html", "https://Example.com/a", "https://example.com/a/",
+    "https://example.com", "http://example.com:80/x", "https://example.com:8443/x",
+    "https://example.com/p?b=2&a=1", "https://example.com/p?q=a%20b", "https://example.com/p#top",
+    "http://127.0.0.1/x", "http://localhost/x",
+]
+
+
+def test_canonicalize_match_agrees_with_canonicalize_url():
+    for url in URLS:
+        assert canonicalize_match(URL_PATTERN.match(url)) == canonicalize_url(url), url
+
+
+def test_parse_batch_rejects_repeats_and_invalid_lines():
+    result = parse_batch([
+        "https://example.com/a | Первая",
+        "https://example.com/a",
+        "https://EXAMPLE.com/a/",
+        "not a url",
+    ])
+    assert result.pairs == [("https://example.com/a", "Первая")]
+    assert [(item.line, item.reason) for item in result.rejected] == [(2, DUPLICATE), (3, DUPLICATE), (4, INVALID)]
@@ -0,0 +1,69 @@
+import asyncio
+import os
+import tempfile
+import time
+
+import pytest
+
+import database
+import jobs
+
+BACKGROUND, INTERACTIVE = "test_digest", "test_shorten"
+
+
+@pytest.fixture(autouse=True)
+def job_db(monkeypatch):
+    """Своя база и свои типы задач на каждый тест; после теста всё возвращается как было."""
+    monkeypatch.setattr(database, "DB_PATH", os.path.join(tempfile.mkdtemp(), "jobs.db"))
+    monkeypatch.setattr(jobs, "_kinds", dict(jobs._kinds))
+    asyncio.run(database.init_db())
+
+
+def test_claim_prefers_interactive_over_older_background():
+    async def scenario():
+        for user_id in range(1, 6):
+            await database.create_job(user_id, user_id, BACKGROUND, {}, [1])
+        interactive = await database.create_job(100, 100, INTERACTIVE, {}, [1])
+        job = await database.claim_job("w", 1, 3, (BACKGROUND,), 2)
+        assert job["id"] == interactive
+        # Фоновых берётся не больше max_background
+        claimed = [await database.claim_job("w", 1, 3, (BACKGROUND,), 2) for _ in range(3)]
+        assert [job is not None for job in claimed] == [True, True, False]
+
+    asyncio.run(scenario())
+
+
+def test_interactive_latency_bounded_under_digest_backlog():
+    started = {}
+
+    async def slow_item(bot, job, item):
+        await asyncio.sleep(0.05)
+        return {"ok": True}
+
+    async def fast_item(bot, job, item):
+        started[job["id"]] = time.perf_counter()
+        return {"ok": True}
+
+    jobs.register_job_kind(BACKGROUND, slow_item, background=True)
+    jobs.register_job_kind(INTERACTIVE, fast_item)
+
+    async def scenario():
+        queue = jobs.JobQueue(bot=None, workers=4, max_per_user=1, background_workers=2)
+        await queue.start()
+        try:
+            # Дайджесты 50 пользователей по 10 элементов — около 12 секунд работы на двух воркерах
+            for user_id in range(1, 51):
+                await jobs.enqueue_job(user_id, user_id, BACKGROUND, {}, list(range(10)))
+            await asyncio.sleep(0.2)
+            latencies = []
+            for n in range(5):
+                enqueued = time.perf_counter()
+                job_id = await jobs.enqueue_job(1000 + n, 1000 + n, INTERACTIVE, {}, [1])
+                while job_id not in started:
+                    await asyncio.sleep(0.005)
+                latencies.append(started[job_id] - enqueued)
+        finally:
+            await queue.stop()
+        assert max(latencies) < 0.5, latencies
+
+    asyncio.run(scenario())
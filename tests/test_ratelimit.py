@@ -0,0 +1,74 @@
+import asyncio
+import math
+import time
+
+from ratelimit import AdaptiveLimiter, BULK, INTERACTIVE, priority
+
+
+async def acquire_at(limiter: AdaptiveLimiter, level: int) -> float:
+    priority.set(level)
+    started = time.monotonic()
+    limiter.release(await limiter.acquire())
+    return time.monotonic() - started
+
+
+def test_flood_cooldown_pauses_only_bulk():
+    async def scenario():
+        limiter = AdaptiveLimiter(8, cooldown=0.3)
+        limiter.release(await limiter.acquire(), "drop")
+        assert limiter.limit == 4
+        interactive = await asyncio.create_task(acquire_at(limiter, INTERACTIVE))
+        bulk = await asyncio.create_task(acquire_at(limiter, BULK))
+        assert interactive < 0.05
+        assert bulk >= 0.25
+
+    asyncio.run(scenario())
+
+
+def test_cooldown_applies_to_everyone_without_priorities():
+    async def scenario():
+        limiter = AdaptiveLimiter(8, cooldown=0.3)
+        limiter.prioritize = False
+        limiter.release(await limiter.acquire(), "drop")
+        assert await asyncio.create_task(acquire_at(limiter, INTERACTIVE)) >= 0.25
+
+    asyncio.run(scenario())
+
+
+def release_ok(limiter: AdaptiveLimiter, busy: int, latency: float = 0.0) -> None:
+    limiter.in_flight = busy
+    limiter.release(time.monotonic() - latency)
+
+
+def test_limit_grows_about_one_per_round_only_when_used():
+    limiter = AdaptiveLimiter(4, tolerance=math.inf)
+    release_ok(limiter, busy=1)
+    assert limiter.limit == 4
+    for _ in range(4):
+        release_ok(limiter, busy=4)
+    assert 4.9 < limiter.limit < 5
+
+
+def test_drop_halves_once_per_wave_and_respects_bounds():
+    limiter = AdaptiveLimiter(8, min_limit=3, max_limit=9, cooldown=0, tolerance=math.inf)
+    started = time.monotonic()
+    limiter.in_flight = 2
+    limiter.release(time.monotonic(), "drop")
+    assert limiter.limit == 4
+    # Ответ на запрос той же волны (начат до снижения) предел повторно не режет
+    limiter.release(started, "drop")
+    assert limiter.limit == 4
+    limiter.in_flight = 1
+    limiter.release(time.monotonic(), "drop")
+    assert limiter.limit == 3
+    assert limiter.drops == 2
+    for _ in range(100):
+        release_ok(limiter, busy=9)
+    assert limiter.limit == 9
+
+
+def test_latency_above_tolerance_trims_by_ten_percent():
+    limiter = AdaptiveLimiter(10)
+    release_ok(limiter, busy=1, latency=0.01)
+    release_ok(limiter, busy=1, latency=1.0)
+    assert math.isclose(limiter.limit, 9)
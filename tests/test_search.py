@@ -0,0 +1,94 @@
+import asyncio
+import os
+import tempfile
+from types import SimpleNamespace
+
+import pytest
+
+import database
+import handlers
+
+USER_ID = 1
+
+
+class AnswerRecorder:
+    def __init__(self):
+        self.texts = []
+
+    async def answer(self, text, **kwargs):
+        self.texts.append(text)
+
+
+def test_search_headers_escape_query(monkeypatch):
+    query = "<b a&b"
+    pages = {1: ([], False), 2: ([(1, "Ссылка", "https://vk.cc/a", "https://example.com")], False)}
+
+    async def fake_search(user_id, q, limit, offset):
+        return pages[offset // limit + 1]
+
+    monkeypatch.setattr(handlers, "search_links", fake_search)
+    message = AnswerRecorder()
+    asyncio.run(handlers.send_search_page(message, 1, query, 1))
+    asyncio.run(handlers.send_search_page(message, 1, query, 2))
+    for text in message.texts:
+        assert "«&lt;b a&amp;b»" in text
+        assert query not in text
+
+
+def test_archive_search_headers_escape_query(monkeypatch):
+    query = "<b a&b"
+    texts = []
+    pages = {1: ([], False), 2: ([(1, "Ссылка", "https://vk.cc/a", "https://example.com")], False)}
+
+    async def fake_archived(user_id, offset, limit, q):
+        return pages[offset // limit + 1]
+
+    async def fake_edit(message, text, **kwargs):
+        texts.append(text)
+
+    monkeypatch.setattr(handlers, "get_archived_links", fake_archived)
+    monkeypatch.setattr(handlers, "edit_message", fake_edit)
+    callback = SimpleNamespace(from_user=SimpleNamespace(id=1), message=None)
+    asyncio.run(handlers.send_archive_page(callback, 1, query))
+    asyncio.run(handlers.send_archive_page(callback, 2, query))
+    for text in texts:
+        assert "«&lt;b a&amp;b»" in text
+
+
+@pytest.fixture
+def user_links(monkeypatch):
+    monkeypatch.setattr(database, "DB_PATH", os.path.join(tempfile.mkdtemp(), "links.db"))
+
+    async def prepare():
+        await database.init_db()
+        for i in range(12):
+            await database.save_link(USER_ID, f"https://example.com/{i}", f"https://vk.cc/s{i}", f"Заметка {i}", f"s{i}")
+        await database.save_link(USER_ID, "https://example.com/sale", "https://vk.cc/sale", "Скидка 50%", "sale")
+
+    asyncio.run(prepare())
+
+
+def test_search_pages_past_rank_window(monkeypatch, user_links):
+    monkeypatch.setattr(database, "SEARCH_RANK_WINDOW", 5)
+
+    async def all_pages():
+        found, page = [], 0
+        while True:
+            rows, has_more = await database.search_links(USER_ID, "заметка", 4, page * 4)
+            found += [row[0] for row in rows]
+            page += 1
+            if not has_more:
+                return found
+
+    found = asyncio.run(all_pages())
+    assert len(found) == 12 and len(set(found)) == 12
+
+
+def test_like_fallback_treats_wildcards_literally(user_links):
+    async def titles(query):
+        rows, _ = await database.search_links(USER_ID, query, 20)
+        return [row[1] for row in rows]
+
+    assert asyncio.run(titles("%")) == ["Скидка 50%"]
+    assert asyncio.run(titles("% %")) == []
+    assert asyncio.run(titles("\\")) == []
@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+from aiogram.methods import EditMessageText, SendMessage
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+
+from sent_messages import MessageRegistry, MessageRegistryMiddleware, registry
+
+CHAT_ID = 42
+OLD = 3600
+
+
+def keyboard(*callbacks: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text=c, callback_data=c)] for c in callbacks])
+
+
+def call(method, message_id: int):
+    async def make_request(bot, method):
+        if isinstance(method, SendMessage):
+            return Message.model_validate({"message_id": message_id, "date": int(time.time()),
+                                           "chat": {"id": CHAT_ID, "type": "private"}, "text": method.text})
+        return True
+
+    return asyncio.run(MessageRegistryMiddleware()(make_request, None, method))
+
+
+def test_only_navigation_menus_expire():
+    reg = MessageRegistry(16)
+    now = time.time()
+    for message_id, purpose in enumerate(("menu", "undo", "result", "document", "digest"), 1):
+        reg.register(CHAT_ID, message_id, purpose, sent_at=now - OLD)
+    reg.register(CHAT_ID, 10, "menu", sent_at=now)
+    assert reg.expired(CHAT_ID, 300, now=now) == [1]
+
+
+def test_undo_keyboard_is_not_a_menu_on_send_and_edit():
+    call(SendMessage(chat_id=CHAT_ID, text="меню", reply_markup=keyboard("main")), 101)
+    assert registry.get(CHAT_ID, 101).purpose == "menu"
+    call(EditMessageText(chat_id=CHAT_ID, message_id=101, text="удалено", reply_markup=keyboard("main", "undo:7")), 0)
+    assert registry.get(CHAT_ID, 101).purpose == "undo"
+    # После отмены сообщение снова обычное меню
+    call(EditMessageText(chat_id=CHAT_ID, message_id=101, text="отменено", reply_markup=keyboard("main")), 0)
+    assert registry.get(CHAT_ID, 101).purpose == "menu"
+
+
+def test_mark_result_keeps_sent_time():
+    reg = MessageRegistry(16)
+    reg.register(CHAT_ID, 5, "menu", sent_at=1.0)
+    reg.mark(CHAT_ID, 5, "result")
+    assert reg.get(CHAT_ID, 5) == (1.0, "result")
+    assert reg.expired(CHAT_ID, 300) == []
@@ -0,0 +1,230 @@
+"""
+Трассировка апдейтов и фоновых задач (включается TRACING=1).
+
+Каждый апдейт и каждая фоновая задача получают trace_id (contextvars), внутри
+создаются вложенные спаны:
+- db.<функция> — каждая публичная корутина database.py (instrument_module);
+- vk <метод> — каждый HTTP-запрос общей aiohttp-сессии (aiohttp_trace_config);
+- bot.<метод> — каждый вызов Bot API (BotRequestMiddleware).
+
+Законченная трасса пишется одной пачкой строк в TRACE_FILE (JSONL, по спану на
+строку) и, если задан TRACE_OTLP_URL, отправляется туда в формате OTLP/HTTP JSON.
+trace_id попадает в каждую запись лога (поле %(trace_id)s).
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from config import TRACING_ENABLED, TRACE_FILE, TRACE_OTLP_URL
+
+logger = logging.getLogger(__name__)
+
+trace_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_id", default=None)
+_span_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span_id", default=None)
+_spans_var: contextvars.ContextVar[Optional[List[dict]]] = contextvars.ContextVar("spans", default=None)
+
+
+def _new_id(size: int) -> str:
+    return os.urandom(size).hex()
+
+
+def _finish(record: dict, started: float, error: Optional[BaseException]) -> None:
+    record["duration_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    if error is not None:
+        record["error"] = f"{type(error).__name__}: {error}"
+    spans = _spans_var.get()
+    if spans is not None:
+        spans.append(record)
+
+
+def _start(name: str, attrs: Dict[str, Any]) -> dict:
+    return {
+        "trace_id": trace_id_var.get(),
+        "span_id": _new_id(8),
+        "parent_id": _span_var.get(),
+        "name": name,
+        "start": time.time(),
+        "attrs": attrs,
+    }
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Спан внутри текущей трассы; вне трассы ничего не делает."""
+    if trace_id_var.get() is None:
+        yield None
+        return
+    record = _start(name, attrs)
+    token = _span_var.set(record["span_id"])
+    started = time.perf_counter()
+    error = None
+    try:
+        yield record
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _span_var.reset(token)
+        _finish(record, started, error)
+
+
+@contextmanager
+def trace(name: str, **attrs):
+    """Корневой спан: новый trace_id, по выходе трасса экспортируется целиком."""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    spans: List[dict] = []
+    tokens = (trace_id_var.set(_new_id(16)), _spans_var.set(spans), _span_var.set(None))
+    try:
+        with span(name, **attrs) as record:
+            yield record
+    finally:
+        _span_var.reset(tokens[2])
+        _spans_var.reset(tokens[1])
+        trace_id_var.reset(tokens[0])
+        export(spans)
+
+
+def traced(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_module(namespace: Dict[str, Any], prefix: str) -> None:
+    """Оборачивает в спаны все публичные корутины, объявленные в модуле."""
+    if not TRACING_ENABLED:
+        return
+    module = namespace["__name__"]
+    for attr, value in list(namespace.items()):
+        if attr.startswith("_") or not inspect.iscoroutinefunction(value) or value.__module__ != module:
+            continue
+        namespace[attr] = traced(f"{prefix}.{attr}")(value)
+
+
+# Экспорт
+
+def export(spans: List[dict]) -> None:
+    if not spans:
+        return
+    try:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            for record in spans:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    except Exception as e:
+        logger.error(f"Ошибка записи трассы: {e}")
+    if TRACE_OTLP_URL:
+        try:
+            # Пустой контекст: сама отправка не должна попадать в трассы
+            asyncio.get_running_loop().create_task(_post_otlp(spans), context=contextvars.Context())
+        except RuntimeError:
+            pass
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: List[dict]) -> dict:
+    otlp_spans = []
+    for record in spans:
+        start_ns = int(record["start"] * 1e9)
+        otlp_span = {
+            "traceId": record["trace_id"],
+            "spanId": record["span_id"],
+            "name": record["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(start_ns),
+            "endTimeUnixNano": str(start_ns + int(record["duration_ms"] * 1e6)),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in record["attrs"].items()],
+            "status": {"code": 2, "message": record["error"]} if "error" in record else {"code": 1},
+        }
+        if record["parent_id"]:
+            otlp_span["parentSpanId"] = record["parent_id"]
+        otlp_spans.append(otlp_span)
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "vkcc-link-bot"}}]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": otlp_spans}],
+    }]}
+
+
+async def _post_otlp(spans: List[dict]) -> None:
+    import session as http
+    try:
+        async with http.session.post(TRACE_OTLP_URL, json=to_otlp(spans)) as resp:
+            if resp.status >= 300:
+                logger.error(f"Коллектор трасс ответил {resp.status}")
+    except Exception as e:
+        logger.error(f"Ошибка отправки трассы: {e}")
+
+
+# Точки подключения
+
+class TracingMiddleware:
+    """Outer-middleware апдейтов: корневой спан на каждый апдейт."""
+    async def __call__(self, handler, event, data):
+        with trace("update", update_id=event.update_id, type=event.event_type):
+            return await handler(event, data)
+
+
+class BotRequestMiddleware:
+    """Request-middleware сессии aiogram: спан на каждый вызов Bot API."""
+    async def __call__(self, make_request, bot, method):
+        with span(f"bot.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+def aiohttp_trace_config():
+    """TraceConfig для aiohttp.ClientSession: спан на каждый HTTP-запрос к VK."""
+    import aiohttp
+
+    async def on_request_start(session, ctx, params):
+        ctx.record = None
+        if trace_id_var.get() is not None:
+            ctx.record = _start(f"vk {params.url.path.rsplit('/', 1)[-1]}", {"http.method": params.method})
+            ctx.started = time.perf_counter()
+
+    async def on_request_end(session, ctx, params):
+        if ctx.record is not None:
+            ctx.record["attrs"]["http.status"] = params.response.status
+            _finish(ctx.record, ctx.started, None)
+
+    async def on_request_exception(session, ctx, params):
+        if ctx.record is not None:
+            _finish(ctx.record, ctx.started, params.exception)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
+
+
+def install_log_record_factory() -> None:
+    """Добавляет trace_id во все записи лога ("-" вне трассы)."""
+    factory = logging.getLogRecordFactory()
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        record.trace_id = trace_id_var.get() or "-"
+        return record
+
+    logging.setLogRecordFactory(record_factory)
@@ -1,6 +1,8 @@
+import heapq
 import re
 import logging
 from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 from aiogram.types import Message
 
 logging.basicConfig(level=logging.INFO)
@@ -12,18 +14,74 @@ async def safe_delete(message: Message):
     except Exception as e:
         logger.debug(f"Не удалось удалить сообщение: {e}")
 
+URL_PATTERN = re.compile(
+    r'^(?P<scheme>https?)://'
+    r'(?P<host>(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}|'  # домен
+    r'localhost|'
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IPv4
+    r'(?::(?P<port>\d+))?(?P<rest>/[-a-zA-Z0-9@:%_\+.~#?&//=]*)?$'
+)
+
 def is_valid_url(url: str) -> bool:
-    url = url.strip()
-    if not url:
-        return False
-    pattern = re.compile(
-        r'^https?://'
-        r'(?:(?:[a-zA-Z0-9](?:[a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}|'  # домен
-        r'localhost|'
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # IPv4
-        r'(?::\d+)?(?:/[-a-zA-Z0-9@:%_\+.~#?&//=]*)?$'
-    )
-    return bool(pattern.match(url))
+    return URL_PATTERN.match(url.strip()) is not None
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Параметры без символов, которые urlencode экранирует: их можно отсортировать без разбора
+_PLAIN_QUERY = re.compile(r"[A-Za-z0-9_.~-]*(?:=[A-Za-z0-9_.~-]*)?(?:&[A-Za-z0-9_.~-]*(?:=[A-Za-z0-9_.~-]*)?)*")
+
+def _canonical_query(query: str) -> str:
+    if _PLAIN_QUERY.fullmatch(query):
+        pairs = sorted(segment.partition("=")[::2] for segment in query.split("&") if segment)
+        return "&".join(map("=".join, pairs))
+    return urlencode(sorted(parse_qsl(query, keep_blank_values=True)))
+
+def canonicalize_url(url: str) -> str:
+    """
+    Канонический вид URL для общего кэша сокращений: схема и хост в нижнем регистре,
+    без порта по умолчанию, без завершающего слэша (кроме корня), параметры запроса
+    отсортированы.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host if port is None or port == DEFAULT_PORTS.get(scheme) else f"{host}:{port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        netloc = f"{userinfo}@{netloc}"
+    path = parts.path.rstrip("/") or "/"
+    query = _canonical_query(parts.query) if parts.query else ""
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+def canonicalize_match(match: re.Match) -> str:
+    """
+    canonicalize_url для адреса, уже совпавшего с URL_PATTERN: части берутся из групп
+    совпадения, без повторного разбора urlsplit. Результат тот же.
+    """
+    scheme, host, port, rest = match.group("scheme", "host", "port", "rest")
+    # Частый случай — адрес уже канонический: хост в нижнем регистре, без порта,
+    # параметров и якоря, путь без завершающего слэша
+    if (port is None and rest and rest[-1] != "/" and "?" not in rest and "#" not in rest
+            and host.islower()):
+        return match.group()
+    netloc = host.lower()
+    if port is not None and int(port) <= 65535 and int(port) != DEFAULT_PORTS[scheme]:
+        netloc = f"{netloc}:{int(port)}"
+    path, _, fragment = (rest or "").partition("#")
+    path, _, query = path.partition("?")
+    path = path.rstrip("/") or "/"
+    url = f"{scheme}://{netloc}{path}"
+    if query:
+        query = _canonical_query(query)
+        if query:
+            url += "?" + query
+    if fragment:
+        url += "#" + fragment
+    return url
 
 def format_date(date_str: str) -> str:
     """
@@ -34,54 +92,97 @@ def format_date(date_str: str) -> str:
     except Exception:
         return date_str[:10]
 
-def format_link_stats(stats: dict, short_url: str) -> str:
-    if not stats or stats.get("views", 0) == 0:
+SEX_NAMES = {1: "мужчины", 2: "женщины", "male": "мужчины", "female": "женщины"}
+
+STATS_TOP_K = 3
+
+def _percent(views: int, total: int) -> float:
+    return round(views / total * 100, 1) if total else 0.0
+
+def _sex_age_rows(rows: list):
+    """
+    Строки sex_age бывают двух видов: {"sex", "age_range", "views"} и
+    {"age_range", "male", "female"}; приводим к (sex, age_range, views).
+    """
+    for row in rows:
+        age = row.get("age_range", "?")
+        if "views" in row:
+            yield row.get("sex"), age, row.get("views", 0)
+        else:
+            for sex in ("male", "female"):
+                if row.get(sex):
+                    yield sex, age, row[sex]
+
+def summarize_stats(stats: dict) -> dict:
+    """
+    Компактная сводка для отображения: топ-3 групп/стран/городов с процентами
+    и итоги по полу и возрасту. Считается один раз при сохранении статистики,
+    чтобы показ карточки был только сборкой строки.
+    """
+    total = stats.get("views", 0) if stats else 0
+    summary = {"views": total}
+    if not total:
+        return summary
+
+    if "sex_age" in stats:
+        by_sex, by_age, groups = {}, {}, []
+        for sex, age, views in _sex_age_rows(stats["sex_age"]):
+            sex_name = SEX_NAMES.get(sex, "неизвестно")
+            by_sex[sex_name] = by_sex.get(sex_name, 0) + views
+            by_age[age] = by_age.get(age, 0) + views
+            groups.append((views, sex_name, age))
+        summary["sex_age"] = [
+            [sex_name, age, views, _percent(views, total)]
+            for views, sex_name, age in heapq.nlargest(STATS_TOP_K, groups, key=lambda g: g[0])
+        ]
+        summary["by_sex"] = {name: [views, _percent(views, total)] for name, views in by_sex.items()}
+        summary["by_age"] = {age: [views, _percent(views, total)] for age, views in sorted(by_age.items())}
+
+    for key, id_field in (("countries", "country_id"), ("cities", "city_id")):
+        if key in stats:
+            top = heapq.nlargest(STATS_TOP_K, stats[key], key=lambda x: x.get("views", 0))
+            summary[key] = [
+                [item.get(id_field), item.get("views", 0), _percent(item.get("views", 0), total)]
+                for item in top
+            ]
+    return summary
+
+def format_link_stats(summary: dict, short_url: str, names: dict | None = None) -> str:
+    """
+    Собирает текст статистики из сводки summarize_stats.
+    names — {"countries": {id: название}, "cities": {...}} из geo.resolve_summary.
+    """
+    names = names or {}
+    country_names = names.get("countries", {})
+    city_names = names.get("cities", {})
+    if not summary or summary.get("views", 0) == 0:
         return f"📉 Статистика по <b>{short_url}</b> отсутствует. Ожидайте переходы."
 
-    total_views = stats.get("views", 1)
     response = [f"<b>📊 Статистика по {short_url}</b>",
-                f"<b>Всего переходов:</b> {total_views}\n"]
+                f"<b>Всего переходов:</b> {summary['views']}\n"]
 
     # Пол и возраст
-    if "sex_age" in stats:
+    if "sex_age" in summary:
         response.append("<b>👥 Топ-3 возрастные группы:</b>")
-        sex_map = {1: "мужчины", 2: "женщины"}
-        top_groups = sorted(stats["sex_age"], key=lambda x: x.get("views", 0), reverse=True)[:3]
-        for group in top_groups:
-            age = group.get("age_range", "?")
-            sex = sex_map.get(group.get("sex"), "неизвестно")
-            views = group.get("views", 0)
-            percent = views / total_views * 100 if total_views else 0
+        for sex, age, views, percent in summary["sex_age"]:
             response.append(f"– {sex}, {age}: {views} ({percent:.1f}%)")
+        if summary.get("by_sex"):
+            response.append("<b>Пол:</b> " + ", ".join(
+                f"{sex} {percent:.1f}%" for sex, (_, percent) in summary["by_sex"].items()
+            ))
 
     # Страны
-    if "countries" in stats:
-        country_map = {
-            1: "Россия", 2: "Украина", 3: "Беларусь", 4: "Казахстан", 5: "Германия",
-            7: "Финляндия", 10: "США", 13: "Франция", 14: "Италия", 17: "Испания"
-        }
-        top_countries = sorted(stats["countries"], key=lambda x: x["views"], reverse=True)[:3]
+    if "countries" in summary:
         response.append("\n<b>🌍 Страны:</b>")
-        for c in top_countries:
-            cid = c.get("country_id")
-            views = c.get("views", 0)
-            name = country_map.get(cid, f"ID {cid}")
-            percent = views / total_views * 100 if total_views else 0
+        for cid, views, percent in summary["countries"]:
+            name = country_names.get(cid, f"ID {cid}")
             response.append(f"– {name}: {views} ({percent:.1f}%)")
 
     # Города
-    if "cities" in stats:
-        city_map = {
-            1: "Москва", 2: "Санкт-Петербург", 99: "Уфа", 56: "Казань",
-            3: "Новосибирск", 4: "Екатеринбург", 66: "Нижний Новгород"
-        }
-        top_cities = sorted(stats["cities"], key=lambda x: x["views"], reverse=True)[:3]
+    if "cities" in summary:
         response.append("\n<b>🏙️ Города:</b>")
-        for c in top_cities:
-            cid = c.get("city_id")
-            views = c.get("views", 0)
-            name = city_map.get(cid, f"ID {cid}")
-            percent = views / total_views * 100 if total_views else 0
+        for cid, views, percent in summary["cities"]:
+            name = city_names.get(cid, f"ID {cid}")
             response.append(f"– {name}: {views} ({percent:.1f}%)")
 
     return "\n".join(response)
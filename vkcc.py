@@ -1,11 +1,29 @@
+import asyncio
+import json
 import logging
-from typing import TypedDict
+from typing import Dict, List, TypedDict
 
-from session import session
-from config import VK_TOKEN
+import aiohttp
 
-VK_API_BASE = "https://api.vk.com/method/"
+import session as http
+from config import (
+    VK_TOKEN,
+    VK_API_URL,
+    VK_CONCURRENCY_INITIAL,
+    VK_CONCURRENCY_MIN,
+    VK_CONCURRENCY_MAX,
+    VK_REQUEST_TIMEOUT,
+    VK_FLOOD_RETRIES,
+)
+from ratelimit import AdaptiveLimiter
+
+VK_API_BASE = VK_API_URL
 VK_API_VERSION = "5.199"
+VK_EXECUTE_MAX_CALLS = 25  # лимит вызовов API внутри одного execute
+VK_FLOOD_ERRORS = {6, 9}   # Too many requests per second, Flood control
+
+# Все исходящие запросы к VK проходят через один адаптивный предел параллельности
+vk_limiter = AdaptiveLimiter(VK_CONCURRENCY_INITIAL, VK_CONCURRENCY_MIN, VK_CONCURRENCY_MAX)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -18,6 +36,39 @@ class FullLinkStats(TypedDict, total=False):
     cities: list
     message: str
 
+async def _request(method: str, params: dict, post: bool = False) -> dict:
+    """
+    Запрос к VK через vk_limiter. Ошибки флуда и таймауты снижают предел;
+    после ошибки флуда запрос повторяется до VK_FLOOD_RETRIES раз.
+    """
+    url = f"{VK_API_BASE}{method}"
+    timeout = aiohttp.ClientTimeout(total=VK_REQUEST_TIMEOUT)
+    for attempt in range(VK_FLOOD_RETRIES + 1):
+        started = await vk_limiter.acquire()
+        outcome = "error"
+        try:
+            if post:
+                request = http.session.post(url, data=params, timeout=timeout)
+            else:
+                request = http.session.get(url, params=params, timeout=timeout)
+            async with request as resp:
+                if resp.status != 200:
+                    if resp.status == 429 or resp.status >= 500:
+                        outcome = "drop"
+                    raise ValueError(f"VK API вернул статус {resp.status}")
+                data = await resp.json()
+            error = data.get("error") if isinstance(data, dict) else None
+            outcome = "drop" if error and error.get("error_code") in VK_FLOOD_ERRORS else "ok"
+        except asyncio.TimeoutError:
+            outcome = "drop"
+            raise ValueError(f"VK API не ответил за {VK_REQUEST_TIMEOUT:g} с")
+        finally:
+            vk_limiter.release(started, outcome)
+        if outcome == "drop" and attempt < VK_FLOOD_RETRIES:
+            logger.warning(f"VK ограничивает частоту ({method}), предел снижен до {vk_limiter.limit:.1f}")
+            continue
+        return data
+
 async def shorten_link(long_url: str, vk_token: str) -> str:
     params = {
         "url": long_url,
@@ -25,18 +76,15 @@ async def shorten_link(long_url: str, vk_token: str) -> str:
         "v": VK_API_VERSION
     }
     try:
-        async with session.get(f"{VK_API_BASE}utils.getShortLink", params=params) as resp:
-            if resp.status != 200:
-                raise ValueError(f"VK API вернул статус {resp.status}")
-            data = await resp.json()
-            if "error" in data:
-                error_msg = data["error"].get("error_msg", "Неизвестная ошибка")
-                raise ValueError(f"VK API ошибка: {error_msg}")
-            short_url = data.get("response", {}).get("short_url")
-            if short_url:
-                logger.info(f"Сократил ссылку: {long_url} -> {short_url}")
-                return short_url
-            raise ValueError("VK API не вернул short_url")
+        data = await _request("utils.getShortLink", params)
+        if "error" in data:
+            error_msg = data["error"].get("error_msg", "Неизвестная ошибка")
+            raise ValueError(f"VK API ошибка: {error_msg}")
+        short_url = data.get("response", {}).get("short_url")
+        if short_url:
+            logger.info(f"Сократил ссылку: {long_url} -> {short_url}")
+            return short_url
+        raise ValueError("VK API не вернул short_url")
     except Exception as e:
         logger.error(f"Ошибка при сокращении ссылки: {e}")
         raise ValueError(f"Сетевая ошибка: {e}")
@@ -50,26 +98,93 @@ async def get_link_stats(vk_key: str, vk_token: str) -> FullLinkStats:
         "interval": "forever"
     }
     try:
-        async with session.get(f"{VK_API_BASE}utils.getLinkStats", params=params) as resp:
-            if resp.status != 200:
-                raise ValueError(f"VK API вернул статус {resp.status}")
-            data = await resp.json()
+        data = await _request("utils.getLinkStats", params)
+        if "error" in data:
+            error_msg = data["error"].get("error_msg", "Неизвестная ошибка")
+            raise ValueError(f"VK API ошибка: {error_msg}")
+
+        return _parse_link_stats(data.get("response", {}))
+
+    except Exception as e:
+        logger.error(f"Ошибка при получении статистики: {e}")
+        raise ValueError(f"Сетевая ошибка: {e}")
+
+def _parse_link_stats(response_data: dict) -> FullLinkStats:
+    if not response_data or "views" not in response_data:
+        return {"views": 0, "message": "Нет данных по этой ссылке"}
+    return {
+        "views": response_data.get("views", 0),
+        "stats": response_data.get("stats", []),
+        "sex_age": response_data.get("sex_age", []),
+        "countries": response_data.get("countries", []),
+        "cities": response_data.get("cities", [])
+    }
+
+async def get_links_stats_batch(vk_keys: List[str], vk_token: str) -> Dict[str, FullLinkStats]:
+    """
+    Статистика сразу по нескольким ссылкам: до 25 ключей за один запрос execute.
+    Ключи, по которым VK вернул ошибку, в результат не попадают.
+    """
+    result: Dict[str, FullLinkStats] = {}
+    for start in range(0, len(vk_keys), VK_EXECUTE_MAX_CALLS):
+        chunk = vk_keys[start:start + VK_EXECUTE_MAX_CALLS]
+        calls = ",".join(
+            f'API.utils.getLinkStats({{"key": {json.dumps(key)}, "extended": 1, "interval": "forever"}})'
+            for key in chunk
+        )
+        params = {
+            "code": f"return [{calls}];",
+            "access_token": vk_token,
+            "v": VK_API_VERSION
+        }
+        try:
+            data = await _request("execute", params, post=True)
             if "error" in data:
                 error_msg = data["error"].get("error_msg", "Неизвестная ошибка")
                 raise ValueError(f"VK API ошибка: {error_msg}")
+            if data.get("execute_errors"):
+                logger.warning(f"Ошибки внутри execute: {data['execute_errors']}")
+            for key, response_data in zip(chunk, data.get("response") or []):
+                if response_data is not False:
+                    result[key] = _parse_link_stats(response_data)
+        except Exception as e:
+            logger.error(f"Ошибка при пакетном получении статистики: {e}")
+            raise ValueError(f"Сетевая ошибка: {e}")
+    return result
 
-            response_data = data.get("response", {})
-            if "views" not in response_data:
-                return {"views": 0, "message": "Нет данных по этой ссылке"}
-
-            return {
-                "views": response_data.get("views", 0),
-                "stats": response_data.get("stats", []),
-                "sex_age": response_data.get("sex_age", []),
-                "countries": response_data.get("countries", []),
-                "cities": response_data.get("cities", [])
-            }
 
+async def _call(method: str, params: dict, vk_token: str):
+    params = {**params, "access_token": vk_token, "v": VK_API_VERSION}
+    try:
+        data = await _request(method, params, post=True)
+        if "error" in data:
+            error_msg = data["error"].get("error_msg", "Неизвестная ошибка")
+            raise ValueError(f"VK API ошибка: {error_msg}")
+        return data.get("response")
     except Exception as e:
-        logger.error(f"Ошибка при получении статистики: {e}")
+        logger.error(f"Ошибка при вызове {method}: {e}")
         raise ValueError(f"Сетевая ошибка: {e}")
+
+VK_DATABASE_MAX_IDS = 1000  # лимит ID в database.getCountriesById / getCitiesById
+
+async def _names_by_id(method: str, ids_param: str, ids: List[int], vk_token: str) -> Dict[int, str]:
+    names = {}
+    for start in range(0, len(ids), VK_DATABASE_MAX_IDS):
+        chunk = ids[start:start + VK_DATABASE_MAX_IDS]
+        response = await _call(method, {ids_param: ",".join(map(str, chunk))}, vk_token) or []
+        names.update({item["id"]: item["title"] for item in response if item.get("title")})
+    return names
+
+async def get_countries_by_id(country_ids: List[int], vk_token: str) -> Dict[int, str]:
+    return await _names_by_id("database.getCountriesById", "country_ids", country_ids, vk_token)
+
+async def get_cities_by_id(city_ids: List[int], vk_token: str) -> Dict[int, str]:
+    return await _names_by_id("database.getCitiesById", "city_ids", city_ids, vk_token)
+
+async def get_all_countries(vk_token: str) -> Dict[int, str]:
+    response = await _call("database.getCountries", {"need_all": 1, "count": 1000}, vk_token) or {}
+    return {item["id"]: item["title"] for item in response.get("items", [])}
+
+async def get_major_cities(country_id: int, vk_token: str) -> Dict[int, str]:
+    response = await _call("database.getCities", {"country_id": country_id, "count": 1000}, vk_token) or {}
+    return {item["id"]: item["title"] for item in response.get("items", [])}
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+class WriteResult(NamedTuple):
+    rowcount: int
+    lastrowid: Optional[int]
+
+
+class _PendingWrite(NamedTuple):
+    sql: str
+    params: Sequence[Any]
+    future: asyncio.Future
+
+
+class GroupCommitWriter:
+    """
+    Группирует записи из всех обработчиков в одну транзакцию.
+
+    Пакет сбрасывается, когда набралось max_batch операций или прошло
+    max_delay секунд с первой операции. Каждая операция выполняется в своём
+    SAVEPOINT, поэтому ошибка (например, IntegrityError) откатывает только её
+    и пробрасывается именно тому, кто её поставил. Результаты отдаются
+    вызывающим только после COMMIT.
+    """
+    def __init__(self, db_path: str, max_batch: int = 64, max_delay: float = 0.005):
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: "asyncio.Queue[_PendingWrite]" = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+        self._db: Optional[aiosqlite.Connection] = None
+        self.batches = 0
+        self.writes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self):
+        self._db = await aiosqlite.connect(self.db_path, isolation_level=None)
+        await self._db.execute("PRAGMA busy_timeout = 5000")
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"Групповая запись включена: до {self.max_batch} операций за {self.max_delay * 1000:.0f} мс")
+
+    async def stop(self):
+        if self._task:
+            # None в очереди — сигнал дописать уже поставленные операции и выйти
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        if self._db:
+            await self._db.close()
+            self._db = None
+        logger.info(f"Групповая запись остановлена: пакетов={self.batches}, операций={self.writes}")
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> WriteResult:
+        if not self.running:
+            raise RuntimeError("Групповая запись не запущена")
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(_PendingWrite(sql, params, future))
+        return await future
+
+    async def _collect(self) -> Tuple[List[_PendingWrite], bool]:
+        first = await self._queue.get()
+        if first is None:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                write = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if write is None:
+                return batch, True
+            batch.append(write)
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._flush(batch)
+
+    async def _flush(self, batch: List[_PendingWrite]):
+        outcomes: List[Tuple[_PendingWrite, Any, Optional[BaseException]]] = []
+        try:
+            await self._db.execute("BEGIN IMMEDIATE")
+            for write in batch:
+                await self._db.execute("SAVEPOINT op")
+                try:
+                    cursor = await self._db.execute(write.sql, write.params)
+                    await self._db.execute("RELEASE op")
+                    outcomes.append((write, WriteResult(cursor.rowcount, cursor.lastrowid), None))
+                except Exception as e:
+                    await self._db.execute("ROLLBACK TO op")
+                    await self._db.execute("RELEASE op")
+                    outcomes.append((write, None, e))
+            await self._db.execute("COMMIT")
+        except Exception as e:
+            logger.error(f"Ошибка групповой записи ({len(batch)} операций): {e}")
+            try:
+                await self._db.execute("ROLLBACK")
+            except Exception:
+                pass
+            for write in batch:
+                if not write.future.done():
+                    write.future.set_exception(e)
+            return
+        self.batches += 1
+        self.writes += len(batch)
+        for write, result, error in outcomes:
+            if write.future.done():
+                continue
+            if error is not None:
+                write.future.set_exception(error)
+            else:
+                write.future.set_result(result)